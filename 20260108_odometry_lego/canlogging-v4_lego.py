@@ -5,6 +5,20 @@ import time
 from datetime import datetime, timedelta
 
 import subprocess
+import sys
+
+# 共用模組位於上層目錄（部署到 RPI_Desktop 時則與本檔同目錄）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CanReceiver import BusSelector, frame_time, id_filters
+from OdometryJournal import CHECKPOINT, JOURNAL_FILE, TripJournal
+
+# 里程計算與記錄控制需要的 CAN ID：VCU state、左右後輪速、記錄控制指令
+ODOMETRY_IDS = [0x281, 0x193, 0x194, 0x420]
+# True: 只接收 ODOMETRY_IDS（kernel can_filters），CSV 也只會記錄這些訊息；
+# False: 接收並記錄所有訊息
+ODOMETRY_ONLY = False
+# RTD 中每隔幾秒把目前的行程里程寫入里程日誌（見 OdometryJournal）
+CHECKPOINT_INTERVAL = 5.0
 
 vcu_instruction = False
 vcu_state = 0x00  # 追蹤 VCU state
@@ -48,7 +62,7 @@ def estimate_distance_from_speeds(current_speed_kmh, previous_speed_kmh, time_de
 
 def read_cumulative_distance(base_dir):
     """
-    讀取累計里程
+    讀取舊版累計檔的累計里程（第一次建立里程日誌時匯入用）
     """
     cumulative_file = os.path.join(base_dir, "trip_distance_cumulative.csv")
     cumulative_distance = 0.0
@@ -70,7 +84,8 @@ def read_cumulative_distance(base_dir):
 
 def write_trip_log(base_dir, new_distance_km, cumulative_distance_km, duration_s, start_time, end_time, wheel_speed_events):
     """
-    將里程數據寫入 log 文件（單一累計文件）
+    將里程數據寫入 log 文件（單一累計文件，給人看的行程摘要）
+    累計里程以里程日誌為準；這裡先寫到暫存檔再 os.replace，寫到一半斷電不會留下殘缺的檔案
     
     Args:
         base_dir: 日誌目錄
@@ -82,9 +97,10 @@ def write_trip_log(base_dir, new_distance_km, cumulative_distance_km, duration_s
         wheel_speed_events: 輪速事件列表
     """
     cumulative_file = os.path.join(base_dir, "trip_distance_cumulative.csv")
+    temp_file = cumulative_file + ".tmp"
     
     try:
-        with open(cumulative_file, 'w', newline='', encoding='utf-8') as f:
+        with open(temp_file, 'w', newline='', encoding='utf-8') as f:
             writer = csv.writer(f)
             writer.writerow(["Trip Distance Cumulative Log"])
             writer.writerow(["Last Updated", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
@@ -110,6 +126,7 @@ def write_trip_log(base_dir, new_distance_km, cumulative_distance_km, duration_s
             
             for i, (left_speed, right_speed, time_offset) in enumerate(wheel_speed_events[:100]):
                 writer.writerow([f"{left_speed:.2f}", f"{right_speed:.2f}", f"{time_offset:.3f}"])
+        os.replace(temp_file, cumulative_file)
         
         print(f"Trip log updated: {cumulative_distance_km:.6f}km total")
         return True
@@ -179,20 +196,22 @@ def main():
     print("\n📡 初始化 CAN 接口...")
     
     # 優先使用虛擬 CAN 進行測試
+    channels = {0: 'vcan0', 1: 'vcan0'}
     bus0 = connect_can('vcan0')
     if bus0 is None:
         print("⚠️  vcan0 不可用，嘗試實際 CAN (can0)...")
+        channels[0] = 'can0'
         bus0 = connect_can('can0')
     
     bus1 = connect_can('vcan0')  # 虛擬 CAN 只有一個接口，所以 bus1 也用 vcan0
     if bus1 is None:
         print("⚠️  vcan0 不可用，嘗試實際 CAN (can1)...")
+        channels[1] = 'can1'
         bus1 = connect_can('can1')
     
-    # 如果沒有 can1，就用 bus0
+    # 如果沒有 can1，就只接收 bus0
     if bus1 is None:
         print("⚠️  使用 bus0 進行雙總線模擬...")
-        bus1 = bus0
     
     if bus0 is None:
         print("\n❌ 致命錯誤：沒有可用的 CAN 接口")
@@ -204,10 +223,23 @@ def main():
         return
     
     print("✅ CAN 接口準備就緒\n")
+
+    receiver = BusSelector({0: bus0})
+    if bus1 is not None:
+        receiver.add(1, bus1)
+    if ODOMETRY_ONLY:
+        receiver.subscribe(id_filters(ODOMETRY_IDS))
+        print(f"Kernel CAN filters installed: {', '.join(f'0x{can_id:03X}' for can_id in ODOMETRY_IDS)}")
     
-    # 讀取上次的累計里程
-    cumulative_distance_km = read_cumulative_distance(base_dir)
+    # 從里程日誌的最後一筆紀錄恢復累計里程（只讀檔尾）；第一次使用時從舊的累計檔匯入
+    journal_path = os.path.join(base_dir, JOURNAL_FILE)
+    initial_km = None if os.path.exists(journal_path) else read_cumulative_distance(base_dir)
+    journal = TripJournal(journal_path, initial_km=initial_km)
+    cumulative_distance_km = journal.cumulative_km
+    if journal.recovered is not None and journal.recovered.kind == CHECKPOINT:
+        print("Previous session stopped during RTD, recovered from its last checkpoint")
     print(f"Cumulative distance from previous records: {cumulative_distance_km:.6f}km")
+    last_checkpoint = 0.0
     
     recording = False
     recording_start_time = datetime.now()
@@ -225,233 +257,201 @@ def main():
     last_left_wheel_speed = 0.0
     last_right_wheel_speed = 0.0
     last_wheel_speed_time = None
+    current_left_speed = None
+    current_right_speed = None
     wheel_speed_events = []  # 記錄 (左輪速, 右輪速, 時間偏移)
     
-    connection_failed_count = 0
-    max_connection_failures = 3
+    last_reconnect = 0
     
     while True:
-        try:
-            # 從兩個 CAN bus 接收訊息
-            msg0 = bus0.recv(timeout=0.001) if bus0 else None  # 使用較短的 timeout
-            msg1 = bus1.recv(timeout=0.001) if bus1 else None
-            connection_failed_count = 0  # 重置失敗計數
-        except Exception as e:
-            connection_failed_count += 1
-            if connection_failed_count == 1:
-                print(f"⚠️  Error receiving CAN messages: {e}")
-            
-            # 如果連續失敗超過 3 次，嘗試重新連接到 vcan0
-            if connection_failed_count >= max_connection_failures:
-                print(f"❌ CAN 連接失敗 {connection_failed_count} 次，嘗試重新連接到 vcan0...")
-                bus0 = connect_can('vcan0')
-                bus1 = bus0  # vcan0 只有一個接口
-                connection_failed_count = 0
-                if bus0 is None:
-                    print("❌ 無法連接到任何 CAN 接口，5 秒後重試...")
-                    time.sleep(5)
-                    continue
-            
-            msg0 = None
-            msg1 = None
-            time.sleep(0.01)  # 短暫延遲避免 CPU 忙碌迴圈
-            continue
-        
-        # 檢查 VCU 指令和狀態 (從 can0)
-        if msg0 is not None and hasattr(msg0, 'arbitration_id') and msg0.arbitration_id == 0x281 and len(msg0.data) > 1:
-            vcu_instruction = msg0.data[0] & 0x20
-            global vcu_state
-            vcu_state = msg0.data[0]  # 完整的 VCU state
-            
-            # 檢查 RTD 狀態變化（VCU state = 0x20 表示 RUNNING）
-            is_running_now = (msg0.data[0] == 0x20)
-            
-            # RTD 開始：state 變為 0x20
-            if is_running_now and not rtd_active:
-                print("[RTD START] VCU state changed to RUNNING (0x20)")
-                rtd_active = True
-                rtd_start_time = datetime.now()
-                trip_distance_km = 0.0
-                last_left_wheel_speed = 0.0
-                last_right_wheel_speed = 0.0
-                last_wheel_speed_time = datetime.now()
-                wheel_speed_events = []
-            
-            # RTD 結束：state 從 0x20 變為其他
-            elif not is_running_now and rtd_active:
-                print("[RTD END] VCU state changed from RUNNING, saving trip log...")
-                rtd_active = False
-                rtd_end_time = datetime.now()
-                
-                # 計算行程時長
-                duration_s = (rtd_end_time - rtd_start_time).total_seconds() if rtd_start_time else 0
-                
-                # 累加到總里程
-                cumulative_distance_km += trip_distance_km
+        # 同時等待兩個 CAN bus，有資料時整批讀出
+        frames = receiver.poll(timeout=0.1)
+
+        # 讀取失敗的 bus 已被移除，每 5 秒嘗試重新連接
+        if receiver.failed and time.time() - last_reconnect >= 5:
+            last_reconnect = time.time()
+            for bus_num in list(receiver.failed):
+                print(f"❌ CAN{bus_num} 接收失敗，嘗試重新連接 {channels[bus_num]}...")
+                bus = connect_can(channels[bus_num])
+                if bus is not None:
+                    receiver.add(bus_num, bus)
+                    print(f"CAN{bus_num} connection restored")
+
+        for bus_num, msg in frames:
+            # frame 的接收時間（SocketCAN kernel 時間戳），行程與里程積分都以此為準
+            received_at = frame_time(msg)
+            received_time = datetime.fromtimestamp(received_at)
+
+            # 檢查 VCU 指令和狀態 (can0 / can1)
+            if msg.arbitration_id == 0x281 and len(msg.data) > 1:
+                vcu_instruction = msg.data[0] & 0x20
+                vcu_state = msg.data[0]  # 完整的 VCU state
                 
-                # 寫入 log 檔案（會覆蓋之前的內容）
-                if rtd_start_time:
-                    write_trip_log(base_dir, trip_distance_km, cumulative_distance_km, duration_s, rtd_start_time, rtd_end_time, 
-                                 wheel_speed_events)
+                # 檢查 RTD 狀態變化（VCU state = 0x20 表示 RUNNING）
+                is_running_now = (msg.data[0] == 0x20)
                 
-                print(f"Trip Summary: Distance={trip_distance_km:.6f}km, Cumulative={cumulative_distance_km:.6f}km, Duration={duration_s:.2f}s")
+                # RTD 開始：state 變為 0x20
+                if is_running_now and not rtd_active:
+                    print("[RTD START] VCU state changed to RUNNING (0x20)")
+                    rtd_active = True
+                    rtd_start_time = received_time
+                    last_checkpoint = time.monotonic()
+                    trip_distance_km = 0.0
+                    last_left_wheel_speed = 0.0
+                    last_right_wheel_speed = 0.0
+                    last_wheel_speed_time = received_time
+                    current_left_speed = None
+                    current_right_speed = None
+                    wheel_speed_events = []
                 
-                # 重置資料
-                trip_distance_km = 0.0
-                last_left_wheel_speed = 0.0
-                last_right_wheel_speed = 0.0
-                last_wheel_speed_time = None
-                wheel_speed_events = []
-        
-        # 也檢查 can1 的 VCU 指令
-        if msg1 is not None and hasattr(msg1, 'arbitration_id') and msg1.arbitration_id == 0x281 and len(msg1.data) > 1:
-            vcu_instruction = msg1.data[0] & 0x20
-            vcu_state = msg1.data[0]
-            
-            # 檢查 RTD 狀態變化
-            is_running_now = (msg1.data[0] == 0x20)
-            
-            if is_running_now and not rtd_active:
-                print("[RTD START] VCU state changed to RUNNING (0x20)")
-                rtd_active = True
-                rtd_start_time = datetime.now()
-                trip_distance_km = 0.0
-                last_left_wheel_speed = 0.0
-                last_right_wheel_speed = 0.0
-                last_wheel_speed_time = datetime.now()
-                wheel_speed_events = []
+                # RTD 結束：state 從 0x20 變為其他
+                elif not is_running_now and rtd_active:
+                    print("[RTD END] VCU state changed from RUNNING, saving trip log...")
+                    rtd_active = False
+                    rtd_end_time = received_time
+                    
+                    # 計算行程時長
+                    duration_s = (rtd_end_time - rtd_start_time).total_seconds() if rtd_start_time else 0
+                    
+                    # 累加到總里程（寫入里程日誌並 fsync）
+                    try:
+                        cumulative_distance_km = journal.end_trip(trip_distance_km, duration_s, received_at)
+                    except OSError as e:
+                        print(f"Failed to write odometry journal: {e}")
+                        cumulative_distance_km += trip_distance_km
+                    
+                    # 寫入行程摘要（會覆蓋之前的內容）
+                    if rtd_start_time:
+                        write_trip_log(base_dir, trip_distance_km, cumulative_distance_km, duration_s, rtd_start_time, rtd_end_time, 
+                                     wheel_speed_events)
+                    
+                    print(f"Trip Summary: Distance={trip_distance_km:.6f}km, Cumulative={cumulative_distance_km:.6f}km, Duration={duration_s:.2f}s")
+                    for filter_bus, stats in receiver.filter_stats().items():
+                        hits = ", ".join(f"{f['can_id']}={f['hits']}" for f in stats['filters'])
+                        print(f"CAN{filter_bus} filter hits: {hits}, unmatched={stats['unmatched']}")
+                    
+                    # 重置資料
+                    trip_distance_km = 0.0
+                    last_left_wheel_speed = 0.0
+                    last_right_wheel_speed = 0.0
+                    last_wheel_speed_time = None
+                    wheel_speed_events = []
             
-            elif not is_running_now and rtd_active:
-                print("[RTD END] VCU state changed from RUNNING, saving trip log...")
-                rtd_active = False
-                rtd_end_time = datetime.now()
-                
-                duration_s = (rtd_end_time - rtd_start_time).total_seconds() if rtd_start_time else 0
-                
-                cumulative_distance_km += trip_distance_km
-                
-                if rtd_start_time:
-                    write_trip_log(base_dir, trip_distance_km, cumulative_distance_km, duration_s, rtd_start_time, rtd_end_time, 
-                                 wheel_speed_events)
+            # 當 RTD 活躍時，收集輪速數據並計算里程
+            if rtd_active:
+                # 收集左後輪速 (0x193, byte 4-5) / 右後輪速 (0x194, byte 4-5)
+                if msg.arbitration_id == 0x193 and len(msg.data) >= 5:
+                    current_left_speed = calculate_wheel_speed(msg.data[4], msg.data[5] if len(msg.data) > 5 else 0)
+                elif msg.arbitration_id == 0x194 and len(msg.data) >= 5:
+                    current_right_speed = calculate_wheel_speed(msg.data[4], msg.data[5] if len(msg.data) > 5 else 0)
                 
-                print(f"Trip Summary: Distance={trip_distance_km:.6f}km, Cumulative={cumulative_distance_km:.6f}km, Duration={duration_s:.2f}s")
-                
-                trip_distance_km = 0.0
-                last_left_wheel_speed = 0.0
-                last_right_wheel_speed = 0.0
-                last_wheel_speed_time = None
-                wheel_speed_events = []
-        
-        # 當 RTD 活躍時，收集輪速數據並計算里程
-        if rtd_active:
-            current_time = datetime.now()
-            current_left_speed = None
-            current_right_speed = None
-            
-            # 收集左後輪速 (0x193, byte 4-5)
-            if msg0 is not None and hasattr(msg0, 'arbitration_id') and msg0.arbitration_id == 0x193 and len(msg0.data) >= 5:
-                current_left_speed = calculate_wheel_speed(msg0.data[4], msg0.data[5] if len(msg0.data) > 5 else 0)
-            
-            if msg1 is not None and hasattr(msg1, 'arbitration_id') and msg1.arbitration_id == 0x193 and len(msg1.data) >= 5:
-                current_left_speed = calculate_wheel_speed(msg1.data[4], msg1.data[5] if len(msg1.data) > 5 else 0)
-            
-            # 收集右後輪速 (0x194, byte 4-5)
-            if msg0 is not None and hasattr(msg0, 'arbitration_id') and msg0.arbitration_id == 0x194 and len(msg0.data) >= 5:
-                current_right_speed = calculate_wheel_speed(msg0.data[4], msg0.data[5] if len(msg0.data) > 5 else 0)
-            
-            if msg1 is not None and hasattr(msg1, 'arbitration_id') and msg1.arbitration_id == 0x194 and len(msg1.data) >= 5:
-                current_right_speed = calculate_wheel_speed(msg1.data[4], msg1.data[5] if len(msg1.data) > 5 else 0)
-            
-            # 使用梯形積分計算里程
-            if current_left_speed is not None and current_right_speed is not None:
-                if last_wheel_speed_time is not None:
-                    time_delta = (current_time - last_wheel_speed_time).total_seconds()
+                # 左右輪速都更新後，使用梯形積分計算里程
+                if current_left_speed is not None and current_right_speed is not None:
+                    current_time = received_time
+                    if last_wheel_speed_time is not None:
+                        time_delta = (current_time - last_wheel_speed_time).total_seconds()
+                        
+                        if time_delta > 0:  # 避免除以零
+                            # 左輪里程
+                            left_distance = estimate_distance_from_speeds(current_left_speed, last_left_wheel_speed, time_delta)
+                            # 右輪里程
+                            right_distance = estimate_distance_from_speeds(current_right_speed, last_right_wheel_speed, time_delta)
+                            # 平均里程
+                            avg_distance = (left_distance + right_distance) / 2
+                            trip_distance_km += avg_distance
                     
-                    if time_delta > 0:  # 避免除以零
-                        # 左輪里程
-                        left_distance = estimate_distance_from_speeds(current_left_speed, last_left_wheel_speed, time_delta)
-                        # 右輪里程
-                        right_distance = estimate_distance_from_speeds(current_right_speed, last_right_wheel_speed, time_delta)
-                        # 平均里程
-                        avg_distance = (left_distance + right_distance) / 2
-                        trip_distance_km += avg_distance
-                
-                # 記錄事件
-                time_offset = (current_time - rtd_start_time).total_seconds()
-                wheel_speed_events.append((current_left_speed, current_right_speed, time_offset))
-                
-                # 更新上一次速度
-                last_left_wheel_speed = current_left_speed
-                last_right_wheel_speed = current_right_speed
-                last_wheel_speed_time = current_time
-
-        vcu_running = check_vcu_running()
-        # VCU 狀態 edge: False -> True，強制新開檔記錄
-        if vcu_running and not vcu_last:
-            print("VCU狀態由False變True，強制新開檔記錄！")
-            if file:
-                file.close()
-            recording_start_time = datetime.now()
-            file, writer = new_csv_writer(base_dir, "can_log_vcu")
-            rotate_at = recording_start_time + timedelta(minutes=20)
-            recording = True
-            print(f"Recording started at {recording_start_time}")
-        # VCU 狀態 edge: True -> False，自動關閉記錄
-        elif not vcu_running and vcu_last:
-            print("VCU狀態由True變False，自動關閉記錄！")
-            if recording and file:
-                file.close()
-                file = None
-                writer = None
-            recording = False
-            recording_start_time = None
-            print(f"Recording stopped at {datetime.now()}")
-            print("Waiting for VCU or manual start...")
-        vcu_last = vcu_running
+                    # 記錄事件
+                    time_offset = (current_time - rtd_start_time).total_seconds()
+                    wheel_speed_events.append((current_left_speed, current_right_speed, time_offset))
+                    
+                    # 更新上一次速度
+                    last_left_wheel_speed = current_left_speed
+                    last_right_wheel_speed = current_right_speed
+                    last_wheel_speed_time = current_time
+                    current_left_speed = None
+                    current_right_speed = None
 
-        # VCU True: 只能自動記錄，不能被0x420打斷
-        if vcu_running:
-            if not recording:
-                print("VCU running, auto start recording!")
+            vcu_running = check_vcu_running()
+            # VCU 狀態 edge: False -> True，強制新開檔記錄
+            if vcu_running and not vcu_last:
+                print("VCU狀態由False變True，強制新開檔記錄！")
+                if file:
+                    file.close()
                 recording_start_time = datetime.now()
-                file, writer = new_csv_writer(base_dir, "can_log")
+                file, writer = new_csv_writer(base_dir, "can_log_vcu")
                 rotate_at = recording_start_time + timedelta(minutes=20)
                 recording = True
                 print(f"Recording started at {recording_start_time}")
-        else:
-            # VCU False: 0x420可控制記錄 (檢查兩個 CAN bus)
-            for msg in [msg0, msg1]:
-                if msg is not None and hasattr(msg, 'arbitration_id') and msg.arbitration_id == 0x420:
-                    data_bytes = list(msg.data)
-                    if len(data_bytes) > 0:
-                        first_byte = data_bytes[0]
-                        if first_byte == 0x01:
-                            if not recording:
-                                print("Start recording command received!")
-                                recording_start_time = datetime.now()
-                                file, writer = new_csv_writer(base_dir, "can_log")
-                                rotate_at = recording_start_time + timedelta(minutes=20)
-                                recording = True
-                                print(f"Recording started at {recording_start_time}")
-                            else:
-                                print("Already recording, ignoring start command")
-                        elif first_byte == 0x02:
-                            if recording:
-                                print("Stop recording command received!")
-                                if file:
-                                    file.close()
-                                    file = None
-                                    writer = None
-                                recording = False
-                                recording_start_time = None
-                                print(f"Recording stopped at {datetime.now()}")
-                                print("Waiting for next start command...")
-                            else:
-                                print("Not recording, ignoring stop command")
-                    break  # 只處理一次控制指令
+            # VCU 狀態 edge: True -> False，自動關閉記錄
+            elif not vcu_running and vcu_last:
+                print("VCU狀態由True變False，自動關閉記錄！")
+                if recording and file:
+                    file.close()
+                    file = None
+                    writer = None
+                recording = False
+                recording_start_time = None
+                print(f"Recording stopped at {datetime.now()}")
+                print("Waiting for VCU or manual start...")
+            vcu_last = vcu_running
+
+            # VCU True: 只能自動記錄，不能被0x420打斷
+            if vcu_running:
+                if not recording:
+                    print("VCU running, auto start recording!")
+                    recording_start_time = datetime.now()
+                    file, writer = new_csv_writer(base_dir, "can_log")
+                    rotate_at = recording_start_time + timedelta(minutes=20)
+                    recording = True
+                    print(f"Recording started at {recording_start_time}")
+            elif msg.arbitration_id == 0x420 and len(msg.data) > 0:
+                # VCU False: 0x420可控制記錄 (兩個 CAN bus 皆可)
+                first_byte = msg.data[0]
+                if first_byte == 0x01:
+                    if not recording:
+                        print("Start recording command received!")
+                        recording_start_time = datetime.now()
+                        file, writer = new_csv_writer(base_dir, "can_log")
+                        rotate_at = recording_start_time + timedelta(minutes=20)
+                        recording = True
+                        print(f"Recording started at {recording_start_time}")
+                    else:
+                        print("Already recording, ignoring start command")
+                elif first_byte == 0x02:
+                    if recording:
+                        print("Stop recording command received!")
+                        if file:
+                            file.close()
+                            file = None
+                            writer = None
+                        recording = False
+                        recording_start_time = None
+                        print(f"Recording stopped at {datetime.now()}")
+                        print("Waiting for next start command...")
+                    else:
+                        print("Not recording, ignoring stop command")
+
+            # 記錄訊息
+            if recording and writer:
+                try:
+                    timestamp = int(received_at * 1000000)
+                    can_id = f"{msg.arbitration_id:08X}"
+                    extended = 'true' if msg.is_extended_id else 'false'
+                    direction = 'Rx' if not msg.is_remote_frame else 'Tx'
+                    dlc = msg.dlc
+                    data_bytes = [f"{byte:02X}" for byte in msg.data]
+                    data_bytes += ['00'] * (8 - len(data_bytes))
+                    writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
+                except Exception as e:
+                    print(f"Unexpected error: {e}")
+                    if file:
+                        file.close()
+                    file = None
+                    writer = None
+                    recording = False
+                    recording_start_time = None
 
         try:
-            # 2. 保留原本的 CAN 指令控制（已在主邏輯處理，這裡只處理寫檔與狀態訊息）
             current_time = time.time()
             if current_time - last_status_send >= 1.0:
                 try:
@@ -466,38 +466,22 @@ def main():
                             0x00, 0x00, 0x00
                         ])
                         status_msg = can.Message(arbitration_id=0x421, data=data, is_extended_id=False)
-                        bus0.send(status_msg)  # 從 can0 發送狀態
+                        receiver.get(0).send(status_msg)  # 從 can0 發送狀態
                     else:
                         data = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
                         status_msg = can.Message(arbitration_id=0x421, data=data, is_extended_id=False)
-                        bus0.send(status_msg)  # 從 can0 發送狀態
+                        receiver.get(0).send(status_msg)  # 從 can0 發送狀態
                     last_status_send = current_time
                 except Exception as e:
                     print(f"Failed to send status message: {e}")
 
-            # 記錄 can0 的訊息
-            if recording and writer and msg0 is not None and hasattr(msg0, 'arbitration_id'):
-                timestamp = int(time.time() * 1000000)
-                can_id = f"{msg0.arbitration_id:08X}"
-                extended = 'true' if msg0.is_extended_id else 'false'
-                direction = 'Rx' if not msg0.is_remote_frame else 'Tx'
-                bus_num = 0  # can0
-                dlc = msg0.dlc
-                data_bytes = [f"{byte:02X}" for byte in msg0.data]
-                data_bytes += ['00'] * (8 - len(data_bytes))
-                writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
-
-            # 記錄 can1 的訊息
-            if recording and writer and msg1 is not None and hasattr(msg1, 'arbitration_id'):
-                timestamp = int(time.time() * 1000000)
-                can_id = f"{msg1.arbitration_id:08X}"
-                extended = 'true' if msg1.is_extended_id else 'false'
-                direction = 'Rx' if not msg1.is_remote_frame else 'Tx'
-                bus_num = 1  # can1
-                dlc = msg1.dlc
-                data_bytes = [f"{byte:02X}" for byte in msg1.data]
-                data_bytes += ['00'] * (8 - len(data_bytes))
-                writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
+            # RTD 中定期寫入 checkpoint，斷電後從最後一筆恢復（只會遺失尚未 fsync 的部分）
+            if rtd_active and rtd_start_time and time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                last_checkpoint = time.monotonic()
+                try:
+                    journal.checkpoint(trip_distance_km, (datetime.now() - rtd_start_time).total_seconds())
+                except OSError as e:
+                    print(f"Failed to write odometry checkpoint: {e}")
 
             # 檢查是否需要輪換日誌檔案
             if recording and writer and datetime.now() >= rotate_at:
@@ -508,25 +492,6 @@ def main():
                 rotate_at = recording_start_time + timedelta(minutes=20)
                 print(f"New log file created at {recording_start_time}")
 
-        except can.CanError as e:
-            print(f"CAN Error: {e}")
-            if recording and file:
-                file.close()
-                file = None
-                writer = None
-                recording = False
-                recording_start_time = None
-            # 重新連接兩個 CAN bus
-            try:
-                bus0 = connect_can('can0')
-                print("CAN0 connection restored")
-            except:
-                print("Failed to restore CAN0")
-            try:
-                bus1 = connect_can('can1')
-                print("CAN1 connection restored")
-            except:
-                print("Failed to restore CAN1")
         except Exception as e:
             print(f"Unexpected error: {e}")
             if recording and file:
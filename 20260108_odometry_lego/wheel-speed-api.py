@@ -7,12 +7,38 @@ Provides REST API endpoints to access wheel speed data from CAN bus
 from flask import Flask, jsonify
 import json
 import os
+import sys
 from datetime import datetime
 import threading
 import time
 
+import can
+
+# Shared modules live in the parent directory (same directory once deployed)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CanReceiver import BusSelector, frame_time, id_filters
+from OdometryJournal import JOURNAL_FILE, read_last_record
+
 app = Flask(__name__)
 
+LOGS_DIR = "/home/pi/Desktop/RPI_Desktop/LOGS"
+CUMULATIVE_LOG = os.path.join(LOGS_DIR, "trip_distance_cumulative.csv")
+# Append-only odometry journal written by the logger (see OdometryJournal); preferred over CUMULATIVE_LOG
+CUMULATIVE_JOURNAL = os.path.join(LOGS_DIR, JOURNAL_FILE)
+# The odometry files are re-checked (stat) at most this often; requests in between are served from memory
+CUMULATIVE_CHECK_INTERVAL = 1.0
+
+CAN_CHANNELS = ['can0', 'can1']
+# Where wheel speed frames come from:
+#   "bus"     open can0 / can1 directly, with kernel filters for the IDs below
+#   "ingest"  subscribe to the same IDs from the CanIngest.py daemon (one process owns the bus)
+FRAME_SOURCE = "bus"
+LEFT_REAR_ID = 0x193
+RIGHT_REAR_ID = 0x194
+VCU_STATUS_ID = 0x281
+# Only these IDs reach Python; everything else is dropped by the kernel
+WHEEL_SPEED_FILTERS = id_filters([LEFT_REAR_ID, RIGHT_REAR_ID, VCU_STATUS_ID])
+
 # Global variables for wheel speed data
 wheel_speed_data = {
     "left_rear": 0.0,
@@ -22,11 +48,90 @@ wheel_speed_data = {
     "cumulative_distance": 0.0
 }
 data_lock = threading.Lock()
+receiver = None
+ingest_client = None
+
+def calculate_wheel_speed(data):
+    """Wheel speed in km/h from bytes 4-5 (little-endian, 0.01 km/h per bit)"""
+    return (((data[5] if len(data) > 5 else 0) << 8) | data[4]) * 0.01
+
+def handle_frame(msg):
+    """Update wheel_speed_data from one 0x193 / 0x194 / 0x281 frame"""
+    data = msg.data
+    with data_lock:
+        if msg.arbitration_id == VCU_STATUS_ID and len(data) > 0:
+            wheel_speed_data["rtd_active"] = data[0] == 0x20
+        elif msg.arbitration_id in (LEFT_REAR_ID, RIGHT_REAR_ID) and len(data) >= 5:
+            key = "left_rear" if msg.arbitration_id == LEFT_REAR_ID else "right_rear"
+            wheel_speed_data[key] = calculate_wheel_speed(data)
+            wheel_speed_data["timestamp"] = datetime.fromtimestamp(frame_time(msg)).isoformat()
+
+def can_reader():
+    """Background thread: keep wheel_speed_data updated from the CAN bus"""
+    if FRAME_SOURCE == "ingest":
+        ingest_reader()
+    else:
+        bus_reader()
 
-def load_cumulative_distance():
+def open_bus(channel):
+    """Single attempt to open a CAN channel; returns None on failure"""
+    try:
+        return can.interface.Bus(channel=channel, interface='socketcan')
+    except Exception as e:
+        print(f"Warning: could not open {channel}: {e}")
+        return None
+
+def bus_reader():
+    global receiver
+    receiver = BusSelector()
+    for bus_num, channel in enumerate(CAN_CHANNELS):
+        bus = open_bus(channel)
+        if bus is not None:
+            receiver.add(bus_num, bus)
+        else:
+            # Not available at startup: retried on the same path as a bus that goes down later
+            receiver.failed[bus_num] = None
+    if not receiver.buses:
+        print("No CAN interface available yet, retrying every 5 seconds")
+
+    receiver.subscribe(WHEEL_SPEED_FILTERS)
+    last_retry = 0
+    while True:
+        for _, msg in receiver.poll(timeout=1.0):
+            handle_frame(msg)
+        # Failed buses are retried every 5 seconds without blocking the healthy ones
+        if receiver.failed and time.time() - last_retry >= 5:
+            last_retry = time.time()
+            for bus_num in list(receiver.failed):
+                bus = open_bus(CAN_CHANNELS[bus_num])
+                if bus is not None:
+                    receiver.add(bus_num, bus)
+                    print(f"{CAN_CHANNELS[bus_num]} connection restored")
+
+def ingest_reader():
+    """Receive only the wheel speed IDs from the CAN ingest daemon, reconnecting when it restarts"""
+    global ingest_client
+    from CanIngest import FrameClient
+    while True:
+        try:
+            ingest_client = FrameClient(filters=WHEEL_SPEED_FILTERS)
+        except OSError as e:
+            print(f"CAN ingest daemon not reachable ({e}), retrying in 5 sec...")
+            time.sleep(5)
+            continue
+        print("Connected to CAN ingest daemon")
+        try:
+            while True:
+                for _, msg, _ in ingest_client.recv(timeout=1.0):
+                    handle_frame(msg)
+        except (ConnectionError, OSError) as e:
+            print(f"CAN ingest connection lost: {e}")
+        ingest_client.close()
+        ingest_client = None
+
+def load_cumulative_distance(log_file=CUMULATIVE_LOG):
     """Load cumulative distance from log file"""
     try:
-        log_file = "/home/pi/Desktop/RPI_Desktop/LOGS/trip_distance_cumulative.csv"
         if os.path.exists(log_file):
             with open(log_file, 'r', encoding='utf-8') as f:
                 lines = f.readlines()
@@ -43,6 +148,61 @@ def load_cumulative_distance():
         print(f"Error loading cumulative distance: {e}")
     return 0.0
 
+def file_signature(path):
+    """(mtime, size, inode) of path, or None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+class CumulativeDistanceCache:
+    """
+    Cumulative distance kept in memory
+
+    Read from the last record of the odometry journal (only the file tail, updated during
+    RTD by checkpoints), or from the legacy trip log when there is no journal yet. The files
+    are stat()ed at most once per check_interval and only re-read when their mtime, size or
+    inode changed, so polling clients never touch the disk.
+    """
+
+    def __init__(self, journal_file=CUMULATIVE_JOURNAL, log_file=CUMULATIVE_LOG,
+                 check_interval=CUMULATIVE_CHECK_INTERVAL):
+        self.journal_file = journal_file
+        self.log_file = log_file
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.value = 0.0
+        self.reloads = 0
+        self._signature = None
+        self._checked = None
+
+    def get(self):
+        now = time.monotonic()
+        with self.lock:
+            if self._checked is None or now - self._checked >= self.check_interval:
+                self._checked = now
+                signature = (file_signature(self.journal_file), file_signature(self.log_file))
+                if signature != self._signature:
+                    self._signature = signature
+                    self.value = self._load(signature)
+                    self.reloads += 1
+            return self.value
+
+    def _load(self, signature):
+        journal, log = signature
+        if journal is not None:
+            try:
+                record = read_last_record(self.journal_file)
+            except OSError as e:
+                print(f"Error reading odometry journal: {e}")
+                record = None
+            if record is not None:
+                return record.cumulative_km
+        return load_cumulative_distance(self.log_file) if log is not None else 0.0
+
+cumulative_distance = CumulativeDistanceCache()
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
@@ -67,8 +227,8 @@ def get_wheel_speed():
 @app.route('/api/odometry', methods=['GET'])
 def get_odometry():
     """Get odometry/cumulative distance data"""
-    cumulative = load_cumulative_distance()
-    
+    cumulative = cumulative_distance.get()
+
     return jsonify({
         "cumulative_distance_km": cumulative,
         "cumulative_distance_m": cumulative * 1000,
@@ -78,16 +238,15 @@ def get_odometry():
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get overall system status"""
+    cumulative = cumulative_distance.get()
     with data_lock:
-        cumulative = load_cumulative_distance()
-        
         return jsonify({
             "system_status": "running",
             "rtd_active": wheel_speed_data["rtd_active"],
             "left_rear_speed_kmh": wheel_speed_data["left_rear"],
             "right_rear_speed_kmh": wheel_speed_data["right_rear"],
             "cumulative_distance_km": cumulative,
-            "logs_directory": "/home/pi/Desktop/RPI_Desktop/LOGS",
+            "logs_directory": LOGS_DIR,
             "timestamp": datetime.now().isoformat()
         })
 
@@ -105,7 +264,25 @@ def get_config():
             "right_rear": "0x194"
         },
         "vcu_status_id": "0x281",
-        "logs_location": "/home/pi/Desktop/RPI_Desktop/LOGS"
+        "logs_location": LOGS_DIR
+    })
+
+@app.route('/api/filters', methods=['GET'])
+def get_filters():
+    """Get per-filter hit counters of the kernel CAN filters"""
+    if ingest_client is not None:
+        # Filters are applied by the ingest daemon; report what this client received
+        return jsonify({
+            "source": "ingest",
+            "filters": [f"0x{f['can_id']:03X}" for f in WHEEL_SPEED_FILTERS],
+            "frames": ingest_client.frames,
+            "timestamp": datetime.now().isoformat()
+        })
+    if receiver is None:
+        return jsonify({"error": "CAN receiver not running"}), 503
+    return jsonify({
+        "buses": {CAN_CHANNELS[bus_num]: stats for bus_num, stats in receiver.filter_stats().items()},
+        "timestamp": datetime.now().isoformat()
     })
 
 @app.errorhandler(404)
@@ -118,7 +295,8 @@ def not_found(error):
             "/api/wheel-speed",
             "/api/odometry",
             "/api/status",
-            "/api/config"
+            "/api/config",
+            "/api/filters"
         ]
     }), 404
 
@@ -138,6 +316,10 @@ if __name__ == '__main__':
     print("  GET /api/odometry      - Cumulative distance")
     print("  GET /api/status        - System status")
     print("  GET /api/config        - Configuration")
+    print("  GET /api/filters       - CAN filter hit counters")
+
+    # Receive wheel speeds from the CAN bus in the background
+    threading.Thread(target=can_reader, daemon=True).start()
     
     # Run Flask app
     app.run(
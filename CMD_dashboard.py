@@ -7,12 +7,15 @@ import threading
 import sys
 from datetime import datetime
 from CanDecoder import CanDecoder
+from CanIngest import REATTACH_INTERVAL, StateReader
 
 frequency = 1.0
 
 class CanReceiver:
-    def __init__(self, use_csv=False, csv_file='can_file.csv', csv_speed=1.0, display_mode='scroll'):
+    def __init__(self, use_csv=False, csv_file='can_file.csv', csv_speed=1.0, display_mode='scroll',
+                 use_ingest=False):
         self.use_csv = use_csv
+        self.use_ingest = use_ingest and not use_csv
         self.csv_file = csv_file
         self.csv_speed = csv_speed
         self.display_mode = display_mode
@@ -25,6 +28,9 @@ class CanReceiver:
             self.csv_start_time = None
             self.bus = None
             self.load_csv_file()
+        elif self.use_ingest:
+            # 不開 bus，讀取 CanIngest.py daemon 發布的狀態
+            self.bus = None
         else:
             try:
                 self.bus = can.interface.Bus(channel='can0', interface='socketcan')
@@ -34,13 +40,16 @@ class CanReceiver:
         
         # Initialize CAN decoder
         self.decoder = CanDecoder()
+        self.data_store = self.decoder.data_store
         self.message_count = 0
+        self.state_reader = None
+        self.last_attach = 0.0
         
         # Threading for CAN receiving
         self.can_thread = None
         self.display_thread = None
         
-        mode_str = "CSV Playback" if self.use_csv else "Real CAN"
+        mode_str = "CSV Playback" if self.use_csv else "CAN Ingest" if self.use_ingest else "Real CAN"
         if self.display_mode == 'dashboard':
             print(f"CAN Receiver Started - Dashboard Mode ({mode_str})")
         else:
@@ -101,6 +110,8 @@ class CanReceiver:
     def can_receive_callback(self):
         if self.use_csv:
             self.csv_receive_callback()
+        elif self.use_ingest:
+            self.ingest_receive_callback()
         else:
             self.real_can_receive_callback()
 
@@ -115,6 +126,28 @@ class CanReceiver:
         except Exception as e:
             pass  # 忽略timeout異常
 
+    def ingest_receive_callback(self):
+        """ingest 模式：daemon 有發布新的狀態時整份換上（不解碼）"""
+        if self.state_reader is not None and not self.state_reader.changed() and \
+                time.time() - self.last_attach >= REATTACH_INTERVAL:
+            # daemon 重新啟動後 segment 被重建，舊的 mapping 不會再更新：重新連上
+            self.last_attach = time.time()
+            if self.state_reader.replaced():
+                self.state_reader.close()
+                self.state_reader = None
+                self.last_attach = 0.0
+        if self.state_reader is None:
+            if time.time() - self.last_attach < REATTACH_INTERVAL:
+                return
+            self.last_attach = time.time()
+            try:
+                self.state_reader = StateReader()
+            except FileNotFoundError:
+                return
+        state = self.state_reader.read()
+        if state is not None:
+            self.data_store, self.message_count, _ = state
+
     def csv_receive_callback(self):
         """CSV 模式的接收回調函數"""
         if self.csv_index >= len(self.csv_data):
@@ -175,14 +208,14 @@ class CanReceiver:
         print("=" * 90)
         
         # Timestamp Section (show decoded time from 0x100)
-        timestamp = self.decoder.data_store['timestamp']
+        timestamp = self.data_store['timestamp']
         if timestamp['time'] is not None:
             time_str = timestamp['time'].strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
             print(f"[Data Time]    {time_str}")
         else:
             print(f"[Data Time]    N/A")
 
-        canlogging = self.decoder.data_store['canlogging']
+        canlogging = self.data_store['canlogging']
         if canlogging['is_recording']:
             start_time = canlogging['start_time'].strftime('%Y-%m-%d %H:%M:%S')
             elapsed_time = time.time() - canlogging['start_timestamp']
@@ -192,7 +225,7 @@ class CanReceiver:
         print("-" * 90)
         
         # VCU Section
-        vcu = self.decoder.data_store['vcu']
+        vcu = self.data_store['vcu']
         print(f"[VCU]          Steer: {self.format_value(vcu['steer'], '{:>6}'):>8} "
               f"Accel: {self.format_value(vcu['accel'], '{:>6}'):>8} "
               f"Brake: {self.format_value(vcu['brake'], '{:>6}'):>8}")
@@ -202,7 +235,7 @@ class CanReceiver:
               f"BSE2: {self.format_value(vcu['bse2'], '{:.2f}'):>8}")
         print("-" * 90)
         # IMU Section
-        # imu = self.decoder.data_store['imu']
+        # imu = self.data_store['imu']
         # print(f"[IMU]          LSM6 Accel X: {self.format_value(imu['lsm6_accel']['x'], '{:.3f} m/s²'):>12} "
         #       f"Y: {self.format_value(imu['lsm6_accel']['y'], '{:.3f} m/s²'):>12} "
         #       f"Z: {self.format_value(imu['lsm6_accel']['z'], '{:.3f} m/s²'):>12}")
@@ -220,7 +253,7 @@ class CanReceiver:
         #       f"Z: {self.format_value(imu['magnetometer']['z'], '{:.1f} μT'):>10}")
 
         # IMU2 Section
-        imu2 = self.decoder.data_store['imu2']
+        imu2 = self.data_store['imu2']
         print(f"[IMU]          Acceleration X: {self.format_value(imu2['acceleration']['x'], '{:.4f} g'):>12} "
               f"Y: {self.format_value(imu2['acceleration']['y'], '{:.4f} g'):>12} "
               f"Z: {self.format_value(imu2['acceleration']['z'], '{:.4f} g'):>12}")
@@ -233,8 +266,8 @@ class CanReceiver:
               f"Z: {self.format_value(imu2['quaternion']['z'], '{:.4f}'):>10}")
         print("-" * 90)
         # GPS Section
-        gps = self.decoder.data_store['gps']
-        cov = self.decoder.data_store['covariance']
+        gps = self.data_store['gps']
+        cov = self.data_store['covariance']
         print(f"[GPS]          Lat: {self.format_value(gps['lat'], '{:.7f}'):>12} "
               f"Lon: {self.format_value(gps['lon'], '{:.7f}'):>12} "
               f"Alt: {self.format_value(gps['alt'], '{:.1f}m'):>8}")
@@ -242,7 +275,7 @@ class CanReceiver:
               f"Covariance Type: {cov['type_name']:>15}")
         print("-" * 90)
         # Velocity Section  
-        vel = self.decoder.data_store['velocity']
+        vel = self.data_store['velocity']
         print(f"[Velocity]     Linear X: {self.format_value(vel['linear_x'], '{:.3f} m/s'):>10} "
               f"Y: {self.format_value(vel['linear_y'], '{:.3f} m/s'):>10} "
               f"Z: {self.format_value(vel['linear_z'], '{:.3f} m/s'):>10}")
@@ -253,7 +286,7 @@ class CanReceiver:
               f"({self.format_value(vel['speed_kmh'], '{:.2f} km/h'):>10})")
         print("-" * 90)
         # Accumulator Section
-        acc = self.decoder.data_store['accumulator']
+        acc = self.data_store['accumulator']
         print(f"[Accumulator]  SOC: {self.format_value(acc['soc'], '{}%'):>5} "
               f"Voltage: {self.format_value(acc['voltage'], '{:.2f}V'):>8} "
               f"Current: {self.format_value(acc['current'], '{:.2f}A'):>8} "
@@ -263,7 +296,7 @@ class CanReceiver:
               f"Heartbeat: {self.format_value(acc['heartbeat'], lambda x: 'OK' if x else 'FAIL'):>4}")
         print("-" * 90)
         # Inverters Section
-        for inv_id, inv in self.decoder.data_store['inverters'].items():
+        for inv_id, inv in self.data_store['inverters'].items():
             # Calculate speed in km/h for inverters
             speed_kmh = None
             if inv['speed'] is not None:
@@ -349,6 +382,7 @@ def main(args=None):
     # 檢查命令行參數
     import sys
     use_csv = '--csv' in sys.argv
+    use_ingest = '--ingest' in sys.argv
     dashboard_mode = '--dashboard' in sys.argv
     csv_file = './LOGS/can_log_20250727_112357.csv'
     csv_speed = 10.0
@@ -371,7 +405,7 @@ def main(args=None):
     # 創建 CAN 接收器
     display_mode = 'dashboard' if dashboard_mode else 'scroll'
     receiver = CanReceiver(use_csv=use_csv, csv_file=csv_file, 
-                          csv_speed=csv_speed, display_mode=display_mode)
+                          csv_speed=csv_speed, display_mode=display_mode, use_ingest=use_ingest)
     
     if use_csv:
         print(f"Using CSV mode: {csv_file} at {csv_speed}x speed")
@@ -0,0 +1,178 @@
+"""
+asyncio CAN reception
+
+AsyncBusReader 把 BusSelector 的 SocketCAN socket 以 loop.add_reader 註冊到
+uvicorn 的 event loop：socket 可讀時直接在 event loop 中 read_burst()
+（recv(timeout=0)，不會阻塞），一次處理該 bus 所有待處理的 frame，
+不需要 executor 執行緒，也不佔用 event loop 等待。
+
+    reader = AsyncBusReader(BusSelector({0: bus}), on_frames)
+    reader.start()          # 在 event loop 中呼叫
+    ...
+    reader.stop()           # 關閉 bus 之前
+
+LoopLagMonitor 量測 event loop 的延遲（定時 sleep 實際醒來比預期晚多少），
+用來比較不同接收方式對 HTTP / WebSocket 處理的影響（見 bench_event_loop.py）。
+"""
+
+import asyncio
+import time
+from collections import deque
+
+from CanReceiver import POLL_INTERVAL
+
+# LoopLagMonitor 的取樣間隔（秒）與保留的樣本數
+LAG_INTERVAL = 0.01
+LAG_WINDOW = 1000
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class AsyncBusReader:
+    """
+    在 asyncio event loop 中接收 BusSelector 的所有 bus
+
+    每次 socket 可讀時讀出最多 max_burst 筆（還有剩的話 event loop 下一輪會再
+    呼叫，其他 task 不會被餓死），整批交給 on_frames([(bus_num, msg), ...])。
+    沒有 fileno() 的 bus 由背景 task 每 POLL_INTERVAL 輪詢；讀取失敗的 bus
+    由 BusSelector 移除並記錄在 selector.failed，這裡同時取消監聽。
+    """
+
+    def __init__(self, selector, on_frames):
+        self.selector = selector
+        self.on_frames = on_frames
+        self.loop = None
+        self._readers = {}  # fileno -> bus_num
+        self._poll_task = None
+
+        # 統計
+        self.wakeups = 0
+        self.frames = 0
+        self.max_batch = 0
+
+    def start(self, loop=None):
+        """開始監聽（需在 event loop 中呼叫，或指定 loop）"""
+        self.loop = loop or asyncio.get_running_loop()
+        self.refresh()
+
+    def refresh(self):
+        """依 selector 目前的 bus 更新監聽的 socket（selector.add / remove 之後呼叫）"""
+        loop = self.loop
+        current = self.selector.fileno_map()
+        for fileno in list(self._readers):
+            if current.get(fileno) != self._readers[fileno]:
+                loop.remove_reader(fileno)
+                del self._readers[fileno]
+        for fileno, bus_num in current.items():
+            if fileno not in self._readers:
+                loop.add_reader(fileno, self._on_readable, fileno, bus_num)
+                self._readers[fileno] = bus_num
+        if self.selector.polled() and self._poll_task is None:
+            self._poll_task = loop.create_task(self._poll())
+
+    def stop(self):
+        """停止監聽（不關閉 selector 與 bus）"""
+        if self.loop is None:
+            return
+        for fileno in self._readers:
+            self.loop.remove_reader(fileno)
+        self._readers.clear()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+
+    def _on_readable(self, fileno, bus_num):
+        frames = self.selector.read_burst(bus_num)
+        if bus_num not in self.selector.buses:
+            # 讀取失敗，bus 已從 selector 移除
+            self.loop.remove_reader(fileno)
+            self._readers.pop(fileno, None)
+        self._deliver(frames)
+
+    async def _poll(self):
+        selector = self.selector
+        while selector.polled():
+            frames = []
+            for bus_num in selector.polled():
+                selector.read_burst(bus_num, frames)
+            self._deliver(frames)
+            await asyncio.sleep(POLL_INTERVAL)
+        self._poll_task = None
+
+    def _deliver(self, frames):
+        if not frames:
+            return
+        count = len(frames)
+        self.wakeups += 1
+        self.frames += count
+        self.selector.wakeups += 1
+        self.selector.frames += count
+        if count > self.max_batch:
+            self.max_batch = count
+        try:
+            self.on_frames(frames)
+        except Exception as e:
+            print(f"Error processing CAN frames: {e}")
+
+    def stats(self):
+        return {
+            'buses': sorted(self._readers.values()),
+            'failed': sorted(self.selector.failed),
+            'wakeups': self.wakeups,
+            'frames': self.frames,
+            'mean_batch': round(self.frames / self.wakeups, 2) if self.wakeups else None,
+            'max_batch': self.max_batch,
+        }
+
+
+class LoopLagMonitor:
+    """每 interval 秒 sleep 一次，記錄實際醒來比預期晚的時間（event loop 被佔用的程度）"""
+
+    def __init__(self, interval=LAG_INTERVAL, window=LAG_WINDOW):
+        self.interval = interval
+        self.samples = deque(maxlen=window)
+        self.max_lag = 0.0
+        self.count = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return self
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+        self.max_lag = 0.0
+        self.count = 0
+
+    async def _run(self):
+        interval = self.interval
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            lag = max(0.0, time.perf_counter() - start - interval)
+            self.samples.append(lag)
+            self.count += 1
+            if lag > self.max_lag:
+                self.max_lag = lag
+
+    def stats(self):
+        samples = self.samples
+        if not samples:
+            return {'samples': 0}
+        return {
+            'samples': self.count,
+            'interval_ms': self.interval * 1000,
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 3),
+            'p50_ms': round(percentile(samples, 0.5) * 1000, 3),
+            'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+            'max_ms': round(self.max_lag * 1000, 3),
+        }
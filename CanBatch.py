@@ -0,0 +1,315 @@
+"""
+Batch / vectorized CAN decode for post-session analysis
+
+將整個記錄檔依 CAN ID 分組，每組以 NumPy structured dtype 一次解碼，
+回傳每個訊號的欄式 (columnar) 陣列，不需逐筆經過 process_can_message。
+
+can_network.yaml 描述的訊息之外，CanDecoder 中手寫的訊息也有對應的向量化解碼:
+    0x100          timestamp.time（epoch 秒，CanDecoder 中為 datetime）
+    0x401          gps.alt、gps.status
+    0x410 ~ 0x418  covariance.values.0 ~ 8（CanDecoder.position_covariance，不在 data_store 中）
+    0x419          covariance.type（type_name 由 type 對應，不另外輸出）
+    0x421          canlogging.is_recording、start_timestamp、dropped_frames、overruns
+其他 CanDecoder 也不認得的 ID 不解碼，以 skipped_ids() 取得（main() 會列出）。
+
+用法:
+    python CanBatch.py ../LOGS/can_log_xxx.csv
+"""
+
+import re
+import sys
+import time
+
+import numpy as np
+
+from CanNetwork import DEFAULT_NETWORK_FILE, load_network
+
+PAYLOAD_WIDTH = 8
+
+# struct 格式字元 -> NumPy dtype
+_NUMPY_TYPES = {
+    'b': 'i1', 'B': 'u1', 'h': 'i2', 'H': 'u2', 'i': 'i4', 'I': 'u4',
+    'l': 'i4', 'L': 'u4', 'q': 'i8', 'Q': 'u8', 'f': 'f4', 'd': 'f8', '?': '?',
+}
+
+
+def layout_dtype(fmt, start, itemsize=PAYLOAD_WIDTH):
+    """將 little-endian struct 格式轉成對應 payload 的 structured dtype"""
+    if not fmt.startswith('<'):
+        raise ValueError(f"Only little-endian formats are supported: {fmt}")
+
+    names, formats, offsets = [], [], []
+    offset = start
+    for count, code in re.findall(r'(\d*)([a-zA-Z?])', fmt[1:]):
+        np_type = _NUMPY_TYPES[code]
+        size = np.dtype(np_type).itemsize
+        for _ in range(int(count) if count else 1):
+            names.append(f"r{len(names)}")
+            formats.append('<' + np_type)
+            offsets.append(offset)
+            offset += size
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': itemsize})
+
+
+def _scale(raw, divisor, factor, offset):
+    """與 CanNetwork 產生的解碼函數相同的運算順序"""
+    value = raw
+    if divisor is not None or factor is not None:
+        value = value.astype(np.float64)
+    elif offset is not None:
+        value = value.astype(np.int64)
+    if divisor is not None:
+        value = value / divisor
+    if factor is not None:
+        value = value * factor
+    if offset is not None:
+        value = value + offset
+    return value
+
+
+def _signal_prefix(path, index):
+    return ".".join(str(index) if key == '{index}' else str(key) for key in path)
+
+
+def _decode_fields(message, raw, timestamps, prefix, result):
+    for field in message['fields']:
+        key = f"{prefix}.{field['name']}"
+        if isinstance(field['raw'], tuple):
+            value = np.stack([raw[f"r{index}"] for index in field['raw']], axis=1)
+        elif field['equals'] is not None:
+            value = raw[f"r{field['raw']}"] == field['equals']
+        else:
+            value = _scale(raw[f"r{field['raw']}"], field['divisor'], field['factor'], field['offset'])
+        result[key] = (timestamps, value)
+
+
+def _decode_array(message, group, raw, timestamps, prefix, result):
+    array = message['array']
+    index = group[:, 0].astype(np.int64)
+    valid = (index % array['step'] == 0) & (index <= array['max_index'])
+    index = index[valid]
+    timestamps = timestamps[valid]
+    values = np.stack([raw[name][valid] for name in raw.dtype.names], axis=1)
+    values = _scale(values, array['divisor'], array['factor'], array['offset'])
+
+    # 攤平成 (cell index, timestamp, value)，再依 cell 分組
+    cells = (index[:, None] + np.arange(values.shape[1])).ravel()
+    cell_times = np.repeat(timestamps, values.shape[1])
+    values = values.ravel()
+    in_range = cells < array['length']
+    cells, cell_times, values = cells[in_range], cell_times[in_range], values[in_range]
+
+    order = np.argsort(cells, kind='stable')
+    cells, cell_times, values = cells[order], cell_times[order], values[order]
+    unique_cells, starts = np.unique(cells, return_index=True)
+    ends = np.append(starts[1:], len(cells))
+    for cell, begin, end in zip(unique_cells, starts, ends):
+        result[f"{prefix}.{cell}"] = (cell_times[begin:end], values[begin:end])
+
+
+# 0x100：ms since midnight (u32)、days since 1984-01-01 (u16)
+_TIMESTAMP = np.dtype({'names': ['ms', 'days'], 'formats': ['<u4', '<u2'], 'offsets': [0, 4],
+                       'itemsize': PAYLOAD_WIDTH})
+TIMESTAMP_EPOCH = 441763200
+COVARIANCE_IDS = range(0x410, 0x419)
+
+
+def _decode_timestamp(group, lengths, times, result):
+    rows = lengths >= 6
+    raw = group[rows].view(_TIMESTAMP).reshape(-1)
+    seconds = TIMESTAMP_EPOCH + raw['days'].astype(np.int64) * 86400 + raw['ms'] / 1000.0
+    result['timestamp.time'] = (times[rows], seconds)
+
+
+def _decode_gps_extended(group, lengths, times, result):
+    rows = lengths >= 2
+    group, lengths, times = group[rows], lengths[rows], times[rows]
+    alt = group[:, :2].copy().view('<i2').reshape(-1).astype(np.float64)
+    status = np.where(lengths > 2, group[:, 2], 0)
+    result['gps.alt'] = (times, alt)
+    result['gps.status'] = (times, status)
+
+
+def _decode_covariance(index, group, lengths, times, result):
+    rows = lengths >= 8
+    result[f'covariance.values.{index}'] = (times[rows], group[rows].copy().view('<f8').reshape(-1))
+
+
+def _decode_covariance_type(group, lengths, times, result):
+    rows = lengths >= 1
+    result['covariance.type'] = (times[rows], group[rows, 0])
+
+
+def _decode_canlogging_status(group, lengths, times, result):
+    # 與 CanDecoder.decode_canlogging_status 相同：status 0x00 / 0x01 以外只更新丟包計數
+    status = group[:, 0]
+    rows = (lengths >= 1) & ((status == 0x00) | (status == 0x01))
+    result['canlogging.is_recording'] = (times[rows], status[rows] == 0x01)
+    rows = (lengths >= 5) & (status == 0x01)
+    result['canlogging.start_timestamp'] = (times[rows], group[rows, 1:5].copy().view('<u4').reshape(-1))
+    rows = lengths >= 8
+    result['canlogging.dropped_frames'] = (times[rows], group[rows, 5:7].copy().view('<u2').reshape(-1))
+    result['canlogging.overruns'] = (times[rows], group[rows, 7])
+
+
+def _special_decoders():
+    """CanDecoder 手寫解碼的訊息：CAN ID -> 解碼函數 (group, lengths, times, result)"""
+    decoders = {
+        0x100: _decode_timestamp,
+        0x401: _decode_gps_extended,
+        0x419: _decode_covariance_type,
+        0x421: _decode_canlogging_status,
+    }
+    for index, can_id in enumerate(COVARIANCE_IDS):
+        decoders[can_id] = lambda *args, index=index: _decode_covariance(index, *args)
+    return decoders
+
+
+def _routes(messages):
+    """CAN ID -> (訊息名稱, index)"""
+    routes = {}
+    for name, message in messages.items():
+        for can_id, index in message['ids'].items():
+            routes[can_id] = (name, index)
+    return routes
+
+
+def skipped_ids(ids, network_file=DEFAULT_NETWORK_FILE):
+    """decode_batch 不會解碼的 CAN ID（網路描述檔與手寫解碼都沒有的）"""
+    messages, _ = load_network(network_file)
+    known = set(_routes(messages)) | set(_special_decoders())
+    return sorted(set(np.unique(np.asarray(ids, dtype=np.int64)).tolist()) - known)
+
+
+def decode_batch(ids, payloads, timestamps, lengths=None, network_file=DEFAULT_NETWORK_FILE):
+    """
+    一次解碼整批 CAN 訊息
+
+    Args:
+        ids:        (N,) CAN ID
+        payloads:   (N, 8) uint8 資料，或長度 N*8 的 bytes
+        timestamps: (N,) 時間戳（單位不限，原樣回傳）
+        lengths:    (N,) DLC，預設全部為 8；不足 min_len 的訊息會略過
+        network_file: 網路描述檔
+
+    Returns:
+        {訊號名稱: (timestamps, values)}，訊號名稱為 data_store 路徑，
+        例如 'inverters.3.torque'、'imu2.acceleration.x'、'accumulator.cell_voltages.17'；
+        不認得的 ID 不解碼（見 skipped_ids()）
+    """
+    messages, _ = load_network(network_file)
+
+    ids = np.asarray(ids, dtype=np.int64)
+    timestamps = np.asarray(timestamps)
+    if isinstance(payloads, (bytes, bytearray, memoryview)):
+        payloads = np.frombuffer(payloads, dtype=np.uint8)
+    payloads = np.ascontiguousarray(payloads, dtype=np.uint8).reshape(len(ids), PAYLOAD_WIDTH)
+    if lengths is None:
+        lengths = np.full(len(ids), PAYLOAD_WIDTH, dtype=np.int64)
+    else:
+        lengths = np.asarray(lengths, dtype=np.int64)
+
+    routes = _routes(messages)
+    special = _special_decoders()
+
+    # 依 CAN ID 排序一次，之後每組都是連續區段
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    unique_ids, starts = np.unique(sorted_ids, return_index=True)
+    ends = np.append(starts[1:], len(sorted_ids))
+
+    result = {}
+    dtypes = {}
+    for can_id, begin, end in zip(unique_ids.tolist(), starts, ends):
+        route = routes.get(can_id)
+        if route is None:
+            decoder = special.get(can_id)
+            if decoder is not None:
+                rows = order[begin:end]
+                decoder(payloads[rows], lengths[rows], timestamps[rows], result)
+            continue
+        name, index = route
+        message = messages[name]
+
+        rows = order[begin:end]
+        rows = rows[lengths[rows] >= message['min_len']]
+        if len(rows) == 0:
+            continue
+
+        dtype = dtypes.get(name)
+        if dtype is None:
+            dtype = dtypes[name] = layout_dtype(message['format'], message['start'])
+        group = payloads[rows]
+        raw = group.view(dtype).reshape(len(rows))
+        group_times = timestamps[rows]
+
+        prefix = _signal_prefix(message['target'], index)
+        if 'array' in message:
+            _decode_array(message, group, raw, group_times, prefix, result)
+        else:
+            _decode_fields(message, raw, group_times, prefix, result)
+
+    return result
+
+
+def load_csv_columns(csv_file):
+    """
+    讀取 can_log_*.csv 成欄式陣列
+    回傳 (ids, payloads, timestamps, lengths)
+    """
+    timestamps = []
+    ids = []
+    lengths = []
+    payload = bytearray()
+    fromhex = bytes.fromhex
+
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        next(f, None)  # 跳過標題列
+        for line in f:
+            parts = line.split(',', 14)
+            try:
+                timestamp = int(parts[0])
+                can_id = int(parts[1], 16)
+                length = int(parts[5])
+                data = ''.join(parts[6:14]).strip()
+                if len(data) != 2 * PAYLOAD_WIDTH:
+                    # 不足 8 bytes 或有空欄位，補 0
+                    data = [b.strip() or '00' for b in parts[6:6 + PAYLOAD_WIDTH]]
+                    data = ''.join(data + ['00'] * (PAYLOAD_WIDTH - len(data)))
+                data = fromhex(data)
+            except (ValueError, IndexError):
+                continue
+            timestamps.append(timestamp)
+            ids.append(can_id)
+            lengths.append(length)
+            payload += data
+
+    return (np.array(ids, dtype=np.int64),
+            np.frombuffer(bytes(payload), dtype=np.uint8).reshape(-1, PAYLOAD_WIDTH),
+            np.array(timestamps, dtype=np.int64),
+            np.array(lengths, dtype=np.int64))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python CanBatch.py <can_log.csv>")
+        return
+
+    start = time.perf_counter()
+    ids, payloads, timestamps, lengths = load_csv_columns(sys.argv[1])
+    loaded = time.perf_counter()
+    signals = decode_batch(ids, payloads, timestamps, lengths)
+    decoded = time.perf_counter()
+
+    print(f"Loaded {len(ids)} frames in {loaded - start:.2f}s, "
+          f"decoded {len(signals)} signals in {decoded - loaded:.2f}s")
+    for key in sorted(signals):
+        times, values = signals[key]
+        print(f"  {key:<40} {len(times):>8} samples")
+    skipped = skipped_ids(ids)
+    if skipped:
+        print(f"Skipped {len(skipped)} unknown IDs: {', '.join(f'0x{can_id:03X}' for can_id in skipped)}")
+
+
+if __name__ == '__main__':
+    main()
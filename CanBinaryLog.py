@@ -0,0 +1,245 @@
+"""
+Binary CAN log format
+
+固定長度的二進位記錄格式，取代每筆 ~60 bytes 的 hex CSV：
+
+    file header (64 bytes)
+        magic 'NTCANLOG', version, record size, block size,
+        建立時間 (µs), clock source
+    block ...
+        block header (24 bytes): magic 'BLK1', record count, first / last timestamp
+        records (24 bytes each): timestamp µs, CAN ID, flags, bus, DLC, 8 data bytes
+    block index (寫檔結束時)
+        每個 block: file offset, record count, first / last timestamp
+    trailer (16 bytes): index offset, block count, magic 'NIDX'
+
+紀錄以大區塊一次寫入；若未正常關檔（斷電），讀取時依 block header
+依序掃描，仍可讀回已寫入的所有區塊。
+
+轉回 CSV:
+    python CanBinaryLog.py to-csv can_log_xxx.canlog [can_log_xxx.csv]
+"""
+
+import csv
+import os
+import struct
+import sys
+import time
+
+FILE_MAGIC = b'NTCANLOG'
+BLOCK_MAGIC = b'BLK1'
+INDEX_MAGIC = b'NIDX'
+FORMAT_VERSION = 1
+
+FILE_EXTENSION = '.canlog'
+
+# magic, version, record size, block records, created (µs), clock source
+HEADER = struct.Struct('<8sHHIQ32s8x')
+# timestamp (µs), CAN ID, flags, bus, DLC, data
+RECORD = struct.Struct('<QIBBBx8s')
+# magic, record count, first timestamp, last timestamp
+BLOCK_HEADER = struct.Struct('<4sIQQ')
+# file offset, record count, first timestamp, last timestamp
+INDEX_ENTRY = struct.Struct('<QIQQ')
+# index offset, block count, magic
+TRAILER = struct.Struct('<QI4s')
+
+# flags
+FLAG_EXTENDED = 0x01
+FLAG_REMOTE = 0x02
+FLAG_ERROR = 0x04
+FLAG_FD = 0x08
+
+DEFAULT_BLOCK_RECORDS = 4096
+
+CSV_HEADER = ["Time Stamp", "ID", "Extended", "Dir", "Bus", "LEN", "D1",
+              "D2", "D3", "D4", "D5", "D6", "D7", "D8", "D9", "D10",
+              "D11", "D12"]
+
+
+def message_flags(msg):
+    """由 can.Message 取得 flags"""
+    flags = 0
+    if msg.is_extended_id:
+        flags |= FLAG_EXTENDED
+    if msg.is_remote_frame:
+        flags |= FLAG_REMOTE
+    if getattr(msg, 'is_error_frame', False):
+        flags |= FLAG_ERROR
+    if getattr(msg, 'is_fd', False):
+        flags |= FLAG_FD
+    return flags
+
+
+class BinaryLogWriter:
+    """以固定大小區塊寫入二進位 CAN 記錄"""
+
+    def __init__(self, filename, block_records=DEFAULT_BLOCK_RECORDS, flush_interval=1.0,
+                 clock_source='system'):
+        self.filename = filename
+        self.block_records = block_records
+        self.flush_interval = flush_interval
+        self.clock_source = clock_source
+
+        # 預先配置整個區塊的 buffer，record 直接 pack_into
+        self._buffer = bytearray(BLOCK_HEADER.size + block_records * RECORD.size)
+        self._count = 0
+        self._first_timestamp = 0
+        self._last_timestamp = 0
+        self._block_started = 0.0
+        self._index = []
+        self.records_written = 0
+
+        self._file = open(filename, 'wb')
+        self._file.write(HEADER.pack(FILE_MAGIC, FORMAT_VERSION, RECORD.size, block_records,
+                                     int(time.time() * 1000000), clock_source.encode()[:32]))
+        self._offset = HEADER.size
+
+    def write(self, timestamp, can_id, flags, bus, dlc, data):
+        """寫入一筆紀錄 (timestamp 單位為 µs)"""
+        if self._count == 0:
+            self._first_timestamp = timestamp
+            self._block_started = time.monotonic()
+
+        RECORD.pack_into(self._buffer, BLOCK_HEADER.size + self._count * RECORD.size,
+                         timestamp, can_id, flags, bus, dlc, bytes(data[:8]))
+        self._last_timestamp = timestamp
+        self._count += 1
+
+        if self._count >= self.block_records:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def write_message(self, msg, bus, timestamp):
+        """寫入 can.Message"""
+        self.write(timestamp, msg.arbitration_id, message_flags(msg), bus, msg.dlc, msg.data)
+
+    def flush_if_due(self):
+        """
+        目前區塊已等待超過 flush_interval 時寫入檔案，回傳是否寫入
+        write() 只在收到新 frame 時檢查；沒有流量時由呼叫端定期呼叫，未滿的區塊才不會一直留在記憶體
+        """
+        if self._count and time.monotonic() - self._block_started >= self.flush_interval:
+            self.flush()
+            return True
+        return False
+
+    def flush(self):
+        """將目前區塊寫入檔案（可能不滿）"""
+        if self._count == 0:
+            return
+
+        BLOCK_HEADER.pack_into(self._buffer, 0, BLOCK_MAGIC, self._count,
+                               self._first_timestamp, self._last_timestamp)
+        size = BLOCK_HEADER.size + self._count * RECORD.size
+        self._file.write(memoryview(self._buffer)[:size])
+        self._file.flush()
+
+        self._index.append((self._offset, self._count, self._first_timestamp, self._last_timestamp))
+        self._offset += size
+        self.records_written += self._count
+        self._count = 0
+
+    def close(self):
+        """寫入剩餘區塊與 block index"""
+        if self._file is None:
+            return
+        self.flush()
+        index_offset = self._offset
+        for entry in self._index:
+            self._file.write(INDEX_ENTRY.pack(*entry))
+        self._file.write(TRAILER.pack(index_offset, len(self._index), INDEX_MAGIC))
+        self._file.close()
+        self._file = None
+
+
+class BinaryLogReader:
+    """讀取二進位 CAN 記錄"""
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            magic, version, record_size, block_records, created, clock_source = \
+                HEADER.unpack(f.read(HEADER.size))
+        if magic != FILE_MAGIC:
+            raise ValueError(f"Not a binary CAN log: {filename}")
+        if version != FORMAT_VERSION or record_size != RECORD.size:
+            raise ValueError(f"Unsupported binary CAN log version {version} (record size {record_size})")
+
+        self.block_records = block_records
+        self.created = created
+        self.clock_source = clock_source.rstrip(b'\0').decode()
+        self.blocks = self._read_index()
+
+    def _read_index(self):
+        """讀取 block index；未正常關檔時依 block header 掃描"""
+        file_size = os.path.getsize(self.filename)
+        with open(self.filename, 'rb') as f:
+            if file_size >= HEADER.size + TRAILER.size:
+                f.seek(file_size - TRAILER.size)
+                index_offset, count, magic = TRAILER.unpack(f.read(TRAILER.size))
+                if magic == INDEX_MAGIC and index_offset + count * INDEX_ENTRY.size + TRAILER.size == file_size:
+                    f.seek(index_offset)
+                    data = f.read(count * INDEX_ENTRY.size)
+                    return [INDEX_ENTRY.unpack_from(data, i * INDEX_ENTRY.size) for i in range(count)]
+
+            blocks = []
+            offset = HEADER.size
+            while offset + BLOCK_HEADER.size <= file_size:
+                f.seek(offset)
+                magic, count, first, last = BLOCK_HEADER.unpack(f.read(BLOCK_HEADER.size))
+                if magic != BLOCK_MAGIC:
+                    break
+                # 最後一個區塊可能只寫了一部分
+                available = (file_size - offset - BLOCK_HEADER.size) // RECORD.size
+                count = min(count, available)
+                if count:
+                    blocks.append((offset, count, first, last))
+                offset += BLOCK_HEADER.size + count * RECORD.size
+            return blocks
+
+    def __len__(self):
+        return sum(count for _, count, _, _ in self.blocks)
+
+    def __iter__(self):
+        """逐筆回傳 (timestamp, can_id, flags, bus, dlc, data)"""
+        with open(self.filename, 'rb') as f:
+            for offset, count, _, _ in self.blocks:
+                f.seek(offset + BLOCK_HEADER.size)
+                yield from RECORD.iter_unpack(f.read(count * RECORD.size))
+
+
+def is_binary_log(filename):
+    """判斷檔案是否為二進位 CAN 記錄"""
+    try:
+        with open(filename, 'rb') as f:
+            return f.read(len(FILE_MAGIC)) == FILE_MAGIC
+    except OSError:
+        return False
+
+
+def convert_to_csv(binary_file, csv_file=None):
+    """將二進位記錄轉回 canlogging 的 CSV 格式，回傳 CSV 檔名"""
+    if csv_file is None:
+        csv_file = os.path.splitext(binary_file)[0] + '.csv'
+
+    reader = BinaryLogReader(binary_file)
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for timestamp, can_id, flags, bus, dlc, data in reader:
+            extended = 'true' if flags & FLAG_EXTENDED else 'false'
+            direction = 'Tx' if flags & FLAG_REMOTE else 'Rx'
+            data_bytes = [f"{byte:02X}" for byte in data]
+            writer.writerow([timestamp, f"{can_id:08X}", extended, direction, bus, dlc] + data_bytes)
+
+    print(f"Converted {len(reader)} frames: {binary_file} -> {csv_file}")
+    return csv_file
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'to-csv':
+        convert_to_csv(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    else:
+        print("Usage: python CanBinaryLog.py to-csv <file.canlog> [output.csv]")
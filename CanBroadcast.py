@@ -0,0 +1,305 @@
+"""
+WebSocket fan-out
+
+每個 tick 的資料每種格式只序列化一次（CanDelta.encode / encode_msgpack），
+再放進每個 client 自己的 bounded queue，由各 client 的送出 task 並行送出。
+慢的 client 不會拖住其他 client：queue 滿時丟掉最舊的訊息（delta client 會因
+seq 不連續而要求 resync）。
+
+client 可以在 /ws 上送訂閱訊息，只收部分欄位、以較低頻率接收：
+    {"type": "subscribe", "topics": ["gps", "velocity"], "rate": 5}
+topics 為廣播資料的頂層欄位（省略或 null 表示全部），META 欄位一律附上；
+rate 單位 Hz（省略或 0 表示有推送就送，full client 最多 FULL_MAX_RATE）。訂閱相同的 client 共用一個 Subscription，
+同一份訊息只序列化一次。
+
+每個 client 的排隊長度、丟棄數與延遲（放進 queue 到送出完成）可由 stats() 取得。
+"""
+
+import asyncio
+import json
+import time
+from collections import deque
+
+from CanDelta import encode, encode_msgpack, merge_changes
+
+DEFAULT_QUEUE_SIZE = 8
+
+# /ws?format=... 可用的格式：json 送文字 frame，msgpack 送二進位 frame
+FORMATS = {
+    'json': encode,
+    'msgpack': encode_msgpack,
+}
+
+# 不論訂閱哪些 topic 都會附上的欄位
+META = ('timestamp', 'message_count', 'update_time')
+
+# 快速訊號在兩次推送之間的 min / max / mean（CanSchedule.SignalAggregates），
+# 以 topic 為 key，只送給有訂閱該 topic 的 client，不屬於 delta 狀態
+AGGREGATES = 'aggregates'
+
+# full client 沒有指定 rate 時的最大頻率 (Hz)，與原本固定 20 FPS 相同
+FULL_MAX_RATE = 20.0
+
+
+def parse_request(text):
+    """解析 client 在 /ws 上送來的 JSON 訊息，格式不對時回傳 None"""
+    try:
+        request = json.loads(text)
+    except ValueError:
+        return None
+    return request if isinstance(request, dict) else None
+
+
+def select(data, topics):
+    """只留下 topics 與 META 欄位（topics 為 None 時原樣回傳）"""
+    if topics is None:
+        return data
+    selected = {key: value for key, value in data.items() if key in topics or key in META}
+    aggregates = data.get(AGGREGATES)
+    if aggregates:
+        aggregates = {name: value for name, value in aggregates.items() if name in topics}
+        if aggregates:
+            selected[AGGREGATES] = aggregates
+    return selected
+
+
+class ClientQueue:
+    """單一 WebSocket client 的送出 queue 與統計"""
+
+    def __init__(self, websocket, kind, format='json', queue_size=DEFAULT_QUEUE_SIZE):
+        self.websocket = websocket
+        self.kind = kind
+        self.format = format
+        self.encode = FORMATS[format]
+        self.subscription = None
+        self.queue = deque(maxlen=queue_size)  # (放入時間, payload)，滿了自動丟掉最舊的
+        self.wakeup = asyncio.Event()
+        self.connected_at = time.time()
+        self.closed = False
+        self.task = None
+
+        # 統計
+        self.queued = 0
+        self.sent = 0
+        self.dropped = 0
+        self.sent_bytes = 0
+        self.high_water = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._lag_total = 0.0
+
+    def send(self, message):
+        """以這個 client 的格式序列化 message 後放進 queue"""
+        self.put(self.encode(message))
+
+    def put(self, payload):
+        """放入已序列化的 payload（str 送文字 frame，bytes 送二進位 frame）"""
+        queue = self.queue
+        if len(queue) == queue.maxlen:
+            self.dropped += 1
+        queue.append((time.monotonic(), payload))
+        self.queued += 1
+        if len(queue) > self.high_water:
+            self.high_water = len(queue)
+        self.wakeup.set()
+
+    async def run(self, on_error):
+        """送出 queue 中的訊息直到連線關閉；送出失敗時呼叫 on_error(self)"""
+        queue = self.queue
+        try:
+            while not self.closed:
+                if not queue:
+                    self.wakeup.clear()
+                    await self.wakeup.wait()
+                    continue
+                queued_at, payload = queue.popleft()
+                if isinstance(payload, bytes):
+                    await self.websocket.send_bytes(payload)
+                else:
+                    await self.websocket.send_text(payload)
+                lag = time.monotonic() - queued_at
+                self.sent += 1
+                self.sent_bytes += len(payload)
+                self.last_lag = lag
+                self._lag_total += lag
+                if lag > self.max_lag:
+                    self.max_lag = lag
+        except Exception:
+            on_error(self)
+
+    def close(self):
+        self.closed = True
+        self.wakeup.set()
+
+    def stats(self):
+        client = self.websocket.client
+        subscription = self.subscription
+        return {
+            'client': f"{client.host}:{client.port}" if client else None,
+            'kind': self.kind,
+            'format': self.format,
+            'topics': sorted(subscription.topics) if subscription and subscription.topics else None,
+            'rate': subscription.rate if subscription else None,
+            'connected_at': self.connected_at,
+            'queued': self.queued,
+            'sent': self.sent,
+            'dropped': self.dropped,
+            'pending': len(self.queue),
+            'high_water': self.high_water,
+            'sent_bytes': self.sent_bytes,
+            'last_lag_ms': round(self.last_lag * 1000, 3),
+            'max_lag_ms': round(self.max_lag * 1000, 3),
+            'mean_lag_ms': round(self._lag_total / self.sent * 1000, 3) if self.sent else None,
+        }
+
+
+class Subscription:
+    """
+    同一種 kind / topics / rate 的 client 群組
+
+    full 群組在訂閱的 topic 有推送、且到期時送出選取的欄位；delta 群組在兩次
+    送出之間把變動累積在 pending，到期時以群組自己的 seq 一次送出。
+    """
+
+    def __init__(self, kind, topics=None, rate=None):
+        self.kind = kind
+        self.topics = topics
+        self.rate = rate
+        if rate:
+            self.interval = 1.0 / rate
+        else:
+            self.interval = 1.0 / FULL_MAX_RATE if kind == 'full' else 0.0
+        self.clients = set()
+        self.next_due = 0.0
+        self.seq = 0
+        self.pending = None
+
+    def due(self, now):
+        if now < self.next_due:
+            return False
+        # 落後超過一個週期時不補送，從現在重新起算
+        self.next_due = max(self.next_due + self.interval, now)
+        return True
+
+    def snapshot(self, state):
+        """delta client 加入或要求 resync 時的 snapshot（state 為 DeltaEncoder 的基準狀態）"""
+        return {'type': 'snapshot', 'seq': self.seq, 'data': select(state, self.topics)}
+
+    def message(self, data, changes, pushed, now):
+        """這個 tick 要送給群組的訊息，不需要送時回傳 None（pushed: 這個 tick 推送的 topic）"""
+        if self.kind != 'delta':
+            if pushed is not None and not (pushed if self.topics is None else self.topics & pushed):
+                return None
+            return select(data, self.topics) if self.due(now) else None
+
+        if changes:
+            changes = select(changes, self.topics)
+            # 只有 META 欄位變動時不送
+            if all(key in META or key == AGGREGATES for key in changes):
+                changes = None
+        if changes:
+            if self.interval:
+                self.pending = merge_changes(self.pending or {}, changes)
+            else:
+                self.pending = changes
+        if not self.pending or not self.due(now):
+            return None
+        self.seq += 1
+        message = {'type': 'delta', 'seq': self.seq, 'changes': self.pending}
+        self.pending = None
+        return message
+
+    def publish(self, message):
+        """把 message 放進群組內每個 client 的 queue，每種格式只序列化一次"""
+        payloads = {}
+        for client in self.clients:
+            payload = payloads.get(client.format)
+            if payload is None:
+                payload = payloads[client.format] = client.encode(message)
+            client.put(payload)
+
+
+class Broadcaster:
+    """管理所有 WebSocket client；broadcast() 不等待任何送出"""
+
+    def __init__(self, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self.clients = {}
+        self.subscriptions = {}
+        self.ticks = 0
+        self.last_encode = 0.0  # 最近一個 tick 的組資料與序列化時間（秒）
+
+    def __len__(self):
+        return len(self.clients)
+
+    def has(self, kind):
+        return any(client.kind == kind for client in self.clients.values())
+
+    def add(self, websocket, kind, format='json'):
+        """登記 client（預設訂閱全部欄位、每個 tick）並啟動送出 task（需在 event loop 中呼叫）"""
+        client = ClientQueue(websocket, kind, format, self.queue_size)
+        self.clients[websocket] = client
+        self.subscribe(client)
+        client.task = asyncio.create_task(client.run(self._drop_client))
+        return client
+
+    def remove(self, websocket):
+        client = self.clients.pop(websocket, None)
+        if client:
+            self._leave(client)
+            client.close()
+
+    def _drop_client(self, client):
+        self.remove(client.websocket)
+
+    def _leave(self, client):
+        subscription = client.subscription
+        if subscription is None:
+            return
+        subscription.clients.discard(client)
+        if not subscription.clients:
+            del self.subscriptions[subscription.kind, subscription.topics, subscription.rate]
+        client.subscription = None
+
+    def subscribe(self, client, topics=None, rate=None):
+        """把 client 移到 (topics, rate) 的群組；delta client 之後需要送一個新的 snapshot"""
+        if isinstance(topics, (list, tuple, set, frozenset)) and topics:
+            topics = frozenset(topic for topic in topics if isinstance(topic, str))
+        else:
+            topics = None
+        if isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0:
+            rate = None
+        else:
+            rate = float(rate)
+        self._leave(client)
+        key = (client.kind, topics, rate)
+        subscription = self.subscriptions.get(key)
+        if subscription is None:
+            subscription = self.subscriptions[key] = Subscription(client.kind, topics, rate)
+        subscription.clients.add(client)
+        client.subscription = subscription
+        return subscription
+
+    def broadcast(self, data, changes=None, pushed=None):
+        """
+        送出一個 tick：full 群組收 data 的選取欄位，delta 群組收 changes
+        （DeltaEncoder.delta() 的 changes，沒有變動時為 None）
+
+        pushed: 這個 tick 推送的 topic（CanSchedule.TopicScheduler.due()），
+                full 群組只在訂閱的 topic 有推送時才送；None 表示每個 tick 都送
+        """
+        now = time.monotonic()
+        for subscription in self.subscriptions.values():
+            message = subscription.message(data, changes, pushed, now)
+            if message is not None:
+                subscription.publish(message)
+        self.ticks += 1
+
+    def stats(self):
+        return {
+            'clients': [client.stats() for client in self.clients.values()],
+            'subscriptions': len(self.subscriptions),
+            'ticks': self.ticks,
+            'last_encode_ms': round(self.last_encode * 1000, 3),
+            'queue_size': self.queue_size,
+        }
@@ -1,94 +1,133 @@
 import can
+import pickle
 import struct
+from array import array
 from datetime import datetime
 import time
 
+from CanNetwork import DEFAULT_NETWORK_FILE, load_network
+from CanState import State, create_data_store, list_array
+
+
+# 手寫解碼函數使用的預編譯格式
+_TIMESTAMP = struct.Struct('<IH')
+_INT16 = struct.Struct('<h')
+_DOUBLE = struct.Struct('<d')
+_UINT16 = struct.Struct('<H')
+_UINT32 = struct.Struct('<I')
+
+
+def _update_in_place(target, source):
+    """
+    把 source 的內容寫回 target，保留原本的 State / dict / array 物件
+    （source 也可以是舊版 keyframe 中的巢狀 dict / list）
+    """
+    for key, value in source.items():
+        current = target.get(key)
+        if isinstance(value, (dict, State)) and isinstance(current, (dict, State)):
+            _update_in_place(current, value)
+        elif isinstance(current, array) and isinstance(value, array) and value.typecode == current.typecode:
+            current[:] = value
+        elif isinstance(current, array) and isinstance(value, (array, list)):
+            current[:] = list_array(current.typecode, value)
+        elif isinstance(value, list) and isinstance(current, list):
+            current[:] = value
+        else:
+            target[key] = value
 
 
 class CanDecoder:
-    def __init__(self):
-        # Data storage
-        self.data_store = {
-            'timestamp': {'time': None, 'last_update': None},
-            'gps': {
-                'lat': None, 'lon': None, 'alt': None, 'status': None,
-                'last_update': None
-            },
-            'covariance': {
-                'values': [0.0] * 9, 'type': 0, 'type_name': 'UNKNOWN',
-                'last_update': None
-            },
-            'velocity': {
-                'linear_x': None, 'linear_y': None, 'linear_z': None,
-                'angular_x': None, 'angular_y': None, 'angular_z': None,
-                'magnitude': None, 'speed_kmh': None,
-                'last_update': None
-            },
-            'accumulator': {
-                'soc': None, 'voltage': None, 'current': None, 'temperature': None,
-                'status': None, 'heartbeat': None, 'capacity': None,
-                'cell_voltages': [None] * 105, 'cell_temperatures': [None] * 224,
-                'last_update': None
-            },
-            'inverters': {
-                # 1: {'name': 'FL', 'status': None, 'torque': None, 'speed': None,
-                #     'control_word': None, 'target_torque': None,
-                #     'dc_voltage': None, 'dc_current': None,
-                #     'mos_temp': None, 'mcu_temp': None, 'motor_temp': None,
-                #     'heartbeat': None, 'last_update': None},
-                # 2: {'name': 'FR', 'status': None, 'torque': None, 'speed': None,
-                #     'control_word': None, 'target_torque': None,
-                #     'dc_voltage': None, 'dc_current': None,
-                #     'mos_temp': None, 'mcu_temp': None, 'motor_temp': None,
-                #     'heartbeat': None, 'last_update': None},
-                3: {'name': 'RL', 'status': None, 'torque': None, 'speed': None,
-                    'control_word': None, 'target_torque': None,
-                    'dc_voltage': None, 'dc_current': None,
-                    'mos_temp': None, 'mcu_temp': None, 'motor_temp': None,
-                    'heartbeat': None, 'last_update': None},
-                4: {'name': 'RR', 'status': None, 'torque': None, 'speed': None,
-                    'control_word': None, 'target_torque': None,
-                    'dc_voltage': None, 'dc_current': None,
-                    'mos_temp': None, 'mcu_temp': None, 'motor_temp': None,
-                    'heartbeat': None, 'last_update': None}
-            },
-            'vcu': {
-                'steer': None, 'accel': None, 'apps1': None,    
-                'apps2': None, 'brake': None, 'bse1': None, 'bse2': None,
-                'last_update': None},
-            'canlogging': {
-                'is_recording': False, 'start_time': None, 'start_timestamp': None,
-                'last_update': None
-            },
-            'imu': {
-                'lsm6_accel': {'x': None, 'y': None, 'z': None},
-                'lsm303_accel': {'x': None, 'y': None, 'z': None},
-                'gyro': {'x': None, 'y': None, 'z': None},
-                'euler_angles': {'roll': None, 'pitch': None, 'yaw': None},
-                'magnetometer': {'x': None, 'y': None, 'z': None},
-                'last_update': None
-            },
-            'imu2': {
-                'acceleration': {'x': None, 'y': None, 'z': None},
-                'gyration': {'x': None, 'y': None, 'z': None},
-                'quaternion': {'w': None, 'x': None, 'y': None, 'z': None},
-                'last_update': None
-            }
-        }
-        
+    def __init__(self, network_file=DEFAULT_NETWORK_FILE, compiled=True):
+        # Data storage：每個子系統是 __slots__ 物件，電芯數值為 array（見 CanState）
+        self.data_store = create_data_store()
+
         self.message_count = 0
         self.running = True
         
         # Legacy GPS數據暫存
-        self.gps_lat = None
-        self.gps_lon = None
         self.gps_alt = None
         
         # Position covariance 暫存
         self.position_covariance = [0.0] * 9
         self.position_covariance_type = 0
 
+        # 由網路描述檔產生的解碼函數（有 build_core.py 編譯的版本時使用編譯版）
+        self.network_file = network_file
+        self.messages, self.decoders = load_network(network_file, compiled)
+
+        # CAN ID 分派表（建構時建立一次）
+        self._dispatch = self._build_dispatch_table()
+
+        # 上次 take_dirty() 之後有更新過的 data_store 頂層欄位（WebSocket delta 用）
+        self.dirty = set()
+
+        # 各數值訊號最近幾分鐘的 ring buffer（enable_history() 之後才記錄）
+        self.history = None
    
+    def snapshot(self):
+        """序列化目前的解碼狀態（replay keyframe 用）"""
+        return pickle.dumps((self.data_store, self.gps_alt, self.position_covariance,
+                             self.position_covariance_type), pickle.HIGHEST_PROTOCOL)
+
+    def restore(self, snapshot):
+        """還原 snapshot()；data_store 就地更新，分派表中的參照仍然有效"""
+        data_store, self.gps_alt, covariance, self.position_covariance_type = pickle.loads(snapshot)
+        _update_in_place(self.data_store, data_store)
+        self.position_covariance[:] = covariance
+        self.dirty.update(self.data_store)
+
+    def apply_state(self, data_store, sections=None, samples=None):
+        """
+        就地寫入另一個 process 解碼的 data_store（CanWorker.DecodeWorker 用），
+        sections 為有變動的頂層欄位，None 表示全部；有開啟歷史時，samples 為該 process
+        SignalJournal.take() 的結果 list（每個 frame 的樣本），None 時只記錄目前的值
+        """
+        if sections is None:
+            sections = data_store.keys()
+        changed = {section: data_store[section] for section in sections
+                   if section in data_store and section in self.data_store}
+        _update_in_place(self.data_store, changed)
+        self.dirty.update(changed)
+        history = self.history
+        if history is not None:
+            if samples is None:
+                history.record_all()
+            else:
+                for journal in samples:
+                    history.merge(journal)
+        return changed.keys()
+
+    def enable_history(self, capacity=None, seconds=None, journal=False):
+        """
+        為網路描述檔中的每個數值欄位建立 ring buffer（見 CanHistory），回傳 SignalHistory；
+        journal 為 True 時改用 SignalJournal，只累積新樣本給另一個 process 的 apply_state()
+        """
+        from CanHistory import HISTORY_CAPACITY, HISTORY_SECONDS, SignalHistory, SignalJournal
+        if journal:
+            history = SignalJournal()
+        else:
+            history = SignalHistory(capacity or HISTORY_CAPACITY, seconds or HISTORY_SECONDS)
+        for name, message in self.messages.items():
+            if 'array' in message:
+                continue
+            fields = [field['name'] for field in message['fields']
+                      if field['equals'] is None and not isinstance(field['raw'], tuple)]
+            for can_id, index in message['ids'].items():
+                target = self._resolve_path(message['target'], index)
+                stamp = self._resolve_path(message['stamp'], index)
+                if target is None or stamp is None:
+                    continue
+                path = '.'.join(str(index if key == '{index}' else key) for key in message['target'])
+                history.add_source(can_id, path, target, stamp, fields)
+        self.history = history
+        return history
+
+    def take_dirty(self):
+        """取出並清空有更新過的頂層欄位"""
+        dirty = self.dirty
+        self.dirty = set()
+        return dirty
+
     def create_mock_can_message(self, can_id, data):
         """創建模擬的 CAN 訊息對象"""
         class MockCanMessage:
@@ -98,246 +137,66 @@ class CanDecoder:
         
         return MockCanMessage(can_id, data)
 
-    def process_can_message(self, msg: can.Message):
-        can_id = msg.arbitration_id
-        data = msg.data
-        
-        try:
-            # Timestamp 解碼
-            if can_id == 0x100:
-                self.decode_timestamp(data)
-            
-            elif can_id == 0x181:
-                self.decode_vcu_cockpit(data)
-            # GPS 解碼
-            elif can_id == 0x400:
-                self.decode_gps_basic(data)
-            elif can_id == 0x401:
-                self.decode_gps_extended(data)
-            elif 0x410 <= can_id <= 0x418:
-                self.decode_position_covariance(data, can_id - 0x410)
-            elif can_id == 0x419:
-                self.decode_position_covariance_type(data)
-
-            # IMU 數據解碼
-            elif can_id == 0x180:
-                self.decode_lsm6_accelerometer(data)
-            elif can_id == 0x182:
-                self.decode_lsm303_accelerometer(data)
-            elif can_id == 0x280:
-                self.decode_angular_velocity(data)
-            elif can_id == 0x380:
-                self.decode_euler_angles(data)
-            elif can_id == 0x430:
-                self.decode_magnetometer(data)
-            
-            # IMU2 數據解碼
-            elif can_id == 0x188:
-                self.decode_imu2_acceleration(data)
-            elif can_id == 0x288:
-                self.decode_imu2_gyration(data)
-            elif can_id == 0x488:
-                self.decode_imu2_quaternion(data)
-
-            # 速度資料解碼
-            elif can_id == 0x402:
-                self.decode_velocity_x(data)
-            elif can_id == 0x403:
-                self.decode_velocity_y(data)
-            elif can_id == 0x404:
-                self.decode_velocity_z(data)
-            elif can_id == 0x405:
-                self.decode_angular_x(data)
-            elif can_id == 0x406:
-                self.decode_angular_y(data)
-            elif can_id == 0x407:
-                self.decode_angular_z(data)
-            elif can_id == 0x408:
-                self.decode_velocity_magnitude(data)
-            
-            # Accumulator 解碼
-            elif can_id == 0x190:
-                self.decode_cell_voltage(data)
-            elif can_id == 0x390:
-                self.decode_accumulator_temperature(data)
-            elif can_id == 0x710:
-                self.decode_accumulator_heartbeat(data)
-            elif can_id == 0x290:
-                self.decode_accumulator_status(data)
-            elif can_id == 0x490:
-                self.decode_accumulator_state(data)
-            
-            # Inverter 解碼
-            elif 0x191 <= can_id <= 0x194:
-                inv_num = can_id - 0x190
-                self.decode_inverter_status(data, inv_num)
-            elif 0x291 <= can_id <= 0x294:
-                inv_num = can_id - 0x290
-                self.decode_inverter_state(data, inv_num)
-            elif 0x391 <= can_id <= 0x394:
-                inv_num = can_id - 0x390
-                self.decode_inverter_temperature(data, inv_num)
-            elif 0x711 <= can_id <= 0x714:
-                inv_num = can_id - 0x710
-                self.decode_inverter_heartbeat(data, inv_num)
-            elif 0x210 <= can_id <= 0x214:
-                inv_num = can_id - 0x210
-                self.decode_inverter_control(data, inv_num)
-            
-            # CAN Logging 狀態解碼
-            elif can_id == 0x421:
-                self.decode_canlogging_status(data)
-            
+    def _resolve_path(self, path, index=None):
+        """依路徑取得 data_store 中的 dict，'{index}' 代入 index，不存在則回傳 None"""
+        node = self.data_store
+        for key in path:
+            if key == '{index}':
+                key = index
+            node = node.get(key) if isinstance(node, (dict, State)) else None
+            if node is None:
+                return None
+        return node
+
+    def _build_dispatch_table(self):
+        """建立 CAN ID -> (解碼函數, 預綁定參數, 更新的 data_store 頂層欄位) 的查找表"""
+        table = {
+            0x100: (self.decode_timestamp, (), 'timestamp'),
+            0x401: (self.decode_gps_extended, (), 'gps'),
+            0x419: (self.decode_position_covariance_type, (), 'covariance'),
+            0x421: (self.decode_canlogging_status, (), 'canlogging'),
+        }
 
-        except Exception as e:
-            print(f"Failed to decode CAN message ID 0x{can_id:03X}: {e}")
-    # IMU 解碼函數
-    def decode_lsm6_accelerometer(self, data):
-        """解碼 LSM6DSOX 加速度計數據 (0x180)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數
-            ax_raw, ay_raw, az_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 轉換回 m/s² (scale_factor = 1000 / 9.80665)
-            scale_factor = 1000
-            ax = ax_raw / scale_factor
-            ay = ay_raw / scale_factor
-            az = az_raw / scale_factor
-            
-            current_time = time.time()
-            self.data_store['imu']['lsm6_accel']['x'] = ax
-            self.data_store['imu']['lsm6_accel']['y'] = ay
-            self.data_store['imu']['lsm6_accel']['z'] = az
-            self.data_store['imu']['last_update'] = current_time
+        # Position covariance (0x410 ~ 0x418)，index 預先綁定
+        for index in range(9):
+            table[0x410 + index] = (self.decode_position_covariance, (index,), 'covariance')
 
-    def decode_lsm303_accelerometer(self, data):
-        """解碼 LSM303AGR 加速度計數據 (0x181)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數
-            ax_raw, ay_raw, az_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 轉換回 mm/s² (scale_factor = 1000)
-            scale_factor = 1000
-            ax = ax_raw / scale_factor
-            ay = ay_raw / scale_factor
-            az = az_raw / scale_factor
-            
-            current_time = time.time()
-            self.data_store['imu']['lsm303_accel']['x'] = ax
-            self.data_store['imu']['lsm303_accel']['y'] = ay
-            self.data_store['imu']['lsm303_accel']['z'] = az
-            self.data_store['imu']['last_update'] = current_time
+        # 網路描述檔中的訊息，目標 dict 預先解析（例如 inverter 編號）
+        for name, message in self.messages.items():
+            decoder = self.decoders[name]
+            for can_id, index in message['ids'].items():
+                target = self._resolve_path(message['target'], index)
+                stamp = self._resolve_path(message['stamp'], index)
+                table[can_id] = (decoder, (target, stamp), message['target'][0])
 
-    def decode_angular_velocity(self, data):
-        """解碼角速度數據 (0x280)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數
-            gx_raw, gy_raw, gz_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 轉換回 rad/s (scale_factor = 10 * 57.2958)
-            scale_factor = 10 * 57.2958
-            gx = gx_raw / scale_factor
-            gy = gy_raw / scale_factor
-            gz = gz_raw / scale_factor
-            
-            current_time = time.time()
-            self.data_store['imu']['gyro']['x'] = gx
-            self.data_store['imu']['gyro']['y'] = gy
-            self.data_store['imu']['gyro']['z'] = gz
-            self.data_store['imu']['last_update'] = current_time
+        return table
 
-    def decode_euler_angles(self, data):
-        """解碼歐拉角數據 (0x380)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數
-            roll_raw, pitch_raw, yaw_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 轉換回度數 (scale_factor = 100)
-            roll = roll_raw / 100.0
-            pitch = pitch_raw / 100.0
-            yaw = yaw_raw / 100.0
-            
-            current_time = time.time()
-            self.data_store['imu']['euler_angles']['roll'] = roll
-            self.data_store['imu']['euler_angles']['pitch'] = pitch
-            self.data_store['imu']['euler_angles']['yaw'] = yaw
-            self.data_store['imu']['last_update'] = current_time
+    def process_can_message(self, msg: can.Message):
+        """解碼一個 CAN 訊息，回傳更新的 data_store 頂層欄位（未知 ID 回傳 None）"""
+        can_id = msg.arbitration_id
 
-    def decode_magnetometer(self, data):
-        """解碼磁力計數據 (0x430)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數
-            mx_raw, my_raw, mz_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 轉換回 μT (scale_factor = 10)
-            mx = mx_raw / 10.0
-            my = my_raw / 10.0
-            mz = mz_raw / 10.0
-            
-            current_time = time.time()
-            self.data_store['imu']['magnetometer']['x'] = mx
-            self.data_store['imu']['magnetometer']['y'] = my
-            self.data_store['imu']['magnetometer']['z'] = mz
-            self.data_store['imu']['last_update'] = current_time
-
-    # IMU2 解碼函數
-    def decode_imu2_acceleration(self, data):
-        """解碼 IMU2 加速度計數據 (0x188)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數 (little-endian)
-            ax_raw, ay_raw, az_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 根據圖片顯示，單位是 g/LSB (signed)
-            # 直接使用原始值，因為已經是以 g 為單位
-            ax = ax_raw * 0.001  # 將 LSB 轉換為 g
-            ay = ay_raw * 0.001
-            az = az_raw * 0.001
-            
-            current_time = time.time()
-            self.data_store['imu2']['acceleration']['x'] = ax
-            self.data_store['imu2']['acceleration']['y'] = ay
-            self.data_store['imu2']['acceleration']['z'] = az
-            self.data_store['imu2']['last_update'] = current_time
+        # 單次查表，未知 ID 直接略過
+        entry = self._dispatch.get(can_id)
+        if entry is None:
+            return None
 
-    def decode_imu2_gyration(self, data):
-        """解碼 IMU2 陀螺儀數據 (0x288)"""
-        if len(data) >= 6:
-            # 解包 3 個 16-bit 有號整數 (little-endian)
-            gx_raw, gy_raw, gz_raw = struct.unpack('<hhh', data[0:6])
-            
-            # 根據圖片顯示，單位是 deg/s/LSB (signed)
-            # 直接使用原始值，因為已經是以 deg/s 為單位
-            gx = gx_raw * 0.1  # 將 LSB 轉換為 deg/s
-            gy = gy_raw * 0.1
-            gz = gz_raw * 0.1
-            
-            current_time = time.time()
-            self.data_store['imu2']['gyration']['x'] = gx
-            self.data_store['imu2']['gyration']['y'] = gy
-            self.data_store['imu2']['gyration']['z'] = gz
-            self.data_store['imu2']['last_update'] = current_time
-
-    def decode_imu2_quaternion(self, data):
-        """解碼 IMU2 四元數數據 (0x488)"""
-        if len(data) >= 8:
-            # 解包 4 個 16-bit 有號整數 (little-endian)
-            qw_raw, qx_raw, qy_raw, qz_raw = struct.unpack('<hhhh', data[0:8])
-            
-            # 四元數通常歸一化，範圍在 -1 到 1 之間
-            # 假設原始值需要除以某個縮放因子來歸一化
-            scale_factor = 16384.0  # 常見的四元數縮放因子 (2^14)
-            qw = qw_raw / scale_factor
-            qx = qx_raw / scale_factor
-            qy = qy_raw / scale_factor
-            qz = qz_raw / scale_factor
-            
-            current_time = time.time()
-            self.data_store['imu2']['quaternion']['w'] = qw
-            self.data_store['imu2']['quaternion']['x'] = qx
-            self.data_store['imu2']['quaternion']['y'] = qy
-            self.data_store['imu2']['quaternion']['z'] = qz
-            self.data_store['imu2']['last_update'] = current_time
+        decoder, args, section = entry
+        self.dirty.add(section)
+        try:
+            decoder(msg.data, *args)
+        except Exception as e:
+            print(f"Failed to decode CAN message ID 0x{can_id:03X}: {e}")
+        else:
+            if self.history is not None:
+                self.history.record(can_id)
+        return section
+
+    def decode_batch(self, ids, payloads, timestamps, lengths=None):
+        """整批解碼整個記錄檔（需要 NumPy），詳見 CanBatch.decode_batch"""
+        from CanBatch import decode_batch
+        return decode_batch(ids, payloads, timestamps, lengths, network_file=self.network_file)
 
+    # IMU / IMU2 數據讀取
     def get_imu_data(self):
         """獲取所有 IMU 數據"""
         return self.data_store['imu'].copy()
@@ -399,73 +258,40 @@ class CanDecoder:
 
 
 
+
+
 # define all decode functions
     def decode_timestamp(self, data):
         if len(data) >= 6:
-            ms_since_midnight = struct.unpack('<I', data[0:4])[0]
-            days_since_1984 = struct.unpack('<H', data[4:6])[0]
+            ms_since_midnight, days_since_1984 = _TIMESTAMP.unpack_from(data, 0)
             
             base_timestamp = 441763200
             total_seconds = base_timestamp + (days_since_1984 * 86400) + (ms_since_midnight / 1000.0)
             decoded_time = datetime.fromtimestamp(total_seconds)
             
-            current_time = time.time()
-            self.data_store['timestamp']['time'] = decoded_time
-            self.data_store['timestamp']['last_update'] = current_time
-
-    def decode_vcu_cockpit(self, data):
-        if len(data) >= 8:
-            stear_raw = struct.unpack('<h', data[0:2])[0]
-            accel_raw = data[2] 
-            apps1_raw = data[3]
-            apps2_raw = data[4]
-            brake_raw = data[5]
-            bse1_raw = data[6]
-            bse2_raw = data[7]
-            stear_data = stear_raw *100
-            # 更新 VCU 數據
-            current_time = time.time()
-            self.data_store['vcu']['steer'] = stear_data / 10000
-            self.data_store['vcu']['accel'] = accel_raw
-            self.data_store['vcu']['apps1'] = apps1_raw
-            self.data_store['vcu']['apps2'] = apps2_raw
-            self.data_store['vcu']['brake'] = brake_raw
-            self.data_store['vcu']['bse1'] = bse1_raw
-            self.data_store['vcu']['bse2'] = bse2_raw
-            self.data_store['vcu']['last_update'] = current_time
-
-    def decode_gps_basic(self, data):
-        if len(data) >= 8:
-            lat_raw = struct.unpack('<i', data[0:4])[0]
-            self.gps_lat = lat_raw / 10**7
-            
-            lon_raw = struct.unpack('<i', data[4:8])[0]
-            self.gps_lon = lon_raw / 10**7
-            
-            current_time = time.time()
-            self.data_store['gps']['lat'] = self.gps_lat
-            self.data_store['gps']['lon'] = self.gps_lon
-            self.data_store['gps']['last_update'] = current_time
+            timestamp = self.data_store['timestamp']
+            timestamp.time = decoded_time
+            timestamp.last_update = time.time()
 
     def decode_gps_extended(self, data):
         if len(data) >= 2:
-            alt_raw = struct.unpack('<h', data[0:2])[0]
+            alt_raw = _INT16.unpack_from(data, 0)[0]
             status_byte = data[2] if len(data) > 2 else 0
             self.gps_alt = float(alt_raw)
             
-            current_time = time.time()
-            self.data_store['gps']['alt'] = self.gps_alt
-            self.data_store['gps']['status'] = status_byte
-            self.data_store['gps']['last_update'] = current_time
+            gps = self.data_store['gps']
+            gps.alt = self.gps_alt
+            gps.status = status_byte
+            gps.last_update = time.time()
 
     def decode_position_covariance(self, data, index):
         if len(data) >= 8 and 0 <= index < 9:
-            covariance_value = struct.unpack('<d', data[0:8])[0]
+            covariance_value = _DOUBLE.unpack_from(data, 0)[0]
             self.position_covariance[index] = covariance_value
 
     def decode_position_covariance_type(self, data):
         if len(data) >= 1:
-            self.position_covariance_type = struct.unpack('<B', data[0:1])[0]
+            self.position_covariance_type = data[0]
             
             covariance_types = {
                 0: "UNKNOWN",
@@ -475,256 +301,42 @@ class CanDecoder:
             }
             type_name = covariance_types.get(self.position_covariance_type, "UNKNOWN")
             
-            current_time = time.time()
-            self.data_store['covariance']['type'] = self.position_covariance_type
-            self.data_store['covariance']['type_name'] = type_name
-            self.data_store['covariance']['last_update'] = current_time
-
-    def decode_velocity_x(self, data):
-        if len(data) >= 4:
-            vx_raw = struct.unpack('<i', data[0:4])[0]
-            vx = vx_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['linear_x'] = vx
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_velocity_y(self, data):
-        if len(data) >= 4:
-            vy_raw = struct.unpack('<i', data[0:4])[0]
-            vy = vy_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['linear_y'] = vy
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_velocity_z(self, data):
-        if len(data) >= 4:
-            vz_raw = struct.unpack('<i', data[0:4])[0]
-            vz = vz_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['linear_z'] = vz
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_angular_x(self, data):
-        if len(data) >= 4:
-            wx_raw = struct.unpack('<i', data[0:4])[0]
-            wx = wx_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['angular_x'] = wx
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_angular_y(self, data):
-        if len(data) >= 4:
-            wy_raw = struct.unpack('<i', data[0:4])[0]
-            wy = wy_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['angular_y'] = wy
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_angular_z(self, data):
-        if len(data) >= 4:
-            wz_raw = struct.unpack('<i', data[0:4])[0]
-            wz = wz_raw / 1000.0
-            
-            current_time = time.time()
-            self.data_store['velocity']['angular_z'] = wz
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_velocity_magnitude(self, data):
-        if len(data) >= 4:
-            vmag_raw = struct.unpack('<i', data[0:4])[0]
-            vmag = vmag_raw / 1000.0
-            speed_kmh = vmag * 3.6
-            
-            current_time = time.time()
-            self.data_store['velocity']['magnitude'] = vmag
-            self.data_store['velocity']['speed_kmh'] = speed_kmh
-            self.data_store['velocity']['last_update'] = current_time
-
-    def decode_cell_voltage(self, data):
-        if len(data) >= 8:
-            # 第一個位元組是 index (0, 7, 14, 21, ..., 98)
-            index = data[0]
-            
-            # 驗證 index 是否有效 (應該是 7 的倍數且 <= 98)
-            if index % 7 != 0 or index > 98:
-                print(f"[ACCUMULATOR] Invalid cell voltage index: {index}")
-                return
-            
-            # 接下來 7 個位元組是電壓數值
-            voltages = []
-            for i in range(1, min(8, len(data))):
-                voltage = data[i] * 0.02  # 20mV/LSB
-                voltages.append(voltage)
-            
-            # 更新一維陣列中對應位置的數值
-            current_time = time.time()
-            for i, voltage in enumerate(voltages):
-                array_index = index + i
-                if array_index < 105:  # 確保不超出陣列範圍
-                    self.data_store['accumulator']['cell_voltages'][array_index] = voltage
-            
-            self.data_store['accumulator']['last_update'] = current_time
-
-    def decode_accumulator_temperature(self, data):
-        if len(data) >= 8:
-            # 第一個位元組是 index (0, 7, 14, 21, ..., 98)
-            index = data[0]
-            
-            # 驗證 index 是否有效 (應該是 7 的倍數且 <= 98)
-            if index % 7 != 0 or index > 217:
-                print(f"[ACCUMULATOR] Invalid temperature index: {index}")
-                return
-            
-            # 接下來 7 個位元組是溫度數值
-            temperatures = []
-            for i in range(1, min(8, len(data))):
-                temp = data[i] - 32  
-                temperatures.append(temp)
-            
-            current_time = time.time()
-            for i, temp in enumerate(temperatures):
-                array_index = index + i
-                if array_index < 224: 
-                    self.data_store['accumulator']['cell_temperatures'][array_index] = temp
-
-            self.data_store['accumulator']['last_update'] = current_time
-
-    def decode_accumulator_heartbeat(self, data):
-        if len(data) >= 1:
-            heartbeat = data[0] == 0x7F
-            
-            current_time = time.time()
-            self.data_store['accumulator']['heartbeat'] = heartbeat
-            self.data_store['accumulator']['last_update'] = current_time
-
-    def decode_accumulator_status(self, data):
-        if len(data) >= 7:
-            status = data[0]
-            temp_raw = struct.unpack('<h', data[1:3])[0]
-            voltage_raw = struct.unpack('<I', data[3:7])[0] if len(data) >= 7 else 0
-            
-            temperature = temp_raw * 0.125
-            voltage = voltage_raw / 1024.0
-            
-            current_time = time.time()
-            self.data_store['accumulator']['status'] = status
-            self.data_store['accumulator']['temperature'] = temperature
-            self.data_store['accumulator']['voltage'] = voltage
-            self.data_store['accumulator']['last_update'] = current_time
-
-    def decode_accumulator_state(self, data):
-        if len(data) >= 5:
-            soc = data[0]
-            current_raw = struct.unpack('<h', data[1:3])[0]
-            capacity_raw = struct.unpack('<h', data[3:5])[0] if len(data) >= 5 else 0
-            
-            current = current_raw * 0.01
-            capacity = capacity_raw * 0.01
-            
-            current_time = time.time()
-            self.data_store['accumulator']['soc'] = soc
-            self.data_store['accumulator']['current'] = current
-            self.data_store['accumulator']['capacity'] = capacity
-            self.data_store['accumulator']['last_update'] = current_time
-
-    def decode_inverter_status(self, data, inv_num):
-        if len(data) >= 6:
-            status_word1 = data[0]
-            status_word2 = data[1]
-            feedback_torque_raw = struct.unpack('<h', data[2:4])[0]
-            speed_raw = struct.unpack('<h', data[4:6])[0]
-            feedback_torque = feedback_torque_raw / 1000.0 * 25
-            speed = speed_raw
-            
-            if inv_num in self.data_store['inverters']:
-                current_time = time.time()
-                self.data_store['inverters'][inv_num]['status'] = (status_word1, status_word2) 
-                self.data_store['inverters'][inv_num]['torque'] = feedback_torque
-                self.data_store['inverters'][inv_num]['speed'] = speed
-                self.data_store['inverters'][inv_num]['last_update'] = current_time
-
-    def decode_inverter_state(self, data, inv_num):
-        if len(data) >= 4:
-            dc_voltage_raw = struct.unpack('<H', data[0:2])[0]
-            dc_current_raw = struct.unpack('<H', data[2:4])[0]
-            
-            dc_voltage = dc_voltage_raw / 100.0
-            dc_current = dc_current_raw / 100.0
-            
-            if inv_num in self.data_store['inverters']:
-                current_time = time.time()
-                self.data_store['inverters'][inv_num]['dc_voltage'] = dc_voltage
-                self.data_store['inverters'][inv_num]['dc_current'] = dc_current
-                self.data_store['inverters'][inv_num]['last_update'] = current_time
-
-    def decode_inverter_temperature(self, data, inv_num):
-        if len(data) >= 6:
-            inv_mos_temp_raw = struct.unpack('<h', data[0:2])[0]
-            mcu_temp_raw = struct.unpack('<h', data[2:4])[0]
-            motor_temp_raw = struct.unpack('<h', data[4:6])[0]
-            
-            inv_mos_temp = inv_mos_temp_raw * 0.1
-            mcu_temp = mcu_temp_raw * 0.1
-            motor_temp = motor_temp_raw * 0.1
-            
-            if inv_num in self.data_store['inverters']:
-                current_time = time.time()
-                self.data_store['inverters'][inv_num]['mos_temp'] = inv_mos_temp
-                self.data_store['inverters'][inv_num]['mcu_temp'] = mcu_temp
-                self.data_store['inverters'][inv_num]['motor_temp'] = motor_temp
-                self.data_store['inverters'][inv_num]['last_update'] = current_time
-
-    def decode_inverter_heartbeat(self, data, inv_num):
-        if len(data) >= 1:
-            heartbeat = data[0] == 0x05
-            
-            if inv_num in self.data_store['inverters']:
-                current_time = time.time()
-                self.data_store['inverters'][inv_num]['heartbeat'] = heartbeat
-                self.data_store['inverters'][inv_num]['last_update'] = current_time
-
-    def decode_inverter_control(self, data, inv_num):
-        if len(data) >= 4:
-            control_word = struct.unpack('<H', data[0:2])[0]
-            target_torque_raw = struct.unpack('<h', data[2:4])[0]
-            target_torque = target_torque_raw / 1000.0 * 20
-            
-            if inv_num in self.data_store['inverters']:
-                current_time = time.time()
-                self.data_store['inverters'][inv_num]['control_word'] = control_word
-                self.data_store['inverters'][inv_num]['target_torque'] = target_torque
-                self.data_store['inverters'][inv_num]['last_update'] = current_time
+            covariance = self.data_store['covariance']
+            covariance.type = self.position_covariance_type
+            covariance.type_name = type_name
+            covariance.last_update = time.time()
 
     def decode_canlogging_status(self, data):
         """解碼 CAN Logging 狀態 (0x421)"""
         if len(data) >= 1:
             status_byte = data[0]
             current_time = time.time()
+            canlogging = self.data_store['canlogging']
             
             if status_byte == 0x01:
                 # 正在記錄，解析開始時間
                 if len(data) >= 5:
                     # 從 bytes 1-4 重建 timestamp (little-endian)
-                    timestamp = (data[4] << 24) | (data[3] << 16) | (data[2] << 8) | data[1]
+                    timestamp = _UINT32.unpack_from(data, 1)[0]
                     start_time = datetime.fromtimestamp(timestamp)
                     
-                    self.data_store['canlogging']['is_recording'] = True
-                    self.data_store['canlogging']['start_time'] = start_time
-                    self.data_store['canlogging']['start_timestamp'] = timestamp
+                    canlogging.is_recording = True
+                    canlogging.start_time = start_time
+                    canlogging.start_timestamp = timestamp
                 else:
                     # 沒有時間資訊，只設定狀態
-                    self.data_store['canlogging']['is_recording'] = True
+                    canlogging.is_recording = True
                     
             elif status_byte == 0x00:
                 # 未記錄
-                self.data_store['canlogging']['is_recording'] = False
-                self.data_store['canlogging']['start_time'] = None
-                self.data_store['canlogging']['start_timestamp'] = None
+                canlogging.is_recording = False
+                canlogging.start_time = None
+                canlogging.start_timestamp = None
+
+            # bytes 5-7: logger 丟包計數 (dropped u16 LE, overrun 次數 u8)
+            if len(data) >= 8:
+                canlogging.dropped_frames = _UINT16.unpack_from(data, 5)[0]
+                canlogging.overruns = data[7]
             
-            self.data_store['canlogging']['last_update'] = current_time
+            canlogging.last_update = current_time
 
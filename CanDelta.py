@@ -0,0 +1,219 @@
+"""
+WebSocket delta encoding
+
+連線時送一次完整狀態，之後每個 tick 只送與上次送出內容不同的欄位：
+    {"type": "snapshot", "seq": n, "data": {...}}
+    {"type": "delta", "seq": n, "changes": {...}}
+
+changes 與完整資料同樣是巢狀 dict；長度不變的 list 只送有變動的元素，
+以 {"$i": {"<索引>": 值}} 表示（例如 105 個電芯電壓只送變動的幾個）。
+欄位不會被移除，client 直接把 changes 合併進上一份資料即可。
+
+seq 每送出一個 delta 加一，client 發現不連續時送 {"type": "resync"}，
+server 再回一個 snapshot。
+
+訊息可用 encode()（JSON 文字）或 encode_msgpack()（MessagePack 二進位，
+/ws?format=msgpack）序列化；後者把電芯電壓 / 溫度這類長的數值 list 打包成
+float32 陣列（ext type 1，None 以 NaN 表示），解碼見 static/msgpack.js。
+"""
+
+import copy
+import json
+import math
+import struct
+import sys
+from array import array
+from datetime import datetime
+
+from CanState import State, array_list
+
+try:
+    import orjson
+except ImportError:  # orjson 為選用，沒有時用標準 json
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack 為選用，沒有時 format=msgpack 的 client 收到 JSON
+    msgpack = None
+
+LIST_INDEX = '$i'
+
+# 至少這麼長、且只有數值 / None 的 list 才打包成 float32 陣列
+FLOAT32_ARRAY_MIN = 16
+FLOAT32_ARRAY_EXT = 1
+
+_MISSING = object()
+
+# 以 {"$i": ...} 只送變動元素的序列（電芯數值在 CanDecoder 中是 array）
+_SEQUENCES = (list, array)
+
+
+def _json_default(value):
+    # CanDecoder 的 __slots__ 狀態與電芯 array 序列化成原本的 dict / list
+    if isinstance(value, State):
+        return value.as_dict()
+    if isinstance(value, array):
+        return array_list(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def encode(message):
+    """序列化成精簡的 JSON 字串（datetime 轉為 ISO 格式），有 orjson 時使用 orjson"""
+    if orjson is not None:
+        return orjson.dumps(message, default=_json_default,
+                            option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(message, default=_json_default, separators=(',', ':'))
+
+
+def _float32_array(items):
+    """數值 list 打包成 float32 ext（None 以 NaN 表示），不是數值 list 時原樣回傳"""
+    try:
+        return msgpack.ExtType(FLOAT32_ARRAY_EXT, struct.pack(f'<{len(items)}f', *items))
+    except (struct.error, TypeError):
+        if None not in items:
+            return items
+    try:
+        return msgpack.ExtType(FLOAT32_ARRAY_EXT, struct.pack(
+            f'<{len(items)}f', *[math.nan if item is None else item for item in items]))
+    except (struct.error, TypeError):
+        return items
+
+
+def _array_ext(values):
+    """array('d') 直接轉成 float32 ext（NaN 即為 None），不經過 Python 的 list"""
+    if values.typecode != 'd':
+        # 整數 array 的 MISSING_INT 先轉回 None
+        return _float32_array(array_list(values))
+    floats = array('f', values)
+    if sys.byteorder != 'little':
+        floats.byteswap()
+    return msgpack.ExtType(FLOAT32_ARRAY_EXT, floats.tobytes())
+
+
+def _pack_arrays(node):
+    """把 dict 樹中長的數值 list / array 換成 float32 ext；只複製有替換的 dict，原本的 dict 不修改"""
+    if isinstance(node, State):
+        node = node.as_dict()
+    packed = None
+    for key, value in node.items():
+        if isinstance(value, (dict, State)):
+            new = _pack_arrays(value)
+        elif isinstance(value, list) and len(value) >= FLOAT32_ARRAY_MIN:
+            new = _float32_array(value)
+        elif isinstance(value, array):
+            new = _array_ext(value) if len(value) >= FLOAT32_ARRAY_MIN else array_list(value)
+        else:
+            continue
+        if new is not value:
+            if packed is None:
+                packed = dict(node)
+            packed[key] = new
+    return node if packed is None else packed
+
+
+def encode_msgpack(message):
+    """序列化成 MessagePack bytes；沒有安裝 msgpack 時退回 encode() 的 JSON 文字"""
+    if msgpack is None:
+        return encode(message)
+    return msgpack.packb(_pack_arrays(message), default=_json_default)
+
+
+def _same(old, new):
+    if old is new:
+        return True
+    if type(old) is not type(new):
+        return False
+    if old == new:
+        return True
+    # NaN 視為沒有變動，避免每個 tick 重送
+    return old != old and new != new
+
+
+def _diff(state, new):
+    """比較 new 與 state（上次送出的內容），把 state 就地更新成 new，回傳變動的部分"""
+    changes = {}
+    is_dict = isinstance(new, (dict, State))
+    items = new.items() if is_dict else enumerate(new)
+    for key, value in items:
+        old = state.get(key, _MISSING) if is_dict else state[key]
+        if isinstance(value, (dict, State)) and isinstance(old, (dict, State)):
+            change = _diff(old, value)
+            if change:
+                changes[key] = change
+        elif isinstance(value, _SEQUENCES) and isinstance(old, _SEQUENCES) and len(value) == len(old):
+            change = _diff(old, value)
+            if change:
+                changes[key] = {LIST_INDEX: change}
+        elif not _same(old, value):
+            value = copy.deepcopy(value)
+            state[key] = value
+            changes[key] = value
+    return changes
+
+
+def merge_changes(pending, changes):
+    """把 changes 合併進 pending（累積數個 tick 的 delta 再一起送），不修改 changes"""
+    for key, value in changes.items():
+        current = pending.get(key)
+        if isinstance(value, dict):
+            if isinstance(current, dict):
+                merge_changes(current, value)
+            elif isinstance(current, _SEQUENCES) and LIST_INDEX in value:
+                current = pending[key] = list(current)
+                for index, item in value[LIST_INDEX].items():
+                    current[index] = item
+            else:
+                pending[key] = merge_changes({}, value)
+        else:
+            pending[key] = value
+    return pending
+
+
+class DeltaEncoder:
+    """
+    記住上次送出的狀態，產生 snapshot / delta 訊息
+
+    volatile 中的欄位（例如 update_time）每次都會變，只在其他欄位也有變動時
+    才一起送出，畫面完全沒變時不送任何訊息。
+    """
+
+    def __init__(self, volatile=()):
+        self.volatile = tuple(volatile)
+        self.state = None
+        self.seq = 0
+
+    def reset(self):
+        """丟掉基準狀態（沒有 delta client 時呼叫，下一個 snapshot 重新建立）"""
+        self.state = None
+
+    def snapshot(self, data):
+        """目前基準狀態的 snapshot 訊息；還沒有基準時以 data 建立"""
+        if self.state is None:
+            self.state = copy.deepcopy(data)
+        return {'type': 'snapshot', 'seq': self.seq, 'data': self.state}
+
+    def delta(self, data, keys=None):
+        """
+        與上次送出的狀態比較，回傳 delta 訊息，沒有變動時回傳 None
+
+        keys: 需要比較的頂層欄位（例如 CanDecoder.take_dirty() 的結果），
+              None 表示全部比較；未列出的欄位視為沒有變動
+        """
+        if self.state is None:
+            self.state = copy.deepcopy(data)
+            return None
+
+        volatile = self.volatile
+        if keys is None:
+            keys = data.keys()
+        current = {key: data[key] for key in keys if key in data and key not in volatile}
+        changes = _diff(self.state, current)
+        if not changes:
+            return None
+        changes.update(_diff(self.state, {key: data[key] for key in volatile if key in data}))
+
+        self.seq += 1
+        return {'type': 'delta', 'seq': self.seq, 'changes': changes}
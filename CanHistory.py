@@ -0,0 +1,433 @@
+"""
+Signal history ring buffers
+
+CanDecoder.enable_history() 之後，網路描述檔中每個數值欄位（不含 equals 布林
+欄位、tuple 欄位與電芯陣列）都有一個固定容量的 ring buffer，記錄最近
+HISTORY_SECONDS 秒的 (last_update, 值)。時間與數值存在 array('d') 中，
+不會為每個樣本建立 Python 物件；ring 在用到時才成長到容量上限，沒有出現的
+訊號不佔記憶體。
+
+較長的時間範圍由多解析度的 min / max tier 提供（HISTORY_TIERS）：第一層每個
+樣本進來時更新目前的 bucket，bucket 關閉時併入下一層，每層只保留每個 bucket
+的最小值與最大值（與出現順序），峰值不會被平均掉。
+
+訊號名稱為 data_store 路徑加欄位名稱，以 '.' 連接，例如 inverters.3.torque、
+imu2.acceleration.x。query() 回傳欄位式（columnar）的精簡格式，供
+/api/history 讓圖表重新連線時直接補上最近的資料：
+    {"t0": 1700000000.0,
+     "signals": {"inverters.3.torque": {"t": [0, 12, 25, ...], "v": [1.5, ...]}}}
+t 為相對 t0（回傳樣本中最早的時間）的毫秒數（整數）。範圍內的樣本超過
+max_points 時，每個訊號改回傳 min / max 降採樣的結果，並附上
+"resolution"（每段的秒數）。
+
+解碼在另一個 process 時（CanIngest daemon、CanWorker.DecodeWorker），該 process 的
+decoder 以 SignalJournal 累積每個 frame 的新樣本，隨狀態一起發布；web process 以
+SignalHistory.merge() 併入自己的 ring，不會只剩發布頻率的快照而漏掉峰值。
+"""
+
+import time
+from array import array
+from bisect import bisect_right
+from operator import attrgetter, itemgetter
+
+from CanState import State
+
+# 每個訊號保留的原始樣本時間長度（秒）與最多樣本數（先到者為準）
+HISTORY_SECONDS = 300.0
+HISTORY_CAPACITY = 16384
+
+# 多解析度 min / max tier：(bucket 寬度秒數, bucket 數)，每層寬度需為前一層的整數倍
+# 0.5 s x 4096 約 34 分鐘、4 s x 4096 約 4.5 小時、32 s x 4096 約 36 小時
+HISTORY_TIERS = ((0.5, 4096), (4.0, 4096), (32.0, 4096))
+
+# query() 每個訊號最多回傳的點數（0 表示不降採樣，只回傳原始樣本）
+MAX_POINTS = 2000
+
+
+def _ring_slice(keys, columns, head, start):
+    """ring 中 key 大於 start 的部分，依時間順序回傳各 column 的切片（keys 依序遞增，head 為最舊的位置）"""
+    if not head:
+        i = bisect_right(keys, start)
+        return [column[i:] for column in columns]
+    if start >= keys[0]:
+        # 全部在較新的那一段 [0, head)
+        i = bisect_right(keys, start, 0, head)
+        return [column[i:head] for column in columns]
+    i = bisect_right(keys, start, head)
+    return [column[i:] + column[:head] for column in columns]
+
+
+def _minmax(times, values, groups):
+    """依時間平均分成 groups 段，每段保留 min 與 max（依出現順序），回傳 (times, values, 每段秒數)"""
+    first = times[0]
+    width = (times[-1] - first) / groups or 1.0
+    out_times, out_values = array('d'), array('d')
+
+    def emit():
+        if low_time == high_time:
+            out_times.append(low_time)
+            out_values.append(low)
+        elif low_time < high_time:
+            out_times.extend((low_time, high_time))
+            out_values.extend((low, high))
+        else:
+            out_times.extend((high_time, low_time))
+            out_values.extend((high, low))
+
+    current = None
+    for t, value in zip(times, values):
+        group = int((t - first) / width)
+        if group != current:
+            if current is not None:
+                emit()
+            current = group
+            low = high = value
+            low_time = high_time = t
+            continue
+        if value < low:
+            low, low_time = value, t
+        if value > high:
+            high, high_time = value, t
+    emit()
+    return out_times, out_values, width
+
+
+class MinMaxTier:
+    """固定寬度 bucket 的 min / max ring；add() 在目前的 bucket 關閉時回傳它，交給下一層合併"""
+
+    __slots__ = ('width', 'capacity', 'starts', 'lows', 'highs', 'orders', 'head',
+                 'bucket', 'low', 'low_time', 'high', 'high_time')
+
+    def __init__(self, width, capacity):
+        self.width = width
+        self.capacity = capacity
+        self.clear()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def clear(self):
+        self.starts = array('d')
+        self.lows = array('d')
+        self.highs = array('d')
+        self.orders = array('b')  # 1 表示 max 比 min 先出現
+        self.head = 0
+        self.bucket = None  # 目前（尚未關閉）的 bucket 編號
+        self.low = self.low_time = self.high = self.high_time = 0.0
+
+    @property
+    def open_start(self):
+        """目前 bucket 的開始時間；這之後的資料還沒有進到這一層"""
+        return None if self.bucket is None else self.bucket * self.width
+
+    def covers(self, start):
+        """start 之後的資料是否都還在這一層"""
+        return len(self.starts) < self.capacity or self.starts[self.head] <= start
+
+    def add(self, low_time, low, high_time, high):
+        """併入一個樣本或前一層關閉的 bucket，目前的 bucket 關閉時回傳 (low_time, low, high_time, high)"""
+        bucket = int(low_time // self.width)
+        if bucket == self.bucket:
+            if low < self.low:
+                self.low, self.low_time = low, low_time
+            if high > self.high:
+                self.high, self.high_time = high, high_time
+            return None
+        closed = self._close() if self.bucket is not None else None
+        self.bucket = bucket
+        self.low, self.low_time, self.high, self.high_time = low, low_time, high, high_time
+        return closed
+
+    def _close(self):
+        start = self.bucket * self.width
+        order = 1 if self.high_time < self.low_time else 0
+        starts = self.starts
+        if len(starts) < self.capacity:
+            starts.append(start)
+            self.lows.append(self.low)
+            self.highs.append(self.high)
+            self.orders.append(order)
+        else:
+            head = self.head
+            starts[head] = start
+            self.lows[head] = self.low
+            self.highs[head] = self.high
+            self.orders[head] = order
+            head += 1
+            self.head = 0 if head == self.capacity else head
+        return self.low_time, self.low, self.high_time, self.high
+
+    def points(self, start):
+        """start 之後（含跨過 start）的 bucket 展開成點：先出現的放在 bucket 開頭，後出現的放在 bucket 中間"""
+        starts, lows, highs, orders = _ring_slice(
+            self.starts, (self.starts, self.lows, self.highs, self.orders), self.head, start - self.width)
+        half = self.width / 2
+        times, values = array('d'), array('d')
+        for bucket_start, low, high, order in zip(starts, lows, highs, orders):
+            if low == high:
+                times.append(bucket_start)
+                values.append(low)
+            else:
+                times.extend((bucket_start, bucket_start + half))
+                values.extend((high, low) if order else (low, high))
+        return times, values
+
+
+class SignalRing:
+    """單一訊號的 (時間, 值) ring buffer 與 min / max tier，時間需依序遞增"""
+
+    __slots__ = ('capacity', 'times', 'values', 'head', 'tiers')
+
+    def __init__(self, capacity=HISTORY_CAPACITY, tiers=HISTORY_TIERS):
+        self.capacity = capacity
+        self.times = array('d')
+        self.values = array('d')
+        self.head = 0  # ring 滿了之後，最舊樣本的位置
+        self.tiers = tuple(MinMaxTier(width, size) for width, size in tiers)
+
+    def __len__(self):
+        return len(self.times)
+
+    def append(self, t, value):
+        times = self.times
+        if len(times) < self.capacity:
+            times.append(t)
+            self.values.append(value)
+        else:
+            head = self.head
+            times[head] = t
+            self.values[head] = value
+            head += 1
+            self.head = 0 if head == self.capacity else head
+
+        # 每個樣本只更新第一層，bucket 關閉時才往下一層合併
+        tiers = self.tiers
+        if tiers:
+            closed = tiers[0].add(t, value, t, value)
+            level = 1
+            while closed is not None and level < len(tiers):
+                closed = tiers[level].add(*closed)
+                level += 1
+
+    def clear(self):
+        self.times = array('d')
+        self.values = array('d')
+        self.head = 0
+        for tier in self.tiers:
+            tier.clear()
+
+    @property
+    def latest(self):
+        """最新的樣本時間，沒有樣本時為 None"""
+        return self.times[self.head - 1] if self.times else None
+
+    def covers(self, start):
+        """start 之後的原始樣本是否都還在 ring 中"""
+        return len(self.times) < self.capacity or self.times[self.head] <= start
+
+    @property
+    def oldest(self):
+        """最舊的資料時間（原始樣本或 tier），沒有資料時為 None"""
+        oldest = self.times[self.head] if self.times else None
+        for tier in self.tiers:
+            if tier.starts and (oldest is None or tier.starts[tier.head] < oldest):
+                oldest = tier.starts[tier.head]
+        return oldest
+
+    def since(self, start):
+        """start 之後（不含）的原始樣本 (times, values)，依時間排序；ring 的兩段各自 bisect，不複製整個 ring"""
+        return _ring_slice(self.times, (self.times, self.values), self.head, start)
+
+    def window(self, start, max_points=MAX_POINTS):
+        """
+        start 之後的 (times, values, resolution)，最多 max_points 個點
+
+        原始樣本涵蓋整個範圍時從原始樣本取，否則用涵蓋範圍的最細 tier 加上
+        tier 尚未合併的最近原始樣本；點數仍超過 max_points 時再做 min / max
+        降採樣。resolution 為每段的秒數，原始樣本為 None。
+        """
+        resolution = None
+        if not max_points or not self.tiers or self.covers(start):
+            times, values = self.since(start)
+        else:
+            tier = next((tier for tier in self.tiers if tier.covers(start)), self.tiers[-1])
+            times, values = tier.points(start)
+            open_start = tier.open_start
+            tail_times, tail_values = self.since(start if open_start is None else max(start, open_start))
+            times += tail_times
+            values += tail_values
+            resolution = tier.width
+        if max_points and len(times) > max_points:
+            # 最後一段只含最後一個點，因此分成 max_points // 2 - 1 段
+            times, values, width = _minmax(times, values, max(max_points // 2 - 1, 1))
+            resolution = max(resolution or 0.0, width)
+        return times, values, resolution
+
+
+class SignalHistory:
+    """
+    所有訊號的 ring buffer，以 CAN ID 分組
+
+    add_source() 登記一個 CAN ID 會更新的 target dict 與欄位；record(can_id) 在
+    該 ID 解碼後呼叫，以 stamp 的 last_update 為時間記錄每個欄位的新值。
+    """
+
+    def __init__(self, capacity=HISTORY_CAPACITY, seconds=HISTORY_SECONDS, tiers=HISTORY_TIERS):
+        self.capacity = capacity
+        self.seconds = seconds
+        self.tiers = tuple(tiers)
+        # 可查詢的最長範圍：最粗的 tier 涵蓋的時間
+        self.retention = max([seconds] + [width * size for width, size in self.tiers])
+        self.signals = {}  # 訊號名稱 -> SignalRing
+        # CAN ID -> [target, stamp, 讀取欄位值, 讀取 last_update, (SignalRing, ...), 上次記錄的 last_update]
+        self._sources = {}
+
+    def add_source(self, can_id, path, target, stamp, fields):
+        if not fields:
+            return
+        rings = []
+        for field in fields:
+            name = f"{path}.{field}"
+            ring = self.signals.get(name)
+            if ring is None:
+                ring = self.signals[name] = self._new_signal()
+            rings.append(ring)
+        # 一次 C 呼叫取出所有欄位（多放一次第一個欄位，單一欄位時也回傳 tuple）
+        if isinstance(target, State):
+            getter = attrgetter
+            fields = [target.attribute(field) for field in fields]
+        else:
+            getter = itemgetter
+        stamp_getter = attrgetter if isinstance(stamp, State) else itemgetter
+        self._sources[can_id] = [target, stamp, getter(*fields, fields[0]),
+                                 stamp_getter('last_update'), tuple(rings), None]
+
+    def _new_signal(self):
+        return SignalRing(self.capacity, self.tiers)
+
+    def record(self, can_id):
+        source = self._sources.get(can_id)
+        if source is None:
+            return
+        target, stamp, get_values, get_stamp, rings, last = source
+        t = get_stamp(stamp)
+        # 解碼失敗（資料長度不足）時 last_update 不變，不重複記錄
+        if t is None or t == last:
+            return
+        source[5] = t
+        for ring, value in zip(rings, get_values(target)):
+            if value is not None:
+                ring.append(t, value)
+
+    def record_all(self):
+        """檢查所有來源，記錄 last_update 有變動的（整批寫入 data_store 之後呼叫）"""
+        for can_id in self._sources:
+            self.record(can_id)
+
+    def merge(self, samples):
+        """
+        併入另一個 process 的 SignalJournal.take() 結果 {訊號名稱: (times, values)}；
+        不比 ring 中最新樣本新的略過（重新連上 daemon 時可能重複收到）
+        """
+        signals = self.signals
+        for name, (times, values) in samples.items():
+            ring = signals.get(name)
+            if ring is None:
+                continue
+            latest = ring.latest
+            for t, value in zip(times, values):
+                if latest is None or t > latest:
+                    ring.append(t, value)
+                    latest = t
+
+    def clear(self):
+        """清空所有 ring（replay 跳轉、切換檔案時呼叫，避免時間軸不連續）"""
+        for ring in self.signals.values():
+            ring.clear()
+        for source in self._sources.values():
+            source[5] = None
+
+    def names(self):
+        return sorted(self.signals)
+
+    def match(self, names):
+        """依名稱或前綴（例如 inverters.3）選出訊號"""
+        if names is None:
+            return self.names()
+        selected = []
+        for name in names:
+            if name in self.signals:
+                selected.append(name)
+                continue
+            prefix = name + '.'
+            selected.extend(signal for signal in self.names() if signal.startswith(prefix))
+        return list(dict.fromkeys(selected))
+
+    def query(self, names=None, since=None, now=None, max_points=MAX_POINTS):
+        """
+        回傳 names 中每個訊號在 since 之後的資料（欄位式格式，見模組說明）
+
+        since: None 表示保留範圍內的全部；負數表示 now 之前幾秒；其他為 epoch 秒
+        max_points: 每個訊號最多回傳的點數，0 表示只回傳原始樣本（最近 seconds 秒）
+        """
+        if now is None:
+            now = time.time()
+        start = now - (self.retention if max_points else self.seconds)
+        if since is not None:
+            since = now + since if since < 0 else since
+            start = max(start, since)
+
+        rings = {name: self.signals[name] for name in self.match(names)}
+        # 降採樣的分段從實際有資料的時間開始，不浪費在空白的範圍
+        oldest = min((ring.oldest for ring in rings.values() if ring.oldest is not None), default=None)
+        if oldest is not None and oldest > start:
+            start = oldest - 1e-6
+
+        columns = {name: ring.window(start, max_points) for name, ring in rings.items()}
+        # t0 取最早的樣本，讓毫秒偏移量盡量小
+        t0 = min((times[0] for times, _, _ in columns.values() if times), default=start)
+        signals = {}
+        for name, (times, values, resolution) in columns.items():
+            signal = signals[name] = {'t': [round((t - t0) * 1000) for t in times], 'v': values.tolist()}
+            if resolution is not None:
+                signal['resolution'] = resolution
+        return {'t0': t0, 'signals': signals}
+
+
+class SampleBuffer:
+    """SignalJournal 的訊號：只累積尚未取出的樣本"""
+
+    __slots__ = ('times', 'values')
+
+    def __init__(self):
+        self.clear()
+
+    def append(self, t, value):
+        self.times.append(t)
+        self.values.append(value)
+
+    def clear(self):
+        self.times = array('d')
+        self.values = array('d')
+
+
+class SignalJournal(SignalHistory):
+    """
+    不保留歷史，只累積上次 take() 之後每個訊號的新樣本（CanIngest daemon 的 decoder 用），
+    由 web process 的 SignalHistory.merge() 併入，每個 frame 的樣本與峰值都保留
+    """
+
+    def __init__(self):
+        super().__init__(capacity=0, seconds=0.0, tiers=())
+
+    def _new_signal(self):
+        return SampleBuffer()
+
+    def take(self):
+        """取出並清空新樣本，回傳 {訊號名稱: (times, values)}（只含有新樣本的訊號）"""
+        samples = {}
+        for name, buffer in self.signals.items():
+            if buffer.times:
+                samples[name] = (buffer.times, buffer.values)
+                buffer.clear()
+        return samples
@@ -0,0 +1,773 @@
+"""
+Single CAN ingest daemon
+
+只有這個 process 開啟 can0 / can1 並執行 CanDecoder，其他工具以便宜的方式接上：
+
+    解碼後的狀態    multiprocessing.shared_memory（STATE_NAME），以 seqlock 保護：
+                    writer 先把 seq 加一（奇數表示寫入中），寫入 pickle 後的
+                    (data_store, 有變動的頂層欄位, 統計, 歷史樣本)，再把 seq 加一；reader 複製前後
+                    seq 相同且為偶數才採用，否則重讀。reader 不需要鎖，也不會拖慢 daemon。
+                    歷史樣本為最近 JOURNAL_PUBLISHES 次發布各自的 SignalJournal.take()
+                    （每個 frame 的數值，見 CanHistory），reader 漏讀幾次發布也能補上。
+    原始 frame      Unix SOCK_SEQPACKET socket（FRAME_SOCKET），每個封包為數筆
+                    CanBinaryLog.RECORD（24 bytes：timestamp µs、CAN ID、flags、bus、DLC、data），
+                    client 可以訂閱部分 ID，也可以請 daemon 代為送出 frame。
+
+啟動 daemon:
+    python CanIngest.py [--channels can0 can1]
+查看狀態:
+    python CanIngest.py status
+
+讀取狀態（例如 CMD_dashboard.py --ingest）:
+    reader = StateReader()
+    state = reader.read()        # 有新狀態時回傳 (data_store, message_count, 發布時間)，否則 None
+
+接收原始 frame（例如 canlogging-v4.py 的 FRAME_SOURCE = "ingest"）:
+    client = FrameClient(filters=id_filters([0x281, 0x420]))
+    for timestamp, msg, bus_num in client.recv(timeout=0.1):
+        ...
+    client.send(can.Message(...), bus_num=0)
+
+訂閱送不出去（client 的 socket buffer 滿了）時丟掉該封包並計數，daemon 不會被慢的 client 阻塞。
+
+同一組名稱只能有一個 daemon：啟動時先以 flock 鎖住 LOCK_DIR/<state name>.lock（內容為 pid），
+已有 daemon 在執行時直接結束，不會搶走 shared memory、socket 與 CAN bus。
+拿得到鎖才表示留下的 shared memory 與 socket 是上一個 daemon 異常結束的殘留，可以清除。
+
+FrameServer 的 socket 權限為 SOCKET_MODE（只有 daemon 的使用者可以連線），並以 SO_PEERCRED
+再檢查一次連線的 uid，其他本機使用者無法訂閱，也無法經由 TRANSMIT 把 frame 送上 bus。
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import pickle
+import selectors
+import signal
+import socket
+import struct
+import sys
+import threading
+import time
+from collections import deque
+
+import can
+
+from CanBinaryLog import FLAG_ERROR, FLAG_EXTENDED, FLAG_FD, FLAG_REMOTE, RECORD, message_flags
+from CanReceiver import CLOCK_SOURCES, TIMESTAMP_KERNEL
+from CanRing import FrameRing, ReceiverThread
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    resource_tracker = shared_memory = None
+
+STATE_NAME = 'rpi_can_state'
+STATE_SIZE = 1 << 20
+# POSIX shared memory 在 Linux 上的位置（用 inode 判斷 segment 是否被重建）
+SHM_DIR = '/dev/shm'
+# reader 檢查 daemon 是否重新啟動的間隔（秒）
+REATTACH_INTERVAL = 1.0
+FRAME_SOCKET = '/tmp/rpi_can_ingest.sock'
+# 單一 daemon 鎖檔的目錄（<state name>.lock）
+LOCK_DIR = '/tmp'
+# FrameServer socket 的權限：只有 daemon 的使用者（與 root）可以連線
+SOCKET_MODE = 0o600
+# SO_PEERCRED 回傳的 struct ucred (pid, uid, gid)
+PEER_CRED = struct.Struct('3i')
+
+# 狀態發布頻率上限 (Hz)，有收到 frame 時才發布
+PUBLISH_RATE = 50.0
+# 每個 bus 的接收 ring 容量
+RING_CAPACITY = 65536
+# 每個 frame 封包最多的紀錄數
+PACKET_RECORDS = 256
+# 每次發布附帶最近幾次發布的歷史樣本（50 Hz 時約 0.5 秒，reader 延遲超過就會漏掉樣本）
+JOURNAL_PUBLISHES = 25
+
+# shared memory 開頭：seq、message_count、發布時間 (epoch 秒)、payload 長度
+SEQ = struct.Struct('<Q')
+STATE_HEADER = struct.Struct('<QQdI')
+PAYLOAD_OFFSET = 64
+
+# client -> daemon 封包類型
+SUBSCRIBE = b'S'  # 後接 '<II' (can_id, can_mask) 的組合，沒有時表示全部
+TRANSMIT = b'T'   # 後接一筆 RECORD
+# daemon -> client 的第一個封包
+HELLO = b'H'      # 後接 JSON {'clock_source', 'buses'}
+
+_FILTER = struct.Struct('<II')
+
+
+def segment_inode(name):
+    """shared memory segment 的 inode，不存在（或不是 Linux）時回傳 None"""
+    try:
+        return os.stat(os.path.join(SHM_DIR, name)).st_ino
+    except OSError:
+        return None
+
+
+def attach_shared_memory(name, track=False):
+    """
+    連上已存在的 shared memory，不交給 resource_tracker 管理
+    （Python < 3.13 的 reader 結束時 resource_tracker 會把 daemon 的 segment 刪掉）
+
+    track=True 用於以 multiprocessing 啟動的 writer（CanWorker）：兩邊共用同一個
+    resource_tracker，取消登記會把 writer 的登記也取消掉
+    """
+    if track:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        try:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+        return shm
+
+
+class InstanceLock:
+    """
+    確保同一個 state name 只有一個 daemon：對鎖檔取得 flock（非阻塞）並寫入 pid。
+    process 結束（包括被 kill -9）時 kernel 會釋放鎖，所以不會留下過期的鎖
+    """
+
+    def __init__(self, state_name=STATE_NAME, lock_dir=LOCK_DIR):
+        self.path = os.path.join(lock_dir, f"{state_name}.lock")
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                owner = os.pread(fd, 32, 0).decode(errors='replace').strip()
+                os.close(fd)
+                raise RuntimeError(f"CAN ingest daemon already running "
+                                   f"(pid {owner or '?'}, lock {self.path})")
+            # 前一個 daemon 可能在我們開檔之後才移除鎖檔，鎖到的是舊檔就重來
+            try:
+                if os.stat(self.path).st_ino == os.fstat(fd).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+        os.ftruncate(fd, 0)
+        os.pwrite(fd, f"{os.getpid()}\n".encode(), 0)
+        self.fd = fd
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+        os.close(self.fd)
+        self.fd = None
+
+
+class StateWriter:
+    """
+    把 data_store 以 seqlock 發布到 shared memory（只能有一個 writer；
+    呼叫前要先取得 InstanceLock，已存在的 segment 才能視為過期而移除）
+    """
+
+    def __init__(self, name=STATE_NAME, size=STATE_SIZE):
+        if shared_memory is None:
+            raise RuntimeError("multiprocessing.shared_memory requires Python 3.8+")
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            # 已持有 InstanceLock：上一個 daemon 沒有正常結束，重新建立
+            old = shared_memory.SharedMemory(name=name)
+            old.close()
+            old.unlink()
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = name
+        self.buffer = self.shm.buf
+        self.capacity = self.shm.size - PAYLOAD_OFFSET
+        self.seq = 0
+        self.published = 0
+        self.too_large = 0
+        STATE_HEADER.pack_into(self.buffer, 0, 0, 0, 0.0, 0)
+
+    def publish(self, data_store, message_count, dirty=None, stats=None, samples=()):
+        """
+        dirty: 上次發布之後有更新的頂層欄位（None 表示全部）；stats: 附帶的統計 dict；
+        samples: [(發布的 seq, SignalJournal.take())]，放不下時只保留最新的一筆
+        """
+        samples = list(samples)
+        payload = pickle.dumps((data_store, dirty, stats, samples), pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.capacity and len(samples) > 1:
+            payload = pickle.dumps((data_store, dirty, stats, samples[-1:]), pickle.HIGHEST_PROTOCOL)
+        length = len(payload)
+        if length > self.capacity:
+            self.too_large += 1
+            if self.too_large == 1:
+                print(f"Warning: state ({length} bytes) does not fit shared memory {self.name}")
+            return False
+
+        buffer = self.buffer
+        seq = self.seq
+        SEQ.pack_into(buffer, 0, seq + 1)  # 奇數：寫入中
+        buffer[PAYLOAD_OFFSET:PAYLOAD_OFFSET + length] = payload
+        STATE_HEADER.pack_into(buffer, 0, seq + 1, message_count, time.time(), length)
+        SEQ.pack_into(buffer, 0, seq + 2)
+        self.seq = seq + 2
+        self.published += 1
+        return True
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class StateReader:
+    """讀取 StateWriter 發布的狀態（不需要鎖，寫入中時重讀）"""
+
+    def __init__(self, name=STATE_NAME, track=False):
+        if shared_memory is None:
+            raise RuntimeError("multiprocessing.shared_memory requires Python 3.8+")
+        self.name = name
+        # 先取 inode 再連上：中間被重建時只會多一次 replaced()，不會漏掉
+        self.inode = segment_inode(name)
+        self.shm = attach_shared_memory(name, track)
+        self.buffer = self.shm.buf
+        self.seq = 0
+        self.retries = 0
+        self.data_store = None
+        self.dirty = None
+        self.stats = None
+        self.samples = []
+        # 漏掉歷史樣本的發布次數（reader 落後超過 JOURNAL_PUBLISHES 次發布）
+        self.missed_samples = 0
+        self.message_count = 0
+        self.published = 0.0
+
+    def replaced(self):
+        """
+        連上的 segment 是否已不是目前的 segment（daemon 重新啟動時會刪除並重建，
+        舊的 mapping 不會再更新）；為 True 時應 close() 後重新建立 StateReader
+        """
+        return self.inode is not None and segment_inode(self.name) != self.inode
+
+    def changed(self):
+        """daemon 是否發布過新的狀態（只讀 seq，不複製）"""
+        return SEQ.unpack_from(self.buffer, 0)[0] != self.seq
+
+    def read_raw(self, max_retries=100):
+        """回傳 (seq, message_count, 發布時間, pickle payload)；沒有新狀態時回傳 None"""
+        buffer = self.buffer
+        for _ in range(max_retries):
+            seq = SEQ.unpack_from(buffer, 0)[0]
+            if seq == self.seq:
+                return None
+            if seq & 1:
+                self.retries += 1
+                time.sleep(0)
+                continue
+            _, message_count, published, length = STATE_HEADER.unpack_from(buffer, 0)
+            if PAYLOAD_OFFSET + length > len(buffer):
+                self.retries += 1
+                continue
+            payload = bytes(buffer[PAYLOAD_OFFSET:PAYLOAD_OFFSET + length])
+            if SEQ.unpack_from(buffer, 0)[0] == seq:
+                return seq, message_count, published, payload
+            self.retries += 1
+        return None
+
+    def read(self):
+        """
+        有新狀態時回傳 (data_store, message_count, 發布時間)，否則回傳 None
+
+        self.dirty 為這次與上次讀到的狀態之間有更新的頂層欄位，中間漏讀過發布
+        （seq 不連續）時為 None，表示全部；self.stats 為 writer 附帶的統計；
+        self.samples 為上次讀取之後每次發布的歷史樣本（SignalHistory.merge() 用）
+        """
+        raw = self.read_raw()
+        if raw is None or raw[0] == 0:
+            return None
+        seq, self.message_count, self.published, payload = raw
+        self.data_store, dirty, self.stats, samples = pickle.loads(payload)
+        self.dirty = dirty if dirty is not None and seq == self.seq + 2 else None
+        self.samples = [journal for published, journal in samples if published > self.seq]
+        if self.seq and samples and samples[0][0] > self.seq + 2:
+            self.missed_samples += (samples[0][0] - self.seq - 2) // 2
+        self.seq = seq
+        return self.data_store, self.message_count, self.published
+
+    def close(self):
+        self.buffer = None
+        self.shm.close()
+
+
+def record_message(timestamp, can_id, flags, dlc, data):
+    """RECORD 欄位轉回 can.Message（timestamp 單位 µs）"""
+    return can.Message(timestamp=timestamp / 1000000, arbitration_id=can_id,
+                       is_extended_id=bool(flags & FLAG_EXTENDED),
+                       is_remote_frame=bool(flags & FLAG_REMOTE),
+                       is_error_frame=bool(flags & FLAG_ERROR),
+                       is_fd=bool(flags & FLAG_FD),
+                       dlc=dlc, data=data[:dlc])
+
+
+def _pack_filters(filters):
+    return SUBSCRIBE + b''.join(_FILTER.pack(f['can_id'], f['can_mask']) for f in filters or ())
+
+
+def _unpack_filters(packet):
+    body = packet[1:]
+    filters = [_FILTER.unpack_from(body, offset)
+               for offset in range(0, len(body) - _FILTER.size + 1, _FILTER.size)]
+    return filters or None
+
+
+class _FrameSubscriber:
+    __slots__ = ('sock', 'filters', 'sent', 'dropped')
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.filters = []  # [(can_id, can_mask)]，None 表示全部，尚未訂閱時不送
+        self.sent = 0
+        self.dropped = 0
+
+    def wants(self, can_id):
+        for match, mask in self.filters:
+            if can_id & mask == match & mask:
+                return True
+        return False
+
+
+def peer_uid(sock):
+    """Unix socket 另一端 process 的 uid（SO_PEERCRED）"""
+    _, uid, _ = PEER_CRED.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEER_CRED.size))
+    return uid
+
+
+def socket_in_use(path):
+    """有 process 在 path 上 listen 時回傳 True（沒有人接聽的 socket 檔是過期的殘留）"""
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        probe.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        probe.close()
+
+
+class FrameServer:
+    """daemon 端：接受 FrameClient 連線，把每批 frame 送給有訂閱的 client"""
+
+    def __init__(self, path=FRAME_SOCKET, hello=None, on_transmit=None):
+        self.path = path
+        self.hello = HELLO + json.dumps(hello or {}).encode()
+        self.on_transmit = on_transmit
+        if socket_in_use(path):
+            raise RuntimeError(f"{path} is in use by another CAN ingest daemon")
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.listener.bind(path)
+        # listen 之前還不能連線，先改好權限
+        os.chmod(path, SOCKET_MODE)
+        self.listener.listen(16)
+        self.listener.setblocking(False)
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.listener, selectors.EVENT_READ)
+        self.clients = {}
+        self.rejected = 0
+
+    def poll(self, timeout=0):
+        """處理新連線、訂閱與代送的 frame，最多等待 timeout 秒"""
+        for key, _ in self.selector.select(timeout):
+            if key.fileobj is self.listener:
+                self._accept()
+            else:
+                self._read(key.fileobj)
+
+    def _accept(self):
+        try:
+            sock, _ = self.listener.accept()
+        except BlockingIOError:
+            return
+        # socket 權限之外再檢查一次：其他使用者（root 除外）不能訂閱或代送 frame
+        uid = peer_uid(sock)
+        if uid not in (0, os.getuid()):
+            self.rejected += 1
+            print(f"Rejected frame client with uid {uid}")
+            sock.close()
+            return
+        sock.setblocking(False)
+        try:
+            sock.send(self.hello)
+        except OSError:
+            sock.close()
+            return
+        self.clients[sock] = _FrameSubscriber(sock)
+        self.selector.register(sock, selectors.EVENT_READ)
+
+    def _read(self, sock):
+        try:
+            packet = sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            packet = b''
+        if not packet:
+            self._drop(sock)
+            return
+        client = self.clients[sock]
+        kind = packet[:1]
+        if kind == SUBSCRIBE:
+            client.filters = _unpack_filters(packet)
+        elif kind == TRANSMIT and len(packet) >= 1 + RECORD.size and self.on_transmit:
+            _, can_id, flags, bus_num, dlc, data = RECORD.unpack_from(packet, 1)
+            self.on_transmit(bus_num, record_message(0, can_id, flags, dlc, data))
+
+    def _drop(self, sock):
+        self.clients.pop(sock, None)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        sock.close()
+
+    def publish(self, batch):
+        """batch: [(timestamp µs, msg, bus_num)]，依各 client 的訂閱打包送出"""
+        if not self.clients or not batch:
+            return
+        records = [(msg.arbitration_id,
+                    RECORD.pack(timestamp, msg.arbitration_id, message_flags(msg), bus_num,
+                                msg.dlc, bytes(msg.data[:8])))
+                   for timestamp, msg, bus_num in batch]
+        everything = None
+        for client in list(self.clients.values()):
+            if client.filters is None:
+                if everything is None:
+                    everything = [record for _, record in records]
+                selected = everything
+            else:
+                selected = [record for can_id, record in records if client.wants(can_id)]
+            for start in range(0, len(selected), PACKET_RECORDS):
+                try:
+                    client.sock.send(b''.join(selected[start:start + PACKET_RECORDS]))
+                    client.sent += 1
+                except BlockingIOError:
+                    client.dropped += 1
+                except OSError:
+                    self._drop(client.sock)
+                    break
+
+    def stats(self):
+        return [{'filters': len(client.filters) if client.filters else None,
+                 'sent': client.sent, 'dropped': client.dropped}
+                for client in self.clients.values()]
+
+    def close(self):
+        for sock in list(self.clients):
+            self._drop(sock)
+        self.selector.close()
+        self.listener.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class FrameClient:
+    """
+    連上 ingest daemon 接收原始 frame（filters 為 python-can 格式，見 CanReceiver.id_filters，
+    None 表示全部；空 list 表示不接收，只用 send() 請 daemon 代送）
+    """
+
+    def __init__(self, path=FRAME_SOCKET, filters=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        self.sock.connect(path)
+        hello = self.sock.recv(4096)
+        info = json.loads(hello[1:]) if hello[:1] == HELLO else {}
+        self.clock_source = info.get('clock_source', CLOCK_SOURCES[TIMESTAMP_KERNEL])
+        self.buses = info.get('buses', [])
+        if filters is None or filters:
+            self.sock.send(_pack_filters(filters))
+        self.sock.setblocking(False)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self.sock, selectors.EVENT_READ)
+        self.packets = 0
+        self.frames = 0
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, timeout=None):
+        """等待並讀出目前所有的 frame，回傳 [(timestamp µs, msg, bus_num)]；daemon 結束時丟出 ConnectionError"""
+        frames = []
+        if not self._selector.select(timeout):
+            return frames
+        while True:
+            try:
+                packet = self.sock.recv(PACKET_RECORDS * RECORD.size)
+            except BlockingIOError:
+                break
+            if not packet:
+                raise ConnectionError("CAN ingest daemon closed the connection")
+            self.packets += 1
+            for offset in range(0, len(packet) - RECORD.size + 1, RECORD.size):
+                timestamp, can_id, flags, bus_num, dlc, data = RECORD.unpack_from(packet, offset)
+                frames.append((timestamp, record_message(timestamp, can_id, flags, dlc, data), bus_num))
+        self.frames += len(frames)
+        return frames
+
+    def send(self, msg, bus_num=0):
+        """請 daemon 從 bus_num 送出 msg"""
+        self.sock.send(TRANSMIT + RECORD.pack(0, msg.arbitration_id, message_flags(msg), bus_num,
+                                              msg.dlc, bytes(msg.data[:8])))
+
+    def close(self):
+        self._selector.close()
+        self.sock.close()
+
+
+class _IngestBus:
+    """IngestReceiver.bus() 回傳的物件，send() 交給 daemon 代送"""
+
+    def __init__(self, client, bus_num):
+        self.client = client
+        self.bus_num = bus_num
+
+    def send(self, msg, timeout=None):
+        try:
+            self.client.send(msg, self.bus_num)
+        except OSError as e:
+            raise can.CanError(f"CAN ingest daemon not reachable: {e}")
+
+
+class IngestReceiver(threading.Thread):
+    """
+    與 CanRing.ReceiverThread 相同的介面（rings、bus()、errors、統計），
+    frame 來自 ingest daemon 而不是自己開啟 bus；daemon 重新啟動時自動重連
+    """
+
+    def __init__(self, rings, filters=None, path=FRAME_SOCKET, timeout=0.1, retry_interval=1.0):
+        super().__init__(name="can-ingest-receiver", daemon=True)
+        self.rings = rings
+        self.filters = filters
+        self.path = path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.client = None
+        self.running = True
+        self.errors = {}
+        self.wakeups = 0
+        self.hardware_fallbacks = 0
+        self._clock_source = CLOCK_SOURCES[TIMESTAMP_KERNEL]
+        self.ready = threading.Event()
+
+    @property
+    def clock_source(self):
+        return self._clock_source
+
+    def bus(self, bus_num):
+        client = self.client
+        if client is None or bus_num not in client.buses:
+            return None
+        return _IngestBus(client, bus_num)
+
+    def run(self):
+        rings = self.rings
+        while self.running:
+            if self.client is None and not self._connect():
+                time.sleep(self.retry_interval)
+                continue
+            try:
+                frames = self.client.recv(self.timeout)
+            except (ConnectionError, OSError) as e:
+                print(f"CAN ingest connection lost: {e}")
+                for bus_num in rings:
+                    self.errors[bus_num] = self.errors.get(bus_num, 0) + 1
+                self.client.close()
+                self.client = None
+                continue
+            if frames:
+                self.wakeups += 1
+            for frame in frames:
+                ring = rings.get(frame[2])
+                if ring is not None:
+                    ring.push(frame)
+            if frames:
+                self.ready.set()
+
+    def _connect(self):
+        try:
+            self.client = FrameClient(self.path, self.filters)
+        except OSError:
+            return False
+        self._clock_source = self.client.clock_source
+        print(f"Connected to CAN ingest daemon ({self.path})")
+        return True
+
+
+class IngestDaemon:
+    """
+    擁有所有 CAN bus：ReceiverThread 接收到 ring，主迴圈整批取出後解碼一次、
+    送給 FrameClient，並以最多 PUBLISH_RATE 的頻率把 data_store 發布到 shared memory
+    """
+
+    def __init__(self, buses, reconnect=None, state_name=STATE_NAME, socket_path=FRAME_SOCKET,
+                 publish_rate=PUBLISH_RATE, timestamp_mode=TIMESTAMP_KERNEL, lock=None):
+        """lock: 呼叫端已取得的 InstanceLock（None 時在這裡取得，已有 daemon 時 RuntimeError）"""
+        from CanDecoder import CanDecoder
+
+        self.lock = lock or InstanceLock(state_name)
+        self.rings = {bus_num: FrameRing(RING_CAPACITY) for bus_num in buses}
+        self.receiver = ReceiverThread(buses, self.rings, reconnect=reconnect,
+                                       timestamp_mode=timestamp_mode)
+        self.decoder = CanDecoder()
+        # 每個 frame 的歷史樣本隨狀態發布，web process 的歷史與彙總不會只剩發布頻率的快照
+        self.journal = self.decoder.enable_history(journal=True)
+        self.samples = deque(maxlen=JOURNAL_PUBLISHES)
+        self.state = StateWriter(state_name)
+        self.server = FrameServer(socket_path, on_transmit=self.transmit,
+                                  hello={'clock_source': CLOCK_SOURCES[timestamp_mode],
+                                         'buses': sorted(buses)})
+        self.publish_interval = 1.0 / publish_rate
+        self.message_count = 0
+        self.transmit_errors = 0
+        self.running = True
+
+    def transmit(self, bus_num, msg):
+        bus = self.receiver.bus(bus_num)
+        try:
+            if bus is None:
+                raise can.CanError(f"CAN{bus_num} is not connected")
+            bus.send(msg)
+        except (can.CanError, OSError) as e:
+            self.transmit_errors += 1
+            print(f"CAN{bus_num} transmit failed: {e}")
+
+    def run(self):
+        self.receiver.start()
+        decoder = self.decoder
+        process = decoder.process_can_message
+        last_publish = 0.0
+        published_count = 0
+        try:
+            while self.running:
+                self.server.poll(0.002)
+                batch = []
+                for ring in self.rings.values():
+                    batch += ring.drain()
+                if batch:
+                    if len(self.rings) > 1:
+                        batch.sort(key=lambda frame: frame[0])
+                    for _, msg, _ in batch:
+                        process(msg)
+                    self.message_count += len(batch)
+                    self.server.publish(batch)
+
+                now = time.monotonic()
+                # 只收到未知 ID 時也發布，讓 reader 的 message_count 跟上
+                if ((decoder.dirty or self.message_count != published_count)
+                        and now - last_publish >= self.publish_interval):
+                    self.samples.append((self.state.seq + 2, self.journal.take()))
+                    self.state.publish(decoder.data_store, self.message_count,
+                                       decoder.take_dirty(), self.stats(), self.samples)
+                    last_publish = now
+                    published_count = self.message_count
+        finally:
+            self.close()
+
+    def stats(self):
+        """接收 ring、bus 錯誤與 FrameClient 的統計（隨狀態一起發布）"""
+        return {
+            'rings': {bus_num: ring.stats() for bus_num, ring in self.rings.items()},
+            'errors': dict(self.receiver.errors),
+            'transmit_errors': self.transmit_errors,
+            'clients': self.server.stats(),
+            'rejected_clients': self.server.rejected,
+        }
+
+    def close(self):
+        self.running = False
+        self.receiver.running = False
+        self.server.close()
+        self.state.close()
+        self.lock.close()
+
+
+def print_status(name=STATE_NAME):
+    try:
+        reader = StateReader(name)
+    except FileNotFoundError:
+        print(f"CAN ingest daemon is not running (no shared memory {name})")
+        return
+    state = reader.read()
+    if state is None:
+        print("CAN ingest daemon has not published any state yet")
+    else:
+        _, message_count, published = state
+        print(f"messages: {message_count}  published {time.time() - published:.3f}s ago  "
+              f"seq: {reader.seq}  sections: {', '.join(reader.data_store)}")
+    reader.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', nargs='?', choices=['run', 'status'], default='run')
+    parser.add_argument('--channels', nargs='+', default=['can0', 'can1'])
+    parser.add_argument('--socket', default=FRAME_SOCKET)
+    parser.add_argument('--rate', type=float, default=PUBLISH_RATE, help='max state publish rate (Hz)')
+    args = parser.parse_args()
+
+    if args.command == 'status':
+        print_status()
+        return
+
+    # 在開啟 CAN bus 之前檢查，第二個 daemon 不會碰到 can0 / can1
+    try:
+        lock = InstanceLock()
+    except (RuntimeError, OSError) as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+    def connect(bus_num):
+        """單次嘗試連接 CAN，失敗回傳 None（接收執行緒重連用）"""
+        try:
+            return can.interface.Bus(channel=args.channels[bus_num], bustype='socketcan')
+        except OSError:
+            return None
+
+    buses = {}
+    for bus_num, channel in enumerate(args.channels):
+        while bus_num not in buses:
+            buses[bus_num] = connect(bus_num)
+            if buses[bus_num] is None:
+                del buses[bus_num]
+                print(f"{channel} not available, retrying in 5 sec...")
+                time.sleep(5)
+    try:
+        daemon = IngestDaemon(buses, reconnect=connect, socket_path=args.socket,
+                              publish_rate=args.rate, lock=lock)
+    except RuntimeError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    # systemd stop：正常結束以移除 shared memory 與 socket
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"CAN ingest daemon started on {', '.join(args.channels)} "
+          f"(state: {STATE_NAME}, frames: {args.socket})")
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        print("\nCAN ingest daemon stopped")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+CAN network description loader
+
+讀取 can_network.yaml，為每個訊息產生專用的解碼函數（scale / offset 直接
+內嵌為常數），並將編譯後的結果以檔案 hash 為 key 快取到 __pycache__/，
+之後啟動時不需要再解析 YAML 或重新產生程式碼。
+
+同一份產生的程式碼也可以用 build_core.py 以 Cython / mypyc 編譯成擴充模組
+（can_network_core.*.so，放在本檔旁邊）。load_network() 找到與網路描述檔
+hash 相符的編譯版本時使用它，沒有編譯、或描述檔已修改時自動退回純 Python。
+"""
+
+import hashlib
+import importlib
+import importlib.machinery
+import importlib.util
+import marshal
+import os
+import struct
+import time
+
+DEFAULT_NETWORK_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'can_network.yaml')
+
+# 產生器版本，修改產生的程式碼時需遞增以讓舊快取失效
+GENERATOR_VERSION = 2
+
+# 已載入的網路描述（同一個 process 內共用）
+_LOADED = {}
+
+# build_core.py 編譯出的擴充模組名稱
+CORE_MODULE = 'can_network_core'
+
+
+def _normalize_ids(ids):
+    if isinstance(ids, dict):
+        return {int(can_id): index for can_id, index in ids.items()}
+    return {int(can_id): None for can_id in ids}
+
+
+def normalize_message(name, spec):
+    """檢查並補齊單一訊息的描述"""
+    fmt = spec['format']
+    size = struct.calcsize(fmt)
+    start = spec.get('start', 0)
+    min_len = spec.get('min_len', start + size)
+    if start + size > min_len:
+        raise ValueError(f"Message {name}: min_len {min_len} shorter than {fmt} at byte {start}")
+
+    message = {
+        'ids': _normalize_ids(spec['ids']),
+        'format': fmt,
+        'start': start,
+        'min_len': min_len,
+        'target': tuple(spec['target']),
+        'stamp': tuple(spec.get('stamp', spec['target'])),
+    }
+
+    if 'array' in spec:
+        array = spec['array']
+        message['array'] = {
+            'label': array['label'],
+            'step': array.get('step', 1),
+            'max_index': array['max_index'],
+            'length': array['length'],
+            'divisor': array.get('divisor'),
+            'factor': array.get('factor'),
+            'offset': array.get('offset'),
+        }
+    else:
+        count = len(struct.unpack(fmt, bytes(size)))
+        fields = []
+        for field in spec['fields']:
+            if not str(field['name']).isidentifier():
+                raise ValueError(f"Message {name}: field name {field['name']!r} is not a valid identifier")
+            raw = field['raw']
+            raw = tuple(raw) if isinstance(raw, list) else raw
+            for index in (raw if isinstance(raw, tuple) else (raw,)):
+                if not 0 <= index < count:
+                    raise ValueError(f"Message {name}: field {field['name']} raw index {index} out of range")
+            fields.append({
+                'name': field['name'],
+                'raw': raw,
+                'divisor': field.get('divisor'),
+                'factor': field.get('factor'),
+                'offset': field.get('offset'),
+                'equals': field.get('equals'),
+            })
+        message['fields'] = fields
+
+    return message
+
+
+def _scaled(expr, divisor, factor, offset):
+    """產生 raw -> 工程值的運算式，保持 divide / multiply 的原始順序"""
+    if divisor is not None:
+        expr = f"{expr} / {divisor!r}"
+    if factor is not None:
+        expr = f"{expr} * {factor!r}"
+    if offset is not None:
+        expr = f"{expr} + {offset!r}"
+    return expr
+
+
+def _field_expr(field):
+    raw = field['raw']
+    if isinstance(raw, tuple):
+        return "(" + ", ".join(f"r{index}" for index in raw) + ")"
+    expr = f"r{raw}"
+    if field['equals'] is not None:
+        return f"{expr} == {field['equals']!r}"
+    return _scaled(expr, field['divisor'], field['factor'], field['offset'])
+
+
+def generate_source(messages):
+    """
+    為每個訊息產生 decode_<name>(data, target, stamp) 的 Python 原始碼
+    target / stamp 為 CanState 的 __slots__ 物件，欄位以屬性寫入；陣列訊息的 target 為 array
+    """
+    lines = []
+    for name, message in messages.items():
+        lines.append(f"def decode_{name}(data, target, stamp, _unpack_from=_unpack_{name}, _time=_time):")
+        lines.append(f"    if len(data) < {message['min_len']} or target is None:")
+        lines.append("        return")
+
+        array = message.get('array')
+        if array:
+            lines.append("    index = data[0]")
+            lines.append(f"    if index % {array['step']} != 0 or index > {array['max_index']}:")
+            lines.append(f"        print(f\"[ACCUMULATOR] Invalid {array['label']} index: {{index}}\")")
+            lines.append("        return")
+            lines.append("    current_time = _time()")
+            lines.append(f"    for i, raw in enumerate(_unpack_from(data, {message['start']})):")
+            lines.append("        array_index = index + i")
+            lines.append(f"        if array_index < {array['length']}:")
+            value = _scaled("raw", array['divisor'], array['factor'], array['offset'])
+            lines.append(f"            target[array_index] = {value}")
+            lines.append("    stamp.last_update = current_time")
+        else:
+            count = len(struct.unpack(message['format'], bytes(struct.calcsize(message['format']))))
+            names = ", ".join(f"r{index}" for index in range(count)) + ("," if count == 1 else "")
+            lines.append(f"    {names} = _unpack_from(data, {message['start']})")
+            for field in message['fields']:
+                lines.append(f"    target.{field['name']} = {_field_expr(field)}")
+            lines.append("    stamp.last_update = _time()")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def generate_module(messages, digest):
+    """
+    產生可獨立 import 的解碼模組原始碼（build_core.py 編譯用）
+    解碼函數與 generate_source() 完全相同，NETWORK_DIGEST 用來檢查是否與描述檔相符
+    """
+    lines = [
+        "# cython: language_level=3, binding=False",
+        '"""由 CanNetwork.generate_module() 自動產生，請勿手動修改"""',
+        "",
+        "import struct",
+        "import time",
+        "",
+        f"NETWORK_DIGEST = {digest!r}",
+        "",
+        "_time = time.time",
+    ]
+    for name, message in messages.items():
+        lines.append(f"_unpack_{name} = struct.Struct({message['format']!r}).unpack_from")
+    lines.append("")
+    lines.append("")
+    lines.append(generate_source(messages))
+    lines.append("DECODERS = {")
+    for name in messages:
+        lines.append(f"    {name!r}: decode_{name},")
+    lines.append("}")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def _namespace(messages):
+    namespace = {'_time': time.time}
+    for name, message in messages.items():
+        namespace[f'_unpack_{name}'] = struct.Struct(message['format']).unpack_from
+    return namespace
+
+
+def _cache_path(path, digest):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '__pycache__')
+    return os.path.join(cache_dir, f"{os.path.basename(path)}.{digest[:16]}.bin")
+
+
+def parse_network(path, source_bytes):
+    """解析網路描述檔的內容，回傳 {名稱: 正規化後的訊息描述}"""
+    try:
+        import yaml
+    except ImportError:
+        raise RuntimeError(f"PyYAML is required to compile {path} (pip install pyyaml)")
+
+    description = yaml.safe_load(source_bytes)
+    return {name: normalize_message(name, spec)
+            for name, spec in description['messages'].items()}
+
+
+def _compile(path, source_bytes):
+    messages = parse_network(path, source_bytes)
+    code = compile(generate_source(messages), f"<{os.path.basename(path)}>", 'exec')
+    return messages, code
+
+
+def _load_core(digest):
+    """載入編譯過的解碼模組，不存在、不是擴充模組或與 digest 不符時回傳 None"""
+    try:
+        module = importlib.import_module(CORE_MODULE)
+    except ImportError:
+        return None
+    if not str(getattr(module, '__file__', '')).endswith(tuple(importlib.machinery.EXTENSION_SUFFIXES)):
+        return None
+    if getattr(module, 'NETWORK_DIGEST', None) != digest:
+        print(f"Warning: {module.__file__} was built from a different CAN network description, "
+              f"using pure Python decoders (rebuild with: python build_core.py)")
+        return None
+    return module
+
+
+def _digest(source_bytes):
+    key = hashlib.sha256()
+    key.update(source_bytes)
+    key.update(importlib.util.MAGIC_NUMBER)
+    key.update(str(GENERATOR_VERSION).encode())
+    return key.hexdigest()
+
+
+def network_digest(path=DEFAULT_NETWORK_FILE):
+    """網路描述檔（與產生器版本）的 hash，描述改變時其他快取也應失效"""
+    with open(path, 'rb') as f:
+        return _digest(f.read())
+
+
+def is_compiled(decoders):
+    """decoders（load_network() 的結果）是否為編譯過的版本"""
+    return any(type(decoder).__name__ != 'function' for decoder in decoders.values())
+
+
+def load_network(path=DEFAULT_NETWORK_FILE, compiled=True):
+    """
+    載入網路描述，回傳 (messages, decoders)
+        messages: {名稱: 正規化後的訊息描述}
+        decoders: {名稱: decode 函數}
+    compiled: 有相符的編譯模組（見 build_core.py）時使用它，False 時一律用純 Python
+    """
+    with open(path, 'rb') as f:
+        source_bytes = f.read()
+    digest = _digest(source_bytes)
+
+    key = (digest, compiled)
+    if key in _LOADED:
+        return _LOADED[key]
+
+    cache_file = _cache_path(path, digest)
+    messages = code = None
+    try:
+        with open(cache_file, 'rb') as f:
+            messages, code = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    if code is None:
+        messages, code = _compile(path, source_bytes)
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                marshal.dump((messages, code), f)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            print(f"Warning: could not write CAN network cache {cache_file}: {e}")
+
+    core = _load_core(digest) if compiled else None
+    if core is not None:
+        decoders = {name: core.DECODERS[name] for name in messages}
+    else:
+        namespace = _namespace(messages)
+        exec(code, namespace)
+        decoders = {name: namespace[f'decode_{name}'] for name in messages}
+
+    _LOADED[key] = (messages, decoders)
+    return messages, decoders
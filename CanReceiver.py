@@ -0,0 +1,353 @@
+"""
+Event-driven multi-bus CAN reception
+
+同時等待多個 SocketCAN socket（selectors，Linux 上為 epoll），有資料時
+一次讀完該 bus 所有待處理的 frame，取代在 can0 / can1 之間輪流
+recv(timeout=0.001)：閒置時不佔 CPU，忙碌時也不會被另一個 bus 的
+timeout 拖慢。
+
+    receiver = BusSelector({0: bus0, 1: bus1})
+    while True:
+        for bus_num, msg in receiver.poll(timeout=1.0):
+            ...
+        for bus_num in receiver.failed:
+            ...  # 重新連線後 receiver.add(bus_num, new_bus)
+
+沒有 fileno() 的 bus（例如 python-can virtual interface）退回短間隔輪詢。
+
+msg.timestamp 為 frame 的接收時間（秒），來源由 timestamp_mode 決定：
+    'kernel'   SocketCAN 的 kernel 接收時間 (SO_TIMESTAMPNS，python-can 預設)
+    'hardware' CAN 控制器的硬體時間 (SO_TIMESTAMPING)，driver 不支援時
+               退回 kernel 軟體時間並計數 hardware_fallbacks
+    'system'   讀出 frame 時的 time.time()（舊的行為，僅供比較）
+
+只需要少數 CAN ID 的程式以 subscribe() 宣告需要的 ID / mask，會安裝成
+SocketCAN can_filters，由 kernel 丟棄其他訊息；每個 filter 的命中次數
+可由 filter_stats() 取得以便驗證。
+
+    receiver.subscribe(id_filters([0x281, 0x193, 0x194]))
+"""
+
+import selectors
+import socket
+import struct
+import time
+
+import can
+
+# 每次喚醒時單一 bus 最多讀取的 frame 數，避免一個 bus 佔住迴圈
+DEFAULT_BURST = 256
+# 有無法 select 的 bus 時，最長的等待時間
+POLL_INTERVAL = 0.005
+
+TIMESTAMP_KERNEL = 'kernel'
+TIMESTAMP_HARDWARE = 'hardware'
+TIMESTAMP_SYSTEM = 'system'
+
+# 記錄到 log 檔頭的 clock source 名稱
+CLOCK_SOURCES = {
+    TIMESTAMP_KERNEL: 'socketcan-kernel',
+    TIMESTAMP_HARDWARE: 'socketcan-hardware',
+    TIMESTAMP_SYSTEM: 'system',
+}
+
+# linux/net_tstamp.h
+SO_TIMESTAMPING = 37
+SOF_TIMESTAMPING_RX_HARDWARE = 1 << 2
+SOF_TIMESTAMPING_RX_SOFTWARE = 1 << 3
+SOF_TIMESTAMPING_SOFTWARE = 1 << 4
+SOF_TIMESTAMPING_RAW_HARDWARE = 1 << 6
+SO_TIMESTAMPNS = 35
+
+# 11-bit / 29-bit ID 的完整 mask
+STANDARD_MASK = 0x7FF
+EXTENDED_MASK = 0x1FFFFFFF
+
+# linux/can.h
+CAN_EFF_FLAG = 0x80000000
+CAN_RTR_FLAG = 0x40000000
+CAN_ERR_FLAG = 0x20000000
+CAN_EFF_MASK = 0x1FFFFFFF
+CANFD_MTU = 72
+
+# can_id, len, flags；data 接在 8 bytes header 後
+_CAN_FRAME_HEADER = struct.Struct('=IBB2x')
+# SCM_TIMESTAMPING: 3 個 struct timespec (software, 已廢棄, raw hardware)
+_TIMESPEC = struct.Struct('@ll')
+_TIMESPEC_ARRAY = struct.Struct('@llllll')
+
+
+def bus_fileno(bus):
+    """回傳 bus 的 socket fileno，不支援時回傳 None"""
+    try:
+        fileno = bus.fileno()
+    except (AttributeError, NotImplementedError):
+        return None
+    return fileno if fileno is not None and fileno >= 0 else None
+
+
+def frame_time(msg):
+    """frame 的接收時間 (秒)；沒有 timestamp 時以目前時間代替"""
+    return msg.timestamp or time.time()
+
+
+def enable_hardware_timestamps(bus):
+    """在 bus 的 socket 上啟用 SO_TIMESTAMPING (硬體 + 軟體接收時間)"""
+    bus.socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPING,
+                          SOF_TIMESTAMPING_RX_HARDWARE | SOF_TIMESTAMPING_RAW_HARDWARE |
+                          SOF_TIMESTAMPING_RX_SOFTWARE | SOF_TIMESTAMPING_SOFTWARE)
+
+
+def _timespec(seconds, nanoseconds):
+    return seconds + nanoseconds / 1e9
+
+
+def recv_hardware_timestamped(bus):
+    """
+    不等待，直接從 SocketCAN socket 讀一個 frame，timestamp 優先使用硬體時間
+    回傳 (msg, 是否為硬體時間)，沒有資料時回傳 (None, False)
+    """
+    try:
+        frame, ancdata, _, _ = bus.socket.recvmsg(CANFD_MTU, 1024, socket.MSG_DONTWAIT)
+    except BlockingIOError:
+        return None, False
+
+    timestamp = 0.0
+    hardware = False
+    for level, kind, data in ancdata:
+        if level != socket.SOL_SOCKET:
+            continue
+        if kind == SO_TIMESTAMPING and len(data) >= _TIMESPEC_ARRAY.size:
+            values = _TIMESPEC_ARRAY.unpack_from(data)
+            if values[4] or values[5]:
+                timestamp = _timespec(values[4], values[5])
+                hardware = True
+                break
+            if values[0] or values[1]:
+                timestamp = _timespec(values[0], values[1])
+        elif kind == SO_TIMESTAMPNS and not timestamp and len(data) >= _TIMESPEC.size:
+            timestamp = _timespec(*_TIMESPEC.unpack_from(data))
+
+    can_id, length, flags = _CAN_FRAME_HEADER.unpack_from(frame)
+    is_fd = len(frame) == CANFD_MTU
+    is_remote = bool(can_id & CAN_RTR_FLAG)
+    msg = can.Message(
+        timestamp=timestamp or time.time(),
+        arbitration_id=can_id & CAN_EFF_MASK,
+        is_extended_id=bool(can_id & CAN_EFF_FLAG),
+        is_remote_frame=is_remote,
+        is_error_frame=bool(can_id & CAN_ERR_FLAG),
+        is_fd=is_fd,
+        dlc=length,
+        data=None if is_remote else frame[_CAN_FRAME_HEADER.size:_CAN_FRAME_HEADER.size + length],
+        channel=getattr(bus, 'channel', None),
+    )
+    return msg, hardware
+
+
+def id_filters(ids, extended=False):
+    """由 CAN ID 列表產生完全比對的 python-can filters"""
+    mask = EXTENDED_MASK if extended else STANDARD_MASK
+    return [{'can_id': can_id, 'can_mask': mask, 'extended': extended} for can_id in ids]
+
+
+class FilterCounter:
+    """
+    每個 filter 的命中次數（kernel 不提供各 filter 的計數，由 Python 端比對）
+    unmatched 為通過 kernel 但不符合任何 filter 的 frame 數，正常應為 0
+    """
+
+    def __init__(self, filters):
+        self.filters = list(filters)
+        self.hits = [0] * len(self.filters)
+        self.unmatched = 0
+        self._matchers = [
+            (f['can_id'] & f['can_mask'], f['can_mask'], f.get('extended'))
+            for f in self.filters
+        ]
+
+    def count(self, msg):
+        can_id = msg.arbitration_id
+        extended = msg.is_extended_id
+        for index, (value, mask, want_extended) in enumerate(self._matchers):
+            if can_id & mask == value and (want_extended is None or want_extended == extended):
+                self.hits[index] += 1
+                return True
+        self.unmatched += 1
+        return False
+
+    def stats(self):
+        return {
+            'filters': [
+                {'can_id': f"0x{f['can_id']:03X}", 'can_mask': f"0x{f['can_mask']:03X}",
+                 'extended': f.get('extended'), 'hits': hits}
+                for f, hits in zip(self.filters, self.hits)
+            ],
+            'unmatched': self.unmatched,
+        }
+
+
+class BusSelector:
+    """同時等待多個 CAN bus，每次喚醒整批讀取"""
+
+    def __init__(self, buses=None, max_burst=DEFAULT_BURST, timestamp_mode=TIMESTAMP_KERNEL):
+        if timestamp_mode not in CLOCK_SOURCES:
+            raise ValueError(f"Unknown timestamp mode: {timestamp_mode}")
+        self.max_burst = max_burst
+        self.timestamp_mode = timestamp_mode
+        self.clock_source = CLOCK_SOURCES[timestamp_mode]
+        self.buses = {}
+        self.failed = {}  # bus_num -> 最後一次的錯誤，已從 selector 移除
+        self._filenos = {}
+        self._polled = set()
+        self._subscriptions = {}  # bus_num -> filters，重新連線時重新安裝
+        self._counters = {}
+        self._selector = selectors.DefaultSelector()
+
+        # 統計
+        self.wakeups = 0
+        self.frames = 0
+        self.errors = {}
+        self.hardware_fallbacks = 0  # hardware 模式下沒有硬體時間的 frame 數
+
+        for bus_num, bus in (buses or {}).items():
+            self.add(bus_num, bus)
+
+    def add(self, bus_num, bus):
+        """加入（或替換）一個 bus"""
+        self.remove(bus_num)
+        fileno = bus_fileno(bus)
+        if self.timestamp_mode == TIMESTAMP_HARDWARE:
+            if fileno is None or not hasattr(bus, 'socket'):
+                raise ValueError(f"bus {bus_num} does not support hardware timestamps")
+            enable_hardware_timestamps(bus)
+        if fileno is None:
+            self._polled.add(bus_num)
+        else:
+            if fileno in self._filenos.values():
+                raise ValueError(f"bus {bus_num} shares a socket with another registered bus")
+            self._selector.register(fileno, selectors.EVENT_READ, bus_num)
+            self._filenos[bus_num] = fileno
+        self.buses[bus_num] = bus
+        self.failed.pop(bus_num, None)
+        if bus_num in self._subscriptions:
+            bus.set_filters(self._subscriptions[bus_num])
+
+    def remove(self, bus_num):
+        """移除 bus（不關閉），回傳被移除的 bus"""
+        bus = self.buses.pop(bus_num, None)
+        fileno = self._filenos.pop(bus_num, None)
+        if fileno is not None:
+            try:
+                self._selector.unregister(fileno)
+            except (KeyError, ValueError):
+                pass
+        self._polled.discard(bus_num)
+        return bus
+
+    def subscribe(self, filters, bus_nums=None):
+        """
+        只接收符合 filters 的訊息（安裝為 kernel can_filters）
+        filters 為 python-can 格式 [{'can_id', 'can_mask', 'extended'}]，None 表示全部接收
+        bus_nums 為 None 時套用到目前所有 bus；斷線重連後會自動重新安裝
+        """
+        if bus_nums is None:
+            bus_nums = set(self.buses) | set(self.failed)
+        for bus_num in bus_nums:
+            if filters is None:
+                self._subscriptions.pop(bus_num, None)
+                self._counters.pop(bus_num, None)
+            else:
+                self._subscriptions[bus_num] = list(filters)
+                self._counters[bus_num] = FilterCounter(filters)
+            bus = self.buses.get(bus_num)
+            if bus is not None:
+                bus.set_filters(filters)
+
+    def filter_stats(self):
+        """{bus_num: 各 filter 命中次數}"""
+        return {bus_num: counter.stats() for bus_num, counter in self._counters.items()}
+
+    def get(self, bus_num):
+        return self.buses.get(bus_num)
+
+    def fileno_map(self):
+        """{fileno: bus_num}，供 event loop (例如 asyncio add_reader) 直接監聽"""
+        return {fileno: bus_num for bus_num, fileno in self._filenos.items()}
+
+    def polled(self):
+        """沒有 fileno()、需要輪詢的 bus_num"""
+        return sorted(self._polled)
+
+    def read_burst(self, bus_num, frames=None):
+        """
+        不等待，讀出單一 bus 目前所有待處理的 frame (最多 max_burst 筆)
+        讀取失敗時 bus 會被移除並記錄在 failed
+        """
+        if frames is None:
+            frames = []
+        bus = self.buses.get(bus_num)
+        if bus is None:
+            return frames
+        mode = self.timestamp_mode
+        counter = self._counters.get(bus_num)
+        try:
+            for _ in range(self.max_burst):
+                if mode == TIMESTAMP_HARDWARE:
+                    msg, hardware = recv_hardware_timestamped(bus)
+                    if msg is not None and not hardware:
+                        self.hardware_fallbacks += 1
+                else:
+                    msg = bus.recv(timeout=0)
+                if msg is None:
+                    break
+                if mode == TIMESTAMP_SYSTEM:
+                    msg.timestamp = time.time()
+                if counter is not None:
+                    counter.count(msg)
+                frames.append((bus_num, msg))
+        except (can.CanError, OSError) as e:
+            print(f"CAN{bus_num} receive error: {e}")
+            self.remove(bus_num)
+            self.failed[bus_num] = e
+            self.errors[bus_num] = self.errors.get(bus_num, 0) + 1
+        return frames
+
+    def poll(self, timeout=None):
+        """
+        等待任一 bus 有資料，回傳 [(bus_num, msg), ...]（每個 bus 內依接收順序）
+        timeout 為 None 時無限等待；逾時回傳空 list
+        """
+        if self._polled:
+            timeout = POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL)
+
+        frames = []
+        if self._filenos:
+            ready = self._selector.select(timeout)
+        else:
+            # 沒有可 select 的 socket：只剩輪詢的 bus，或全部斷線
+            time.sleep(POLL_INTERVAL if timeout is None else timeout)
+            ready = []
+
+        for key, _ in ready:
+            self.read_burst(key.data, frames)
+        for bus_num in list(self._polled):
+            self.read_burst(bus_num, frames)
+
+        if frames:
+            self.wakeups += 1
+            self.frames += len(frames)
+        return frames
+
+    def close(self, shutdown=False):
+        """關閉 selector；shutdown=True 時一併關閉所有 bus"""
+        if shutdown:
+            for bus in self.buses.values():
+                try:
+                    bus.shutdown()
+                except Exception:
+                    pass
+        self.buses.clear()
+        self._filenos.clear()
+        self._polled.clear()
+        self._selector.close()
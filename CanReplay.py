@@ -0,0 +1,344 @@
+"""
+Indexed CAN log replay
+
+CSV 記錄檔第一次開啟時掃描一次，建立「時間戳 -> byte offset」索引，存成
+<log>.idx 放在記錄檔旁邊；之後開啟時直接 mmap 索引與記錄檔，播放游標
+前進到哪一行才解析那一行。開啟幾乎不花時間，記憶體用量也與記錄長度無關。
+
+記錄檔仍在寫入（檔案變長）時，只掃描上次索引之後新增的部分。
+
+    replay = LogReplay('../LOGS/can_log_xxx.csv')
+    for i in range(len(replay)):
+        message = replay.message(i)   # (can_id, data) 或 None
+
+Keyframes 為每隔 KEYFRAME_INTERVAL 的 CanDecoder 狀態 snapshot，存成
+<log>.keyframes。跳轉時還原目標之前最近的 keyframe，只重播之間的訊息，
+跳轉後儀表板立即有完整的狀態。建立 keyframe 需要解碼整個記錄檔，
+可在背景執行:
+    python CanReplay.py index ../LOGS/can_log_xxx.csv [...]
+"""
+
+import bisect
+import mmap
+import os
+import pickle
+import struct
+import sys
+import time
+from array import array
+
+from CanDecoder import CanDecoder
+from CanNetwork import DEFAULT_NETWORK_FILE, network_digest
+
+INDEX_MAGIC = b'NTCANIDX'
+INDEX_VERSION = 1
+INDEX_EXTENSION = '.idx'
+
+# magic, version, 已掃描到的 byte 位置, 記錄檔 mtime (ns), 筆數
+INDEX_HEADER = struct.Struct('<8sH6xQQQ')
+
+# CSV 的 D1-D12 欄位
+DATA_COLUMNS = 12
+
+KEYFRAME_EXTENSION = '.keyframes'
+KEYFRAME_VERSION = 1
+# keyframe 間隔 (µs，記錄檔時間)
+KEYFRAME_INTERVAL = 1000000
+
+
+def parse_data(line):
+    """
+    由一行 CSV 取出 (can_id, data)，格式錯誤時回傳 None
+    欄位規則與原本的 csv.DictReader 版本相同：遇到空白欄位補一個 0 並停止，
+    最後截斷成 LEN 個 byte
+    """
+    parts = line.split(b',')
+    try:
+        can_id = int(parts[1], 16)
+        length = int(parts[5])
+    except (ValueError, IndexError):
+        return None
+
+    fields = parts[6:6 + DATA_COLUMNS]
+    data = []
+    for i in range(DATA_COLUMNS):
+        value = fields[i].strip() if i < len(fields) else b''
+        if not value:
+            data.append(0)
+            break
+        try:
+            data.append(int(value, 16))
+        except ValueError:
+            break
+
+    if len(data) > length:
+        data = data[:length]
+    return can_id, bytes(data)
+
+
+def _scan(f, start, timestamps, offsets):
+    """從 start 開始掃描完整的行，回傳最後一個完整行結束的位置"""
+    f.seek(start)
+    position = start
+    for line in f:
+        if not line.endswith(b'\n'):
+            break  # 最後一行還沒寫完
+        comma = line.find(b',')
+        try:
+            timestamp = int(line[:comma])
+            int(line[comma + 1:line.find(b',', comma + 1)], 16)
+        except ValueError:
+            pass  # 標題列或格式錯誤的行
+        else:
+            timestamps.append(timestamp)
+            offsets.append(position)
+        position += len(line)
+    return position
+
+
+class LogReplay:
+    """以 mmap 存取的 CSV 記錄檔，timestamps / offsets 為索引"""
+
+    def __init__(self, path, index_path=None):
+        self.path = path
+        self.index_path = index_path or path + INDEX_EXTENSION
+        self._file = open(path, 'rb')
+        self._map = None
+        self._index_map = None
+        self.timestamps = ()
+        self.offsets = ()
+
+        self._load_index()
+        if os.fstat(self._file.fileno()).st_size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def _read_cached_index(self):
+        """讀取快取的索引，回傳 (header 欄位, mmap)；沒有或格式不符時回傳 None"""
+        try:
+            with open(self.index_path, 'rb') as f:
+                index_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+
+        if len(index_map) >= INDEX_HEADER.size:
+            magic, version, scanned_to, mtime_ns, count = INDEX_HEADER.unpack_from(index_map)
+            if magic == INDEX_MAGIC and version == INDEX_VERSION and \
+                    len(index_map) == INDEX_HEADER.size + count * 16:
+                return (scanned_to, mtime_ns, count), index_map
+        index_map.close()
+        return None
+
+    def _load_index(self):
+        stat = os.fstat(self._file.fileno())
+        cached = self._read_cached_index()
+        if cached is not None:
+            (scanned_to, mtime_ns, count), index_map = cached
+            view = memoryview(index_map)[INDEX_HEADER.size:]
+            timestamps = view[:count * 8].cast('q')
+            offsets = view[count * 8:].cast('Q')
+
+            if mtime_ns == stat.st_mtime_ns and scanned_to <= stat.st_size:
+                # 索引是最新的，直接使用 mmap
+                self._index_map = index_map
+                self.timestamps, self.offsets = timestamps, offsets
+                return
+            appended = scanned_to <= stat.st_size and self._still_appended(timestamps, offsets)
+            if appended:
+                # 記錄檔只有在後面新增資料：從上次的位置接著掃描
+                start, old_timestamps, old_offsets = scanned_to, array('q', timestamps), array('Q', offsets)
+            del timestamps, offsets
+            view.release()
+            index_map.close()
+            if appended:
+                self._build(start, old_timestamps, old_offsets, stat)
+                return
+
+        self._build(0, array('q'), array('Q'), stat)
+
+    def _still_appended(self, timestamps, offsets):
+        """確認索引的最後一筆仍指向相同的內容（檔案沒有被覆寫）"""
+        if not len(offsets):
+            return False
+        self._file.seek(offsets[-1])
+        line = self._file.readline()
+        try:
+            return int(line[:line.find(b',')]) == timestamps[-1]
+        except ValueError:
+            return False
+
+    def _build(self, start, timestamps, offsets, stat):
+        scanned_to = _scan(self._file, start, timestamps, offsets)
+        self.timestamps, self.offsets = timestamps, offsets
+
+        try:
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, scanned_to,
+                                          stat.st_mtime_ns, len(timestamps)))
+                timestamps.tofile(f)
+                offsets.tofile(f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            print(f"Warning: could not write replay index {self.index_path}: {e}")
+
+    def timestamp(self, i):
+        return self.timestamps[i]
+
+    def message(self, i):
+        """解析第 i 筆訊息，回傳 (can_id, data)；格式錯誤時回傳 None"""
+        start = self.offsets[i]
+        end = self._map.find(b'\n', start)
+        return parse_data(self._map[start:end])
+
+    def close(self):
+        self.timestamps = self.offsets = ()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._index_map is not None:
+            self._index_map.close()
+            self._index_map = None
+        self._file.close()
+
+
+    def find(self, timestamp):
+        """第一筆時間戳 >= timestamp 的索引（bisect）"""
+        return bisect.bisect_left(self.timestamps, timestamp)
+
+    def find_before(self, timestamp):
+        """最後一筆時間戳 <= timestamp 的索引，沒有時回傳 0"""
+        return max(bisect.bisect_right(self.timestamps, timestamp) - 1, 0)
+
+
+class Keyframes:
+    """
+    記錄檔的解碼狀態 keyframe
+    indices[k] 為 keyframe k 對應的訊息索引，snapshots[k] 為處理該訊息「之前」的狀態
+    """
+
+    def __init__(self, indices, snapshots, count):
+        self.indices = indices
+        self.snapshots = snapshots
+        self.count = count  # 已涵蓋的訊息數
+
+    @staticmethod
+    def cache_path(log_path):
+        return log_path + KEYFRAME_EXTENSION
+
+    @classmethod
+    def _read_cache(cls, replay, network_file):
+        """讀取與 replay 相符的快取 (dict)；不存在或不相符時回傳 None"""
+        try:
+            with open(cls.cache_path(replay.path), 'rb') as f:
+                cache = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+            return None
+
+        count = cache.get('count', 0) if isinstance(cache, dict) else 0
+        if cache.get('version') != KEYFRAME_VERSION or \
+                cache.get('key') != (network_digest(network_file), KEYFRAME_INTERVAL) or \
+                not 0 < count <= len(replay) or \
+                replay.offsets[count - 1] != cache['last_offset'] or \
+                replay.timestamps[count - 1] != cache['last_timestamp']:
+            return None
+        return cache
+
+    @classmethod
+    def load(cls, replay, network_file=DEFAULT_NETWORK_FILE):
+        """載入快取的 keyframe；沒有快取時回傳 None（涵蓋範圍可能小於 len(replay)）"""
+        cache = cls._read_cache(replay, network_file)
+        if cache is None:
+            return None
+        indices = array('q')
+        indices.frombytes(cache['indices'])
+        return cls(indices, cache['snapshots'], cache['count'])
+
+    @classmethod
+    def build(cls, replay, network_file=DEFAULT_NETWORK_FILE):
+        """
+        解碼整個記錄檔並建立 keyframe，寫入快取後回傳
+        記錄檔只有新增資料時，從上次的最後狀態接著解碼
+        """
+        decoder = CanDecoder(network_file)
+        cache = cls._read_cache(replay, network_file)
+        if cache is not None:
+            indices = array('q')
+            indices.frombytes(cache['indices'])
+            snapshots = cache['snapshots']
+            start = cache['count']
+            decoder.restore(cache['tail'])
+            next_keyframe = replay.timestamps[indices[-1]] + KEYFRAME_INTERVAL
+        else:
+            indices, snapshots, start = array('q'), [], 0
+            next_keyframe = replay.timestamps[0] if len(replay) else 0
+
+        timestamps = replay.timestamps
+        for i in range(start, len(replay)):
+            timestamp = timestamps[i]
+            if timestamp >= next_keyframe:
+                indices.append(i)
+                snapshots.append(decoder.snapshot())
+                next_keyframe = timestamp + KEYFRAME_INTERVAL
+            message = replay.message(i)
+            if message is not None:
+                decoder.process_can_message(decoder.create_mock_can_message(*message))
+
+        count = len(replay)
+        if count:
+            cache_file = cls.cache_path(replay.path)
+            try:
+                tmp_path = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump({
+                        'version': KEYFRAME_VERSION,
+                        'key': (network_digest(network_file), KEYFRAME_INTERVAL),
+                        'count': count,
+                        'last_offset': replay.offsets[count - 1],
+                        'last_timestamp': timestamps[count - 1],
+                        'indices': indices.tobytes(),
+                        'snapshots': snapshots,
+                        'tail': decoder.snapshot(),
+                    }, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, cache_file)
+            except OSError as e:
+                print(f"Warning: could not write keyframes {cache_file}: {e}")
+        return cls(indices, snapshots, count)
+
+    def seek(self, replay, decoder, index):
+        """
+        把 decoder 還原成播放到 index（不含）時的狀態
+        回傳重播的訊息數；index 超出 keyframe 涵蓋範圍時回傳 None，decoder 不變
+        """
+        if index > self.count or not self.indices:
+            return None
+        k = bisect.bisect_right(self.indices, index) - 1
+        if k < 0:
+            return None
+        decoder.restore(self.snapshots[k])
+        for i in range(self.indices[k], index):
+            message = replay.message(i)
+            if message is not None:
+                decoder.process_can_message(decoder.create_mock_can_message(*message))
+        return index - self.indices[k]
+
+
+def index_log(path, network_file=DEFAULT_NETWORK_FILE):
+    """建立（或更新）記錄檔的索引與 keyframe"""
+    start = time.perf_counter()
+    replay = LogReplay(path)
+    indexed = time.perf_counter()
+    keyframes = Keyframes.build(replay, network_file)
+    print(f"{path}: {len(replay)} messages indexed in {indexed - start:.2f}s, "
+          f"{len(keyframes.indices)} keyframes in {time.perf_counter() - indexed:.2f}s")
+    replay.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'index':
+        for log_path in sys.argv[2:]:
+            index_log(log_path)
+    else:
+        print("Usage: python CanReplay.py index <can_log.csv> [...]")
@@ -0,0 +1,171 @@
+"""
+Lock-free frame ring buffer and receiver threads
+
+接收與寫檔分離：接收執行緒同時等待所有 CAN bus (BusSelector)，放進各 bus
+預先配置的 ring buffer；寫檔執行緒再整批取出。SD 卡寫入卡頓時接收不會被阻塞，
+ring 滿了只會丟棄新的 frame 並計數。
+
+每個 ring 只有一個 producer 與一個 consumer，head / tail 各自只由一方
+寫入，在 GIL 下不需要鎖。
+"""
+
+import threading
+import time
+
+from CanReceiver import TIMESTAMP_KERNEL, BusSelector, frame_time
+
+
+class FrameRing:
+    """單一 producer / 單一 consumer 的固定容量 ring buffer"""
+
+    def __init__(self, capacity=65536):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self._slots = [None] * capacity
+        self._head = 0  # 只由 producer 寫入
+        self._tail = 0  # 只由 consumer 寫入
+
+        # 統計
+        self.pushed = 0
+        self.dropped = 0
+        self.overruns = 0  # ring 由未滿變滿的次數
+        self.high_water = 0
+        self._overflowing = False
+
+    def __len__(self):
+        return self._head - self._tail
+
+    def push(self, item):
+        """放入一個 frame；ring 已滿時丟棄並回傳 False"""
+        head = self._head
+        used = head - self._tail
+        if used >= self.capacity:
+            self.dropped += 1
+            if not self._overflowing:
+                self._overflowing = True
+                self.overruns += 1
+            return False
+
+        self._slots[head & self._mask] = item
+        self._head = head + 1
+        self.pushed += 1
+        self._overflowing = False
+        if used + 1 > self.high_water:
+            self.high_water = used + 1
+        return True
+
+    def drain(self, max_items=None):
+        """取出最多 max_items 個 frame（依接收順序）"""
+        tail = self._tail
+        count = self._head - tail
+        if max_items is not None and count > max_items:
+            count = max_items
+        if count <= 0:
+            return []
+
+        slots = self._slots
+        mask = self._mask
+        items = []
+        for position in range(tail, tail + count):
+            index = position & mask
+            items.append(slots[index])
+            slots[index] = None
+        self._tail = tail + count
+        return items
+
+    def stats(self):
+        return {
+            'pushed': self.pushed,
+            'dropped': self.dropped,
+            'overruns': self.overruns,
+            'pending': len(self),
+            'high_water': self.high_water,
+            'capacity': self.capacity,
+        }
+
+
+class ReceiverThread(threading.Thread):
+    """
+    以 BusSelector 同時接收多個 CAN bus，放進各自的 FrameRing
+    每個 item 為 (接收時間 µs, msg, bus_num)，接收時間取自 msg.timestamp
+    （來源見 CanReceiver 的 timestamp_mode）
+
+    bus 讀取失敗時會從 selector 移除，每隔 retry_interval 秒呼叫一次
+    reconnect(bus_num)（回傳新的 bus 或 None），其他 bus 不受影響。
+    """
+
+    def __init__(self, buses, rings, reconnect=None, timeout=0.1, retry_interval=1.0,
+                 timestamp_mode=TIMESTAMP_KERNEL):
+        super().__init__(name="can-receiver", daemon=True)
+        self.selector = BusSelector(buses, timestamp_mode=timestamp_mode)
+        self.rings = rings
+        self.reconnect = reconnect
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.running = True
+        self._last_retry = 0.0
+        # 有 frame 放進 ring 時 set，寫檔端以 wait() 等待而不必輪詢
+        self.ready = threading.Event()
+
+    @property
+    def errors(self):
+        return self.selector.errors
+
+    @property
+    def clock_source(self):
+        return self.selector.clock_source
+
+    @property
+    def hardware_fallbacks(self):
+        return self.selector.hardware_fallbacks
+
+    @property
+    def wakeups(self):
+        return self.selector.wakeups
+
+    def bus(self, bus_num):
+        return self.selector.get(bus_num)
+
+    def run(self):
+        rings = self.rings
+        while self.running:
+            frames = self.selector.poll(self.timeout)
+            for bus_num, msg in frames:
+                rings[bus_num].push((int(frame_time(msg) * 1000000), msg, bus_num))
+            if frames:
+                self.ready.set()
+
+            if self.selector.failed and time.monotonic() - self._last_retry >= self.retry_interval:
+                self._reconnect()
+
+    def _reconnect(self):
+        self._last_retry = time.monotonic()
+        for bus_num in list(self.selector.failed):
+            if self.reconnect is None:
+                continue
+            try:
+                bus = self.reconnect(bus_num)
+            except Exception as e:
+                print(f"CAN{bus_num} reconnect failed: {e}")
+                continue
+            if bus is None:
+                continue
+            try:
+                self.selector.add(bus_num, bus)
+            except Exception as e:
+                # 例如 hardware 模式下新的 bus 沒有硬體時間戳：關閉它，下次再試
+                print(f"CAN{bus_num} reconnect rejected: {e}")
+                self.selector.remove(bus_num)
+                self.selector.failed[bus_num] = e
+                self.selector.errors[bus_num] = self.selector.errors.get(bus_num, 0) + 1
+                try:
+                    bus.shutdown()
+                except Exception:
+                    pass
+                continue
+            print(f"CAN{bus_num} connection restored")
+
+    def stop(self):
+        self.running = False
@@ -0,0 +1,234 @@
+"""
+Adaptive per-topic broadcast scheduling
+
+取代固定 20 FPS 的 broadcaster_loop：每個 topic（廣播資料的頂層欄位）有變動時
+才推送，但不超過該 topic 的最大頻率（MAX_RATES）；沒到期的變動留到下次到期時
+一起送。各 topic 的實際更新頻率由 data_store 中的 last_update 估計，用來決定
+broadcaster 下次醒來的時間，並可由 stats() 查看。
+
+快速訊號（例如 100 Hz 以上的 IMU2）在兩次推送之間可以用 SignalAggregates
+累積每個數值欄位的 min / max / mean，避免降頻後遺失峰值。
+"""
+
+import time
+
+from CanState import State
+
+# 每個 topic 的最大推送頻率 (Hz)，未列出的用 DEFAULT_MAX_RATE
+DEFAULT_MAX_RATE = 20.0
+MAX_RATES = {
+    'imu2': 50.0,
+    'inverters': 20.0,
+    'vcu': 20.0,
+    'velocity': 20.0,
+    'gps': 10.0,
+    'accumulator': 5.0,
+    'canlogging': 2.0,
+    'playback_control': 2.0,
+}
+
+# broadcaster 醒來的間隔範圍（秒）
+MIN_WAKEUP = 0.01
+IDLE_WAKEUP = 0.05
+
+# last_update 間隔的 EWMA 係數
+RATE_SMOOTHING = 0.2
+
+
+def _latest_update(section):
+    """section 的 last_update；inverters 這類巢狀結構取內層最新的"""
+    latest = section.get('last_update')
+    for _, value in section.items():
+        if isinstance(value, (dict, State)):
+            inner = _latest_update(value)
+            if inner is not None and (latest is None or inner > latest):
+                latest = inner
+    return latest
+
+
+class TopicState:
+    __slots__ = ('name', 'max_rate', 'min_interval', 'last_update', 'interval',
+                 'last_push', 'pending', 'pushes', 'deferred')
+
+    def __init__(self, name, max_rate):
+        self.name = name
+        self.max_rate = max_rate
+        self.min_interval = 1.0 / max_rate
+        self.last_update = None
+        self.interval = None  # last_update 間隔的 EWMA（秒）
+        self.last_push = 0.0
+        self.pending = False
+        self.pushes = 0
+        self.deferred = 0  # 因為超過最大頻率而延後的次數
+
+    @property
+    def natural_rate(self):
+        return 1.0 / self.interval if self.interval else None
+
+    def observe(self, last_update):
+        if last_update is None or last_update == self.last_update:
+            return
+        if self.last_update is not None and last_update > self.last_update:
+            interval = last_update - self.last_update
+            if self.interval is None:
+                self.interval = interval
+            else:
+                self.interval += RATE_SMOOTHING * (interval - self.interval)
+        self.last_update = last_update
+
+
+class TopicScheduler:
+    """
+    決定每個 tick 要推送哪些 topic
+
+    observe(data_store, dirty) 記錄有變動的 topic（CanDecoder.take_dirty() 的結果）
+    與其 last_update；due() 回傳現在可以推送的 topic；next_wakeup() 為下一個
+    延後中的 topic 到期前的秒數。
+    """
+
+    def __init__(self, max_rates=None, default_max_rate=DEFAULT_MAX_RATE):
+        self.max_rates = dict(MAX_RATES if max_rates is None else max_rates)
+        self.default_max_rate = default_max_rate
+        self.topics = {}
+
+    def topic(self, name):
+        state = self.topics.get(name)
+        if state is None:
+            state = self.topics[name] = TopicState(
+                name, self.max_rates.get(name, self.default_max_rate))
+        return state
+
+    def observe(self, data_store, dirty):
+        for name in dirty:
+            state = self.topic(name)
+            state.pending = True
+            section = data_store.get(name)
+            if isinstance(section, (dict, State)):
+                state.observe(_latest_update(section))
+
+    def mark(self, *names):
+        """標記不經過 CanDecoder 的 topic 有變動（例如 playback_control）"""
+        for name in names:
+            self.topic(name).pending = True
+
+    def due(self, now=None):
+        """回傳現在要推送的 topic，並記錄推送時間"""
+        if now is None:
+            now = time.monotonic()
+        topics = set()
+        for state in self.topics.values():
+            if not state.pending:
+                continue
+            if now - state.last_push >= state.min_interval:
+                state.pending = False
+                state.last_push = now
+                state.pushes += 1
+                topics.add(state.name)
+            else:
+                state.deferred += 1
+        return topics
+
+    def next_wakeup(self, now=None):
+        """到下一個延後中的 topic 到期的秒數；沒有延後的 topic 時依最快的實際更新頻率"""
+        if now is None:
+            now = time.monotonic()
+        wakeup = IDLE_WAKEUP
+        for state in self.topics.values():
+            if state.pending:
+                wait = state.last_push + state.min_interval - now
+            elif state.interval:
+                wait = max(state.interval, state.min_interval)
+            else:
+                continue
+            if wait < wakeup:
+                wakeup = wait
+        return max(wakeup, MIN_WAKEUP)
+
+    def stats(self):
+        return {
+            name: {
+                'max_rate': state.max_rate,
+                'natural_rate': round(state.natural_rate, 2) if state.natural_rate else None,
+                'pushes': state.pushes,
+                'deferred': state.deferred,
+                'pending': state.pending,
+            }
+            for name, state in sorted(self.topics.items())
+        }
+
+
+class SignalAggregates:
+    """
+    在兩次推送之間累積 topic 內每個數值欄位的 min / max / mean
+
+    sample(name, section) 在每個 frame 解碼後呼叫；take(name) 取出並清空，
+    格式與 section 相同的巢狀 dict，葉節點為 {'min', 'max', 'mean', 'n'}。
+    解碼在另一個 process 時改以 sample_journal() 併入該 process 每個 frame 的樣本。
+    """
+
+    def __init__(self, topics=('imu2',)):
+        self.topics = frozenset(topics)
+        self._values = {}
+
+    def sample(self, name, section):
+        if name not in self.topics:
+            return
+        self._sample(self._values.setdefault(name, {}), section)
+
+    def _sample(self, acc, section):
+        for key, value in section.items():
+            if key == 'last_update':
+                continue
+            if isinstance(value, (dict, State)):
+                self._sample(acc.setdefault(key, {}), value)
+            elif type(value) in (int, float):
+                stats = acc.get(key)
+                if stats is None:
+                    acc[key] = [value, value, value, 1]
+                else:
+                    if value < stats[0]:
+                        stats[0] = value
+                    if value > stats[1]:
+                        stats[1] = value
+                    stats[2] += value
+                    stats[3] += 1
+
+    def sample_journal(self, samples):
+        """
+        併入 SignalJournal.take() 的結果 {訊號名稱: (times, values)}：
+        訊號名稱為 topic 加 data_store 路徑（數字為 index，例如 inverters.3.torque）。
+        min / max 與逐 frame sample() 相同；mean 與 n 只計算欄位實際更新的樣本
+        """
+        for name, (_, values) in samples.items():
+            topic, _, path = name.partition('.')
+            if topic not in self.topics or not values:
+                continue
+            acc = self._values.setdefault(topic, {})
+            *parents, key = (int(part) if part.isdigit() else part for part in path.split('.'))
+            for parent in parents:
+                acc = acc.setdefault(parent, {})
+            low, high, total, count = min(values), max(values), sum(values), len(values)
+            stats = acc.get(key)
+            if stats is None:
+                acc[key] = [low, high, total, count]
+            else:
+                if low < stats[0]:
+                    stats[0] = low
+                if high > stats[1]:
+                    stats[1] = high
+                stats[2] += total
+                stats[3] += count
+
+    def take(self, name):
+        acc = self._values.pop(name, None)
+        return self._summary(acc) if acc else None
+
+    def _summary(self, acc):
+        summary = {}
+        for key, value in acc.items():
+            if isinstance(value, dict):
+                summary[key] = self._summary(value)
+            else:
+                low, high, total, count = value
+                summary[key] = {'min': low, 'max': high, 'mean': total / count, 'n': count}
+        return summary
@@ -0,0 +1,248 @@
+"""
+Compact decoder state
+
+CanDecoder.data_store 的每個子系統是一個 __slots__ 物件（沒有 per-instance
+__dict__），電芯電壓與 position covariance 是 array('d')（未收到的電芯以 NaN
+表示），電芯溫度是整數（raw - 32），存成 array('h')，未收到的以 MISSING_INT 表示。
+產生的解碼函數直接寫入屬性（target.torque = ...），不再做字串 key 的 dict 查找。
+
+State 同時提供 dict 的讀寫介面（data_store['inverters'][3]['torque']、
+.get()、.items() 等），既有的程式不需要修改；序列化時不複製整個狀態，
+CanDelta.encode / encode_msgpack 以 as_dict() 取得淺層的 dict 檢視，
+array 轉為 list（NaN / MISSING_INT 轉回 None），輸出的 JSON 與原本的巢狀 dict
+完全相同（溫度仍是整數，與 CanBatch 一致）。
+"""
+
+import math
+from array import array
+
+CELL_VOLTAGE_COUNT = 105
+CELL_TEMPERATURE_COUNT = 224
+
+# 整數 array('h') 中表示尚未收到的值（溫度範圍 -32 ~ 223，不會用到）
+MISSING_INT = -32768
+
+
+def nan_array(length):
+    """長度 length、全部為 NaN（尚未收到）的 array('d')"""
+    return array('d', [math.nan]) * length
+
+
+def missing_int_array(length):
+    """長度 length、全部為 MISSING_INT（尚未收到）的 array('h')"""
+    return array('h', [MISSING_INT]) * length
+
+
+def array_list(values):
+    """array 轉為 list，NaN / MISSING_INT 轉為 None（與原本 [None] * n 的 list 相同）"""
+    items = values.tolist()
+    if values.typecode == 'd':
+        if any(item != item for item in items):
+            return [None if item != item else item for item in items]
+    elif MISSING_INT in items:
+        return [None if item == MISSING_INT else item for item in items]
+    return items
+
+
+def list_array(typecode, values):
+    """list（None 表示未收到）或其他型別的 array 轉為 typecode 的 array"""
+    if isinstance(values, array):
+        values = array_list(values)
+    if typecode == 'd':
+        return array('d', [math.nan if item is None else item for item in values])
+    return array(typecode, [MISSING_INT if item is None else int(item) for item in values])
+
+
+class State:
+    """
+    __slots__ 狀態物件的共用介面
+
+    欄位依 FIELDS 的順序（即原本 dict 的 key 順序），可以用屬性或 dict 的方式讀寫。
+    key 與 dict 介面的方法同名時（例如 'values'），以 RENAMED 對應到另一個屬性名稱。
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+    RENAMED = {}
+    # 由 FIELDS / RENAMED 產生：各 key 的屬性名稱
+    ATTRIBUTES = ()
+    _KEYS = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.ATTRIBUTES = tuple(cls.RENAMED.get(name, name) for name in cls.FIELDS)
+        cls._KEYS = dict(zip(cls.FIELDS, cls.ATTRIBUTES))
+
+    @classmethod
+    def attribute(cls, key):
+        """key 對應的屬性名稱（例如給 attrgetter 用）"""
+        return cls._KEYS[key]
+
+    def __init__(self):
+        for name in self.ATTRIBUTES:
+            setattr(self, name, None)
+
+    def __getitem__(self, key):
+        attribute = self._KEYS.get(key)
+        if attribute is None:
+            raise KeyError(key)
+        return getattr(self, attribute)
+
+    def __setitem__(self, key, value):
+        attribute = self._KEYS.get(key)
+        if attribute is None:
+            raise KeyError(key)
+        setattr(self, attribute, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+    def get(self, key, default=None):
+        attribute = self._KEYS.get(key)
+        return default if attribute is None else getattr(self, attribute)
+
+    def keys(self):
+        return self.FIELDS
+
+    def values(self):
+        return [getattr(self, attribute) for attribute in self.ATTRIBUTES]
+
+    def items(self):
+        return [(name, getattr(self, attribute)) for name, attribute in zip(self.FIELDS, self.ATTRIBUTES)]
+
+    def as_dict(self):
+        """淺層的 dict 檢視（值不複製，巢狀的 State / array 原樣放入）"""
+        return {name: getattr(self, attribute) for name, attribute in zip(self.FIELDS, self.ATTRIBUTES)}
+
+    def copy(self):
+        """與原本 dict.copy() 相同：回傳淺層複製的 dict"""
+        return self.as_dict()
+
+
+class TimestampState(State):
+    __slots__ = FIELDS = ('time', 'last_update')
+
+
+class GpsState(State):
+    __slots__ = FIELDS = ('lat', 'lon', 'alt', 'status', 'last_update')
+
+
+class CovarianceState(State):
+    # 'values' 存在 _values，不遮住 State.values()
+    FIELDS = ('values', 'type', 'type_name', 'last_update')
+    RENAMED = {'values': '_values'}
+    __slots__ = ('_values', 'type', 'type_name', 'last_update')
+
+    def __init__(self):
+        super().__init__()
+        self._values = array('d', bytes(9 * 8))
+        self.type = 0
+        self.type_name = 'UNKNOWN'
+
+
+class VelocityState(State):
+    __slots__ = FIELDS = ('linear_x', 'linear_y', 'linear_z',
+                          'angular_x', 'angular_y', 'angular_z',
+                          'magnitude', 'speed_kmh', 'last_update')
+
+
+class AccumulatorState(State):
+    __slots__ = FIELDS = ('soc', 'voltage', 'current', 'temperature',
+                          'status', 'heartbeat', 'capacity',
+                          'cell_voltages', 'cell_temperatures', 'last_update')
+
+    def __init__(self):
+        super().__init__()
+        self.cell_voltages = nan_array(CELL_VOLTAGE_COUNT)
+        self.cell_temperatures = missing_int_array(CELL_TEMPERATURE_COUNT)
+
+
+class InverterState(State):
+    __slots__ = FIELDS = ('name', 'status', 'torque', 'speed',
+                          'control_word', 'target_torque',
+                          'dc_voltage', 'dc_current',
+                          'mos_temp', 'mcu_temp', 'motor_temp',
+                          'heartbeat', 'last_update')
+
+    def __init__(self, name):
+        super().__init__()
+        self.name = name
+
+
+class VcuState(State):
+    __slots__ = FIELDS = ('steer', 'accel', 'apps1', 'apps2', 'brake', 'bse1', 'bse2',
+                          'last_update')
+
+
+class CanLoggingState(State):
+    __slots__ = FIELDS = ('is_recording', 'start_time', 'start_timestamp',
+                          'dropped_frames', 'overruns', 'last_update')
+
+    def __init__(self):
+        super().__init__()
+        self.is_recording = False
+
+
+class Vector3(State):
+    __slots__ = FIELDS = ('x', 'y', 'z')
+
+
+class EulerAngles(State):
+    __slots__ = FIELDS = ('roll', 'pitch', 'yaw')
+
+
+class Quaternion(State):
+    __slots__ = FIELDS = ('w', 'x', 'y', 'z')
+
+
+class ImuState(State):
+    __slots__ = FIELDS = ('lsm6_accel', 'lsm303_accel', 'gyro', 'euler_angles',
+                          'magnetometer', 'last_update')
+
+    def __init__(self):
+        super().__init__()
+        self.lsm6_accel = Vector3()
+        self.lsm303_accel = Vector3()
+        self.gyro = Vector3()
+        self.euler_angles = EulerAngles()
+        self.magnetometer = Vector3()
+
+
+class Imu2State(State):
+    __slots__ = FIELDS = ('acceleration', 'gyration', 'quaternion', 'last_update')
+
+    def __init__(self):
+        super().__init__()
+        self.acceleration = Vector3()
+        self.gyration = Vector3()
+        self.quaternion = Quaternion()
+
+
+def create_data_store():
+    """CanDecoder.data_store 的初始狀態（頂層與 inverters 仍是 dict，key 與原本相同）"""
+    return {
+        'timestamp': TimestampState(),
+        'gps': GpsState(),
+        'covariance': CovarianceState(),
+        'velocity': VelocityState(),
+        'accumulator': AccumulatorState(),
+        'inverters': {
+            # 1: InverterState('FL'),
+            # 2: InverterState('FR'),
+            3: InverterState('RL'),
+            4: InverterState('RR'),
+        },
+        'vcu': VcuState(),
+        'canlogging': CanLoggingState(),
+        'imu': ImuState(),
+        'imu2': Imu2State(),
+    }
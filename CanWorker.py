@@ -0,0 +1,289 @@
+"""
+CAN decode worker process
+
+web app 的 CAN 模式預設在 uvicorn 的 event loop 中接收並解碼（CanAsync），
+frame 接收、CanDecoder、JSON 編碼與 HTTP / WebSocket 共用同一個 GIL：
+dashboard client 一多，接收就會被延後（socket buffer 滿了就掉 frame），反之亦然。
+
+DecodeWorker 另外啟動一個 process 執行 CanIngest.IngestDaemon（ReceiverThread +
+CanDecoder），只屬於這個 web app（shared memory 與 socket 名稱帶 web process 的 pid）。
+web process 只讀取 worker 以最多 publish_rate 發布到 shared memory 的狀態
+（seqlock，不需要鎖，見 CanIngest.StateWriter），控制命令經由 Unix socket 請 worker 代送。
+
+    worker = DecodeWorker({0: 'can0'})
+    if worker.start():
+        ...
+        state = worker.poll()     # 有新狀態時回傳 (data_store, 有變動的頂層欄位, message_count, 歷史樣本)
+        worker.send(msg)
+        worker.stop()
+
+data_store 是發布頻率的快照，但 worker 的 decoder 另外以 SignalJournal 記錄每個 frame 的
+數值，隨狀態一起發布（poll() 的歷史樣本）：web process 以 CanDecoder.apply_state() 併入
+/api/history，以 SignalAggregates.sample_journal() 併入彙總，峰值不會因為發布頻率而漏掉。
+效果見 bench_ws_load.py。
+
+CanIngest.py daemon 已經在執行時不需要自己的 worker：IngestSource 以相同的介面
+直接讀取 daemon 發布的狀態（STATE_NAME），控制命令經由 FRAME_SOCKET 請 daemon 代送，
+不會有第二個開啟 bus 或解碼的 process。daemon 重新啟動時自動重新連上。
+
+    source = IngestSource()
+    if not source.start():       # 沒有 daemon 在執行
+        source = DecodeWorker({0: 'can0'})
+"""
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+import can
+
+from CanIngest import (FRAME_SOCKET, PUBLISH_RATE, REATTACH_INTERVAL, STATE_NAME, FrameClient,
+                       IngestDaemon, StateReader)
+
+# 等待 worker 開啟 bus 並建立 shared memory 的時間（秒）
+START_TIMEOUT = 5.0
+# worker 檢查 web process 是否還在的間隔（秒）
+PARENT_CHECK_INTERVAL = 1.0
+# web process 檢查新狀態的間隔（秒），小於發布間隔
+STATE_POLL_INTERVAL = 0.01
+
+
+def open_bus(channel):
+    """單次嘗試連接 CAN，失敗回傳 None"""
+    try:
+        return can.interface.Bus(channel=channel, bustype='socketcan')
+    except OSError:
+        return None
+
+
+def run_worker(channels, state_name, socket_path, publish_rate, parent_pid):
+    """worker process 的進入點：開啟 bus 並執行 IngestDaemon，web process 結束時跟著結束"""
+    # Ctrl+C 由 web process 處理，worker 由 DecodeWorker.stop() 結束
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    buses = {}
+    for bus_num, channel in channels.items():
+        bus = open_bus(channel)
+        if bus is None:
+            print(f"Decode worker: {channel} not available")
+            for opened in buses.values():
+                opened.shutdown()
+            sys.exit(1)
+        buses[bus_num] = bus
+
+    daemon = IngestDaemon(buses, reconnect=lambda bus_num: open_bus(channels[bus_num]),
+                          state_name=state_name, socket_path=socket_path,
+                          publish_rate=publish_rate)
+
+    def watch_parent():
+        # web process 被 kill -9 時不會呼叫 stop()，不要留下孤兒 worker
+        while daemon.running:
+            if os.getppid() != parent_pid:
+                daemon.running = False
+                return
+            time.sleep(PARENT_CHECK_INTERVAL)
+
+    threading.Thread(target=watch_parent, name="decode-worker-watchdog", daemon=True).start()
+    try:
+        daemon.run()
+    finally:
+        for bus in buses.values():
+            bus.shutdown()
+
+
+class DecodeWorker:
+    """web process 端：啟動 / 停止 worker，讀取它發布的狀態，代送控制命令"""
+
+    def __init__(self, channels, publish_rate=PUBLISH_RATE):
+        self.channels = dict(channels)
+        self.publish_rate = publish_rate
+        pid = os.getpid()
+        self.state_name = f"{STATE_NAME}_{pid}"
+        self.socket_path = f"/tmp/rpi_can_worker_{pid}.sock"
+        self.process = None
+        self.reader = None
+        self.client = None
+
+    def start(self, timeout=START_TIMEOUT):
+        """啟動 worker 並等待它建立 shared memory；bus 開不起來或逾時回傳 False"""
+        # spawn：不從 uvicorn process fork（event loop、socket 與執行緒都不帶過去）
+        context = multiprocessing.get_context('spawn')
+        self.process = context.Process(
+            target=run_worker, name="can-decode-worker", daemon=True,
+            args=(self.channels, self.state_name, self.socket_path, self.publish_rate, os.getpid()))
+        self.process.start()
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if not self.process.is_alive():
+                break
+            try:
+                self.reader = StateReader(self.state_name, track=True)
+                return True
+            except FileNotFoundError:
+                time.sleep(0.05)
+        print(f"Decode worker failed to start on {', '.join(self.channels.values())}")
+        self.stop()
+        return False
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def poll(self):
+        """有新狀態時回傳 (data_store, 有變動的頂層欄位或 None 表示全部, message_count, 歷史樣本)，否則 None"""
+        if self.reader is None:
+            return None
+        state = self.reader.read()
+        if state is None:
+            return None
+        data_store, message_count, _ = state
+        return data_store, self.reader.dirty, message_count, self.reader.samples
+
+    def send(self, msg, bus_num=0):
+        """請 worker 從 bus_num 送出 msg（第一次呼叫時才連線，只代送不訂閱 frame）"""
+        if self.client is None:
+            self.client = FrameClient(self.socket_path, filters=[])
+        try:
+            self.client.send(msg, bus_num)
+        except OSError:
+            self.client.close()
+            self.client = None
+            raise
+
+    def stats(self):
+        reader = self.reader
+        return {
+            'source': 'worker',
+            'pid': self.process.pid if self.process else None,
+            'alive': self.alive(),
+            'channels': self.channels,
+            'publish_rate': self.publish_rate,
+            'seq': reader.seq if reader else None,
+            'message_count': reader.message_count if reader else 0,
+            'age': round(time.time() - reader.published, 3) if reader and reader.published else None,
+            'read_retries': reader.retries if reader else 0,
+            'missed_samples': reader.missed_samples if reader else 0,
+            'worker': reader.stats if reader else None,
+        }
+
+    def stop(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.process = None
+
+
+class IngestSource:
+    """web process 端：讀取 CanIngest daemon 發布的狀態，經由 daemon 代送控制命令（介面與 DecodeWorker 相同）"""
+
+    def __init__(self, state_name=STATE_NAME, socket_path=FRAME_SOCKET):
+        self.state_name = state_name
+        self.socket_path = socket_path
+        self.reader = None
+        self.client = None
+        self.last_check = 0.0
+        self.reattaches = 0
+        # daemon 的 message_count 從連上時開始計算，daemon 重新啟動後接著累加
+        self.message_count = 0
+        self.daemon_messages = 0
+        self.pending = False
+
+    def start(self):
+        """連上 daemon 的 shared memory；daemon 沒有在執行時回傳 False"""
+        try:
+            self.reader = StateReader(self.state_name)
+        except FileNotFoundError:
+            return False
+        # 連上時已發布的狀態在第一次 poll() 回傳，之前收到的 frame 不計入 message_count
+        self.pending = self.reader.read() is not None
+        self.daemon_messages = self.reader.message_count
+        self.last_check = time.monotonic()
+        return True
+
+    def alive(self):
+        return self.reader is not None
+
+    def _check_daemon(self):
+        """沒有新狀態時每 REATTACH_INTERVAL 秒確認 daemon 是否重新啟動（segment 被重建），是的話重新連上"""
+        now = time.monotonic()
+        if now - self.last_check < REATTACH_INTERVAL:
+            return
+        self.last_check = now
+        if self.reader is not None:
+            if not self.reader.replaced():
+                return
+            print("CAN ingest daemon restarted, re-attaching")
+            self.reader.close()
+            self.reader = None
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+        try:
+            self.reader = StateReader(self.state_name)
+        except FileNotFoundError:
+            return
+        self.reattaches += 1
+        self.daemon_messages = 0
+
+    def poll(self):
+        """有新狀態時回傳 (data_store, 有變動的頂層欄位或 None 表示全部, message_count, 歷史樣本)，否則 None"""
+        if self.pending:
+            self.pending = False
+            return self.reader.data_store, None, self.message_count, self.reader.samples
+        if self.reader is None or not self.reader.changed():
+            self._check_daemon()
+            return None
+        state = self.reader.read()
+        if state is None:
+            return None
+        data_store, message_count, _ = state
+        self.message_count += max(message_count - self.daemon_messages, 0)
+        self.daemon_messages = message_count
+        return data_store, self.reader.dirty, self.message_count, self.reader.samples
+
+    def send(self, msg, bus_num=0):
+        """請 daemon 從 bus_num 送出 msg（第一次呼叫時才連線，只代送不訂閱 frame）"""
+        if self.client is None:
+            self.client = FrameClient(self.socket_path, filters=[])
+        try:
+            self.client.send(msg, bus_num)
+        except OSError:
+            self.client.close()
+            self.client = None
+            raise
+
+    def stats(self):
+        reader = self.reader
+        return {
+            'source': 'ingest',
+            'alive': self.alive(),
+            'state_name': self.state_name,
+            'reattaches': self.reattaches,
+            'seq': reader.seq if reader else None,
+            'message_count': self.message_count,
+            'age': round(time.time() - reader.published, 3) if reader and reader.published else None,
+            'read_retries': reader.retries if reader else 0,
+            'missed_samples': reader.missed_samples if reader else 0,
+            'daemon': reader.stats if reader else None,
+        }
+
+    def stop(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
@@ -2,7 +2,7 @@ import can
 import struct
 import asyncio
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,7 +14,14 @@ import threading
 from typing import List
 import csv
 import os
+from CanAsync import AsyncBusReader, LoopLagMonitor
+from CanBroadcast import AGGREGATES, FORMATS, Broadcaster, parse_request, select
 from CanDecoder import CanDecoder
+from CanDelta import encode
+from CanHistory import MAX_POINTS
+from CanReceiver import BusSelector
+from CanSchedule import SignalAggregates, TopicScheduler
+from CanWorker import STATE_POLL_INTERVAL, DecodeWorker, IngestSource
 # _0801_0831
 
 
@@ -33,16 +40,31 @@ CSV_FILE = "../LOGS/can_log_20250731_00445.csv"
 CSV_SPEED = 1.0
 PORT = 8888
 DIRBASE = "../LOGS/"
+# CAN 模式使用的 SocketCAN 介面
+CAN_CHANNEL = 'can0'
+# True：CAN 接收與解碼在另一個 process 執行（見 CanWorker），WebSocket client 多時不會掉 frame
+DECODE_WORKER = False
+# True：CanIngest.py daemon 有在執行時直接讀取它發布的狀態（見 CanWorker.IngestSource），
+# 不再自己開 bus 或解碼；沒有 daemon 時才依 DECODE_WORKER 使用 worker 或在 event loop 中接收
+USE_INGEST = True
 
 templates = Jinja2Templates(directory="templates")
 
-# WebSocket connections
-connections: List[WebSocket] = []
+# WebSocket connections（每個 client 的 bounded queue 與訂閱，見 CanBroadcast）
+broadcaster = Broadcaster()
+
+# 在兩次推送之間累積 min / max / mean 的快速訊號 topic（空 tuple 表示不累積）
+AGGREGATE_TOPICS = ('imu2',)
 
 class CanReceiverWebApp:
-    def __init__(self, use_csv=USE_CSV, csv_file=CSV_FILE, csv_speed=CSV_SPEED):
+    def __init__(self, use_csv=USE_CSV, csv_file=CSV_FILE, csv_speed=CSV_SPEED, decode_worker=DECODE_WORKER,
+                 use_ingest=USE_INGEST):
         self.csv_data = []
         self.use_csv = use_csv
+        self.decode_worker = decode_worker
+        self.use_ingest = use_ingest
+        self.worker = None
+        self.worker_messages = 0
         self.csv_file = csv_file
         self.csv_speed = csv_speed
         self.index = 0
@@ -57,6 +79,11 @@ class CanReceiverWebApp:
         
         # 初始化 CanDecoder
         self.decoder = CanDecoder()
+        # 每個 topic 有變動才推送，不超過各自的最大頻率（見 CanSchedule）
+        self.scheduler = TopicScheduler()
+        self.aggregates = SignalAggregates(AGGREGATE_TOPICS) if AGGREGATE_TOPICS else None
+        # 各數值訊號最近幾分鐘的歷史，/api/history 讓圖表重新連線時直接補上
+        self.decoder.enable_history()
         
         # Initialize CAN bus or CSV reader
         if self.use_csv:
@@ -65,10 +92,15 @@ class CanReceiverWebApp:
             self.csv_start_time = None
             self.bus = None
             self.load_csv_file()
+        elif self.use_ingest and self.attach_ingest():
+            self.bus = None
+        elif self.decode_worker:
+            self.bus = None
+            self.start_decode_worker()
         else:
             try:
                 from packaging import version
-                can_kwargs = dict(channel='can0')
+                can_kwargs = dict(channel=CAN_CHANNEL)
                 if version.parse(can.__version__) >= version.parse('4.2.0'):
                     can_kwargs['interface'] = 'socketcan'
                 else:
@@ -77,6 +109,10 @@ class CanReceiverWebApp:
             except Exception as e:
                 print(f"Warning: Could not initialize CAN bus: {e}")
                 self.bus = None
+        self.receiver = BusSelector({0: self.bus}) if self.bus else None
+        # CAN frame 在 socket 可讀時直接於 event loop 中處理（見 CanAsync）
+        self.reader = None
+        self.loop_lag = LoopLagMonitor()
         
         self.message_count = 0
         self.running = True
@@ -85,6 +121,7 @@ class CanReceiverWebApp:
 
     async def start_can_receiver(self):
         """啟動CAN接收循環和廣播循環"""
+        self.loop_lag.start()
         # 建立兩個並行的任務
         receiver_task = asyncio.create_task(self.receiver_loop())
         broadcaster_task = asyncio.create_task(self.broadcaster_loop())
@@ -107,13 +144,12 @@ class CanReceiverWebApp:
                 await asyncio.sleep(0.1)
 
     async def broadcaster_loop(self):
-        """定期廣播數據的循環"""
+        """廣播數據的循環，依各 topic 的更新頻率決定下次醒來的時間"""
         while self.running:
             # 只在有客戶端連接時才廣播
-            if connections:
+            if broadcaster:
                 await self.broadcast_data()
-            # 固定廣播頻率，例如每 50ms 一次 (20 FPS)
-            await asyncio.sleep(0.05)
+            await asyncio.sleep(self.scheduler.next_wakeup())
 
     def load_csv_file(self):
         """載入 CSV 檔案"""
@@ -220,6 +256,7 @@ class CanReceiverWebApp:
         target_index = int(len(self.csv_data) * percentage / 100)
         
         self.csv_index = target_index
+        self.decoder.history.clear()
         if self.csv_index < len(self.csv_data):
             current_time = time.time()
             elapsed_time = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
@@ -255,6 +292,7 @@ class CanReceiverWebApp:
                 target_index = 0
         
         self.csv_index = target_index
+        self.decoder.history.clear()
         current_time = time.time()
         elapsed_time = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
         self.csv_start_time = current_time - (elapsed_time / self.playback_speed)
@@ -278,6 +316,7 @@ class CanReceiverWebApp:
         self.csv_start_time = None
         self.csv_base_timestamp = None
         self.is_paused = False
+        self.decoder.history.clear()
         
         # 重新載入檔案
         self.load_csv_file()
@@ -323,6 +362,11 @@ class CanReceiverWebApp:
         
         try:
             # 停止當前模式
+            self.stop_can_reader()
+            self.stop_decode_worker()
+            if self.receiver:
+                self.receiver.close()
+                self.receiver = None
             if self.bus:
                 self.bus.shutdown()
                 self.bus = None
@@ -333,6 +377,7 @@ class CanReceiverWebApp:
             self.csv_start_time = None
             self.csv_base_timestamp = None
             self.is_paused = False
+            self.decoder.history.clear()
             
             if use_csv:
                 # 切換到 CSV 模式
@@ -342,13 +387,20 @@ class CanReceiverWebApp:
             else:
                 # 切換到 CAN 模式
                 try:
-                    from packaging import version
-                    can_kwargs = dict(channel='can0')
-                    if version.parse(can.__version__) >= version.parse('4.2.0'):
-                        can_kwargs['interface'] = 'socketcan'
+                    if self.use_ingest and self.attach_ingest():
+                        pass
+                    elif self.decode_worker:
+                        if not self.start_decode_worker():
+                            raise RuntimeError(f"decode worker could not open {CAN_CHANNEL}")
                     else:
-                        can_kwargs['bustype'] = 'socketcan'
-                    self.bus = can.interface.Bus(**can_kwargs)
+                        from packaging import version
+                        can_kwargs = dict(channel=CAN_CHANNEL)
+                        if version.parse(can.__version__) >= version.parse('4.2.0'):
+                            can_kwargs['interface'] = 'socketcan'
+                        else:
+                            can_kwargs['bustype'] = 'socketcan'
+                        self.bus = can.interface.Bus(**can_kwargs)
+                        self.receiver = BusSelector({0: self.bus})
                     print(f"Switched from {old_mode} to CAN mode")
                 except Exception as e:
                     print(f"Warning: Could not initialize CAN bus: {e}")
@@ -374,17 +426,15 @@ class CanReceiverWebApp:
     def is_can_available(self):
         """檢查 CAN 介面是否可用"""
         try:
-            test_bus = can.interface.Bus(channel='can0', bustype='socketcan')
+            test_bus = can.interface.Bus(channel=CAN_CHANNEL, bustype='socketcan')
             test_bus.shutdown()
             return True
         except:
             return False
 
-    async def broadcast_data(self):
-        """廣播數據到所有連接的客戶端"""
-        if not connections:
-            return
-        broadcast_data = {
+    def get_broadcast_data(self):
+        """組出廣播用的完整資料"""
+        return {
             'timestamp': self.decoder.data_store['timestamp']['time'].isoformat() if self.decoder.data_store['timestamp']['time'] else None,
             'gps': self.decoder.data_store['gps'],
             'velocity': self.decoder.data_store['velocity'],
@@ -397,19 +447,29 @@ class CanReceiverWebApp:
             'update_time': datetime.now().isoformat(),
             'playback_control': self.get_playback_status() 
         }
-        
-        # 發送到所有連接的客戶端
-        disconnected = []
-        for websocket in connections:
-            try:
-                await websocket.send_text(json.dumps(broadcast_data))
-            except:
-                disconnected.append(websocket)
-        
-        # 移除斷開的連接
-        for ws in disconnected:
-            if ws in connections:
-                connections.remove(ws)
+
+    async def broadcast_data(self):
+        """推送到期的 topic 到所有連接的客戶端（依各 client 的訂閱，每種格式只序列化一次）"""
+        if not broadcaster:
+            return
+        start = time.perf_counter()
+        scheduler = self.scheduler
+        scheduler.observe(self.decoder.data_store, self.decoder.take_dirty())
+        scheduler.mark('playback_control')
+        topics = scheduler.due()
+        if not topics:
+            return
+        broadcast_data = self.get_broadcast_data()
+        if self.aggregates:
+            aggregates = {}
+            for topic in topics:
+                summary = self.aggregates.take(topic)
+                if summary:
+                    aggregates[topic] = summary
+            if aggregates:
+                broadcast_data[AGGREGATES] = aggregates
+        broadcaster.broadcast(broadcast_data, pushed=topics)
+        broadcaster.last_encode = time.perf_counter() - start
 
     async def can_receive_callback(self):
         if self.use_csv:
@@ -418,17 +478,75 @@ class CanReceiverWebApp:
             await self.real_can_receive_callback()
 
     async def real_can_receive_callback(self):
-        """原始的 CAN 接收回調函數 (async)"""
-        try:
-            if self.bus:
-                message = self.bus.recv(timeout=0.001)
-                if message:
-                    self.message_count += 1
-                    self.process_can_message(message)
-                    # await self.broadcast_data() # REMOVED to prevent flooding
-            # await asyncio.sleep(0.001) # REMOVED, handled by receiver_loop
-        except Exception as e:
-            await asyncio.sleep(0.1)
+        """
+        CAN 模式：frame 由 AsyncBusReader 在 socket 可讀時直接處理（loop.add_reader，
+        不阻塞 event loop），這裡只確認監聽的是目前的 receiver；
+        worker / ingest 模式則讀取 worker process 或 CanIngest daemon 發布的最新狀態
+        """
+        if self.worker is not None:
+            self.apply_worker_state()
+            await asyncio.sleep(STATE_POLL_INTERVAL)
+            return
+        receiver = self.receiver
+        if self.reader is not None and self.reader.selector is not receiver:
+            self.stop_can_reader()
+        if receiver is not None and self.reader is None:
+            self.reader = AsyncBusReader(receiver, self.process_can_frames)
+            self.reader.start()
+        await asyncio.sleep(0.1)
+
+    def stop_can_reader(self):
+        """停止監聽 CAN socket（關閉 bus 之前呼叫）"""
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def start_decode_worker(self):
+        """CAN 接收與解碼改由 worker process 執行（見 CanWorker），bus 開不起來時回傳 False"""
+        worker = DecodeWorker({0: CAN_CHANNEL})
+        if not worker.start():
+            return False
+        self.worker = worker
+        self.worker_messages = 0
+        return True
+
+    def attach_ingest(self):
+        """CanIngest daemon 有在執行時改為讀取它發布的狀態（見 CanWorker.IngestSource），沒有 daemon 時回傳 False"""
+        source = IngestSource()
+        if not source.start():
+            return False
+        print("Using the CAN ingest daemon's decoded state")
+        self.worker = source
+        self.worker_messages = 0
+        return True
+
+    def stop_decode_worker(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+    def apply_worker_state(self):
+        """
+        把 worker（或 ingest daemon）最新發布的狀態就地寫入 decoder，只標記有變動的 topic；
+        歷史與彙總以 worker 每個 frame 的樣本更新，不是發布時的快照
+        """
+        state = self.worker.poll()
+        if state is None:
+            return
+        data_store, dirty, message_count, samples = state
+        self.decoder.apply_state(data_store, dirty, samples)
+        self.message_count += message_count - self.worker_messages
+        self.worker_messages = message_count
+        aggregates = self.aggregates
+        if aggregates:
+            for journal in samples:
+                aggregates.sample_journal(journal)
+
+    def process_can_frames(self, frames):
+        """AsyncBusReader 每次喚醒讀到的 [(bus_num, msg), ...]"""
+        for _, message in frames:
+            self.message_count += 1
+            self.process_can_message(message)
 
     async def csv_receive_callback(self):
         """CSV 模式的接收回調函數 (async)"""
@@ -464,7 +582,10 @@ class CanReceiverWebApp:
         return self.decoder.create_mock_can_message(can_id, data)
 
     def process_can_message(self, msg: can.Message):
-        self.decoder.process_can_message(msg)
+        section = self.decoder.process_can_message(msg)
+        aggregates = self.aggregates
+        if aggregates and section in aggregates.topics:
+            aggregates.sample(section, self.decoder.data_store[section])
 
 
 
@@ -496,7 +617,8 @@ async def imu2_dashboard(request: Request):
 @app.get('/api/data')
 async def get_data():
     if can_receiver:
-        return {
+        # data_store 的 __slots__ 狀態與電芯 array 由 encode() 序列化成原本的 dict / list
+        return Response(encode({
             'timestamp': can_receiver.decoder.data_store['timestamp']['time'].isoformat() if can_receiver.decoder.data_store['timestamp']['time'] else None,
             'gps': can_receiver.decoder.data_store['gps'],
             'velocity': can_receiver.decoder.data_store['velocity'],
@@ -508,31 +630,85 @@ async def get_data():
             'canlogging': can_receiver.decoder.data_store['canlogging'],
             'message_count': can_receiver.message_count,
             'update_time': datetime.now().isoformat()
-        }
+        }), media_type='application/json')
     else:
         return {'error': 'CAN receiver not initialized'}
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connections.append(websocket)
+    # ?format=msgpack: 二進位 MessagePack frame（static/msgpack.js 解碼），預設 JSON 文字
+    data_format = websocket.query_params.get('format', 'json')
+    if data_format not in FORMATS:
+        data_format = 'json'
+    client = broadcaster.add(websocket, 'full', data_format)
     print('Client connected')
     # 新增：連線時主動推送一次資料
     if can_receiver:
-        await can_receiver.broadcast_data()
+        client.send(can_receiver.get_broadcast_data())
     try:
         while True:
-            await websocket.receive_text()  # 等待客戶端發送消息以保持連接
+            text = await websocket.receive_text()  # 等待客戶端發送消息以保持連接
+            request = parse_request(text)
+            if request is not None and request.get('type') == 'subscribe':
+                # {"type": "subscribe", "topics": [...], "rate": Hz}，見 CanBroadcast
+                broadcaster.subscribe(client, request.get('topics'), request.get('rate'))
+                # 訂閱的 topic 可能很久才有推送，先送一次目前的資料
+                if can_receiver:
+                    client.send(select(can_receiver.get_broadcast_data(), client.subscription.topics))
     except Exception as e:
         print('Client disconnected', e)
     finally:
-        if websocket in connections:
-            connections.remove(websocket)
+        broadcaster.remove(websocket)
+
+@app.get('/api/ws/clients')
+async def get_ws_clients():
+    """每個 WebSocket client 的排隊、丟棄與延遲統計"""
+    return broadcaster.stats()
+
+@app.get('/api/ws/topics')
+async def get_ws_topics():
+    """每個 topic 的實際更新頻率、最大推送頻率與推送 / 延後次數"""
+    if can_receiver:
+        return can_receiver.scheduler.stats()
+    return {'error': 'CAN receiver not initialized'}
+
+@app.get('/api/receiver')
+async def get_receiver_stats():
+    """CAN 接收（每次喚醒的 frame 數）與 event loop 延遲統計"""
+    if not can_receiver:
+        return {'error': 'CAN receiver not initialized'}
+    reader = can_receiver.reader
+    worker = can_receiver.worker
+    return {
+        'mode': 'csv' if can_receiver.use_csv else 'can',
+        'message_count': can_receiver.message_count,
+        'reader': reader.stats() if reader else None,
+        'worker': worker.stats() if worker else None,
+        'loop_lag': can_receiver.loop_lag.stats(),
+    }
+
+@app.get('/api/history')
+async def get_history(signals: str = None, since: float = None, points: int = MAX_POINTS):
+    """
+    訊號歷史，欄位式格式（見 CanHistory）
+    signals: 逗號分隔的訊號名稱或前綴（例如 inverters.3.torque,imu2.acceleration），省略時列出可用的訊號
+    since: epoch 秒，或負數表示幾秒前（例如 -60）；省略時回傳保留範圍內的全部
+    points: 每個訊號最多回傳的點數，超過時以 min / max 降採樣（保留峰值）；0 表示只回傳最近的原始樣本
+    """
+    if not can_receiver:
+        return {'error': 'CAN receiver not initialized'}
+    history = can_receiver.decoder.history
+    if not signals:
+        return {'signals': history.names(), 'seconds': history.seconds, 'retention': history.retention}
+    names = [name.strip() for name in signals.split(',') if name.strip()]
+    return Response(encode(history.query(names, since, max_points=max(points, 0))),
+                    media_type='application/json')
 
 async def start_can_receiver():
     """啟動 CAN 接收器"""
     global can_receiver
-    can_receiver = CanReceiverWebApp()
+    can_receiver = CanReceiverWebApp(use_csv=USE_CSV, decode_worker=DECODE_WORKER, use_ingest=USE_INGEST)
     await can_receiver.start_can_receiver()
 
 @app.on_event("startup")
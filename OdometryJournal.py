@@ -0,0 +1,199 @@
+"""
+Append-only odometry journal
+
+累計里程原本只存在 trip_distance_cumulative.csv，每次 RTD 結束整個檔案重寫，
+寫到一半斷電就會失去累計里程。這裡改為只附加的日誌，每筆紀錄一行:
+
+    kind,time,cumulative_km,trip_km,duration_s,crc32
+
+    kind          C = 行程中的 checkpoint（累計里程含目前行程已跑的距離）
+                  T = 行程結束
+    crc32         前面欄位的 CRC32（hex），斷電時寫到一半的最後一行會被略過
+
+- 每筆紀錄寫入後立即 flush（process 當掉不會遺失），fsync 則每 fsync_interval
+  秒批次一次（SD 卡寫入次數少），行程結束時立即 fsync
+- 啟動時只讀檔案最後 TAIL_BYTES，取最後一筆有效紀錄的 cumulative_km（O(1)，
+  與日誌長度無關）
+- 檔案超過 compact_bytes 時只保留 T 紀錄，寫到暫存檔、fsync 後以 os.replace 取代
+  （任何時間點斷電，磁碟上都是完整的舊檔或新檔）
+
+    journal = TripJournal(os.path.join(base_dir, JOURNAL_FILE))
+    journal.cumulative_km                       # 恢復的累計里程
+    journal.checkpoint(trip_km, duration_s)     # RTD 中定期呼叫
+    journal.end_trip(trip_km, duration_s)       # RTD 結束
+"""
+
+import os
+import time
+import zlib
+from collections import namedtuple
+
+JOURNAL_FILE = "trip_distance_journal.csv"
+
+CHECKPOINT = 'C'
+TRIP = 'T'
+
+# fsync 批次間隔（秒）：斷電最多遺失這段時間內的 checkpoint
+FSYNC_INTERVAL = 30.0
+# 日誌超過此大小時壓縮（bytes）
+COMPACT_BYTES = 256 * 1024
+# 啟動時從檔尾讀取的長度（bytes），遠大於一筆紀錄
+TAIL_BYTES = 4096
+
+Record = namedtuple('Record', 'kind time cumulative_km trip_km duration_s')
+
+
+def format_record(kind, when, cumulative_km, trip_km, duration_s):
+    body = f"{kind},{when:.3f},{cumulative_km:.6f},{trip_km:.6f},{duration_s:.2f}"
+    return f"{body},{zlib.crc32(body.encode()):08x}\n"
+
+
+def parse_record(line):
+    """解析一行紀錄，格式不符或 CRC 錯誤時回傳 None"""
+    body, _, crc = line.strip().rpartition(',')
+    if not body:
+        return None
+    try:
+        if int(crc, 16) != zlib.crc32(body.encode()):
+            return None
+        kind, when, cumulative_km, trip_km, duration_s = body.split(',')
+        if kind not in (CHECKPOINT, TRIP):
+            return None
+        return Record(kind, float(when), float(cumulative_km), float(trip_km), float(duration_s))
+    except ValueError:
+        return None
+
+
+def read_records(path):
+    """依序讀出所有有效紀錄（壓縮用）"""
+    records = []
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            record = parse_record(line)
+            if record is not None:
+                records.append(record)
+    return records
+
+
+def read_last_record(path, tail_bytes=TAIL_BYTES):
+    """只讀檔尾，回傳最後一筆有效紀錄；檔案不存在或沒有有效紀錄時回傳 None"""
+    try:
+        with open(path, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - tail_bytes))
+            lines = f.read().split(b'\n')
+    except FileNotFoundError:
+        return None
+    if size > tail_bytes:
+        lines = lines[1:]  # 第一行可能只讀到後半段
+    for line in reversed(lines):
+        record = parse_record(line.decode('utf-8', errors='replace'))
+        if record is not None:
+            return record
+    if size > tail_bytes:
+        # 檔尾都是損壞的資料，退回完整掃描
+        records = read_records(path)
+        return records[-1] if records else None
+    return None
+
+
+def _ends_with_partial_line(path):
+    try:
+        with open(path, 'rb') as f:
+            if f.seek(0, os.SEEK_END) == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+    except FileNotFoundError:
+        return False
+
+
+def _fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class TripJournal:
+    """里程日誌的 writer（同一個檔案只能有一個 writer）"""
+
+    def __init__(self, path, fsync_interval=FSYNC_INTERVAL, compact_bytes=COMPACT_BYTES,
+                 initial_km=None):
+        """initial_km: 日誌還不存在時的起始累計里程（例如從舊的 trip_distance_cumulative.csv 匯入）"""
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_bytes = compact_bytes
+        self.compact_at = compact_bytes
+
+        last = read_last_record(path)
+        self.cumulative_km = last.cumulative_km if last else 0.0
+        self.recovered = last
+        partial = _ends_with_partial_line(path)
+        self.file = open(path, 'a', encoding='utf-8')
+        if partial:
+            # 斷電時最後一行只寫了一半，從新的一行開始
+            self.file.write('\n')
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.syncs = 0
+        self.compactions = 0
+        if last is None and initial_km:
+            self.cumulative_km = initial_km
+            self._append(TRIP, time.time(), initial_km, 0.0, 0.0)
+            self.sync()
+
+    def _append(self, kind, when, cumulative_km, trip_km, duration_s):
+        self.file.write(format_record(kind, when, cumulative_km, trip_km, duration_s))
+        self.file.flush()
+        self.unsynced += 1
+
+    def checkpoint(self, trip_km, duration_s, when=None):
+        """記錄行程中的進度（累計里程含 trip_km），fsync 以 fsync_interval 批次"""
+        self._append(CHECKPOINT, when or time.time(), self.cumulative_km + trip_km, trip_km, duration_s)
+        if time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def end_trip(self, trip_km, duration_s, when=None):
+        """行程結束：累加里程並立即 fsync，日誌太大時壓縮；回傳新的累計里程"""
+        self.cumulative_km += trip_km
+        self._append(TRIP, when or time.time(), self.cumulative_km, trip_km, duration_s)
+        self.sync()
+        if self.file.tell() >= self.compact_at:
+            self.compact()
+        return self.cumulative_km
+
+    def sync(self):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+            self.syncs += 1
+        self.last_sync = time.monotonic()
+
+    def compact(self):
+        """只保留行程結束紀錄，以暫存檔 + os.replace 取代（過程中斷電不影響原檔）"""
+        self.sync()
+        trips = [record for record in read_records(self.path) if record.kind == TRIP]
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in trips:
+                f.write(format_record(*record))
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temp_path, self.path)
+        _fsync_directory(self.path)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self.compactions += 1
+        # 只剩行程紀錄時也會慢慢變大，下一次等檔案再長一倍才壓縮
+        self.compact_at = max(self.compact_bytes, self.file.tell() * 2)
+
+    def close(self):
+        self.sync()
+        self.file.close()
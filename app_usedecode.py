@@ -2,7 +2,7 @@ import can
 import struct
 import asyncio
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -14,7 +14,17 @@ import threading
 from typing import List
 import csv
 import os
+import subprocess
+import sys
+from CanAsync import AsyncBusReader, LoopLagMonitor
+from CanBroadcast import AGGREGATES, FORMATS, Broadcaster, parse_request, select
 from CanDecoder import CanDecoder
+from CanDelta import DeltaEncoder, encode
+from CanHistory import MAX_POINTS
+from CanReceiver import BusSelector
+from CanReplay import Keyframes, LogReplay
+from CanSchedule import SignalAggregates, TopicScheduler
+from CanWorker import STATE_POLL_INTERVAL, DecodeWorker, IngestSource
 
 
 app = FastAPI()
@@ -32,15 +42,33 @@ CSV_FILE = "../LOGS/can_log_20250731_004450.csv"
 CSV_SPEED = 1.0
 PORT = 8888
 DIRBASE = "../LOGS/"
+# CAN 模式使用的 SocketCAN 介面
+CAN_CHANNEL = 'can0'
+# True：CAN 接收與解碼在另一個 process 執行（見 CanWorker），WebSocket client 多時不會掉 frame
+DECODE_WORKER = False
+# True：CanIngest.py daemon 有在執行時直接讀取它發布的狀態（見 CanWorker.IngestSource），
+# 不再自己開 bus 或解碼；沒有 daemon 時才依 DECODE_WORKER 使用 worker 或在 event loop 中接收
+USE_INGEST = True
 
 templates = Jinja2Templates(directory="templates")
 
-# WebSocket connections
-connections: List[WebSocket] = []
+# 每個 client 的 bounded queue，慢的 client 丟最舊的訊息
+WS_QUEUE_SIZE = 8
+
+# WebSocket connections（kind: 'full' 每個 tick 收完整資料，'delta' 以 /ws?delta=1 連線只收變動的欄位）
+broadcaster = Broadcaster(queue_size=WS_QUEUE_SIZE)
+
+# 在兩次推送之間累積 min / max / mean 的快速訊號 topic（空 tuple 表示不累積）
+AGGREGATE_TOPICS = ('imu2',)
 
 class CanReceiverWebApp:
-    def __init__(self, use_csv=USE_CSV, csv_file=CSV_FILE, csv_speed=CSV_SPEED):
+    def __init__(self, use_csv=USE_CSV, csv_file=CSV_FILE, csv_speed=CSV_SPEED, decode_worker=DECODE_WORKER,
+                 use_ingest=USE_INGEST):
         self.use_csv = use_csv
+        self.decode_worker = decode_worker
+        self.use_ingest = use_ingest
+        self.worker = None
+        self.worker_messages = 0
         self.csv_file = csv_file
         self.csv_speed = csv_speed
         self.index = 0
@@ -49,32 +77,51 @@ class CanReceiverWebApp:
         self.current_csv_file = csv_file
         self.available_csv_files = self.scan_csv_files()
         self.total_csv_messages = 0
+        self.replay = None
+        self.keyframes = None
+        self.keyframe_process = None
         self.decoder = CanDecoder()
+        self.delta = DeltaEncoder(volatile=('update_time', 'message_count'))
+        # 每個 topic 有變動才推送，不超過各自的最大頻率（見 CanSchedule）
+        self.scheduler = TopicScheduler()
+        self.aggregates = SignalAggregates(AGGREGATE_TOPICS) if AGGREGATE_TOPICS else None
+        # 各數值訊號最近幾分鐘的歷史，/api/history 讓圖表重新連線時直接補上
+        self.decoder.enable_history()
         self.running = True
         self.message_count = 0
         
         # Initialize CAN bus or CSV reader
         if self.use_csv:
-            self.csv_data = []
             self.csv_index = 0
             self.csv_start_time = None
+            self.csv_base_timestamp = None
             self.bus = None
             self.load_csv_file()
+        elif self.use_ingest and self.attach_ingest():
+            self.bus = None
+        elif self.decode_worker:
+            self.bus = None
+            self.start_decode_worker()
         else:
             if os.name == 'posix':
                 try:
-                    self.bus = can.interface.Bus(channel='can0', bustype='socketcan')
+                    self.bus = can.interface.Bus(channel=CAN_CHANNEL, bustype='socketcan')
                 except Exception as e:
                     print(f"Warning: Could not initialize CAN bus on Linux: {e}")
                     self.bus = None
             else:
                 self.bus = None
                 print("CAN bus initialization skipped on non-Linux OS.")
+        self.receiver = BusSelector({0: self.bus}) if self.bus else None
+        # CAN frame 在 socket 可讀時直接於 event loop 中處理（見 CanAsync）
+        self.reader = None
+        self.loop_lag = LoopLagMonitor()
         
         print("CAN Receiver Web App Started")
 
     async def start_can_receiver(self):
         """啟動CAN接收循環和廣播循環"""
+        self.loop_lag.start()
         # 建立兩個並行的任務
         receiver_task = asyncio.create_task(self.receiver_loop())
         broadcaster_task = asyncio.create_task(self.broadcaster_loop())
@@ -97,71 +144,63 @@ class CanReceiverWebApp:
                 await asyncio.sleep(0.1)
 
     async def broadcaster_loop(self):
-        """定期廣播數據的循環"""
+        """廣播數據的循環，依各 topic 的更新頻率決定下次醒來的時間"""
         while self.running:
             # 只在有客戶端連接時才廣播
-            if connections:
+            if broadcaster:
                 await self.broadcast_data()
-            # 固定廣播頻率，例如每 50ms 一次 (20 FPS)
-            await asyncio.sleep(0.05)
+            await asyncio.sleep(self.scheduler.next_wakeup())
 
     def load_csv_file(self):
-        """載入 CSV 檔案"""
+        """開啟 CSV 檔案（使用 <log>.idx 索引，播放時才逐行解析）"""
+        self.close_csv_file()
+        self.decoder.history.clear()
         try:
-            with open(self.csv_file, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    can_id = row['ID']
-                    # print(f"Processing CSV row{self.index} with ID: {can_id}")
-                    self.index += 1
-                    try:
-                        # 解析 CSV 行
-                        timestamp = int(row['Time Stamp'])
-                        can_id = int(row['ID'], 16)  # 16進制轉換
-                        length = int(row['LEN'])
-                        
-                        data = []
-                        for i in range(1, 13):  # D1-D12
-                            data_key = f'D{i}'
-                            if data_key in row and row[data_key] != '' and row[data_key] is not None:  # 只處理存在且不為空的欄位
-                                try:
-                                    # 確保是字符串並移除可能的空白字符
-                                    data_value = str(row[data_key]).strip()
-                                    if data_value:  # 確保不是空字符串
-                                        data.append(int(data_value, 16))
-                                    else:
-                                        data.append(0)
-                                        # print(f"Missing or empty data for {data_key}, stopping further data extraction.1")
-                                except ValueError as ve:
-                                    # 如果無法解析，跳過此欄位而不是添加 0
-                                    print(f"Invalid data for {data_key}: '{row[data_key]}' (type: {type(row[data_key])}), skipping - {ve}")
-                                    break
-                            else:
-                                data.append(0)
-                                break
-                        
-                        # 確保數據長度不超過 LEN 指定的長度
-                        if len(data) > length:
-                            data = data[:length]
-                        
-                        self.csv_data.append({
-                            'timestamp': timestamp,
-                            'can_id': can_id,
-                            'data': bytes(data)
-                        })
-                    except Exception as e:
-                        print(f"Error parsing CSV row: {e}")
-                        print(f"Row data: {dict(row)}")
-                        continue  # 跳過錯誤的行，繼續處理下一行
-            
-            print(f"Loaded {len(self.csv_data)} CAN messages from CSV")
-            
+            start = time.time()
+            self.replay = LogReplay(self.csv_file)
+            self.total_csv_messages = len(self.replay)
+            print(f"Indexed {len(self.replay)} CAN messages from CSV in {time.time() - start:.2f}s")
+            self.keyframes = Keyframes.load(self.replay, self.decoder.network_file)
+            if self.keyframes is None or self.keyframes.count < self.total_csv_messages:
+                self.start_keyframe_indexer()
         except FileNotFoundError:
             print(f"CSV file not found: {self.csv_file}")
-            self.csv_data = []
         except Exception as e:
             print(f"Error loading CSV file: {e}")
-            self.csv_data = []
+
+    def close_csv_file(self):
+        """關閉目前的 CSV 檔案"""
+        if self.replay is not None:
+            self.replay.close()
+            self.replay = None
+        self.keyframes = None
+        self.total_csv_messages = 0
+
+    def start_keyframe_indexer(self):
+        """在背景 process 建立 keyframe（需解碼整個檔案，不佔用 event loop）"""
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CanReplay.py')
+        self.keyframe_process = subprocess.Popen([sys.executable, script, 'index', self.csv_file],
+                                                 stdout=subprocess.DEVNULL)
+        print(f"Building keyframes for {os.path.basename(self.csv_file)} in background...")
+
+    def current_keyframes(self):
+        """目前檔案的 keyframe；背景建立完成後重新載入"""
+        if self.replay is None:
+            return None
+        if self.keyframe_process is not None and self.keyframe_process.poll() is not None:
+            self.keyframe_process = None
+            self.keyframes = Keyframes.load(self.replay, self.decoder.network_file)
+        return self.keyframes
+
+    def seek(self, index):
+        """移動播放游標，並以最近的 keyframe 重建該時間點的解碼狀態"""
+        self.csv_index = index
+        keyframes = self.current_keyframes()
+        replayed = keyframes.seek(self.replay, self.decoder, index) if keyframes else None
+        # 跳轉前的歷史與跳轉後的時間軸不連續，重新開始記錄
+        self.decoder.history.clear()
+        if replayed is None:
+            print("Keyframes not ready, values will refresh as messages are replayed")
 
     def scan_csv_files(self):
         """掃描可用的 CSV 檔案"""
@@ -183,9 +222,9 @@ class CanReceiverWebApp:
         """恢復播放"""
         self.is_paused = False
         # 重新設定時間基準點以避免時間跳躍
-        if self.csv_start_time and self.csv_index < len(self.csv_data):
+        if self.csv_start_time and self.csv_index < self.total_csv_messages:
             current_time = time.time()
-            elapsed_time = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
+            elapsed_time = (self.replay.timestamps[self.csv_index] - self.csv_base_timestamp) / 1000000
             self.csv_start_time = current_time - (elapsed_time / self.playback_speed)
         print("Playback resumed")
 
@@ -203,50 +242,41 @@ class CanReceiverWebApp:
 
     def jump_to_percentage(self, percentage):
         """跳到指定百分比位置"""
-        if not self.csv_data:
+        if not self.total_csv_messages:
             return False
         
         percentage = max(0, min(100, percentage))
-        target_index = int(len(self.csv_data) * percentage / 100)
+        target_index = int(self.total_csv_messages * percentage / 100)
         
-        self.csv_index = target_index
-        if self.csv_index < len(self.csv_data):
+        self.seek(target_index)
+        if self.csv_index < self.total_csv_messages:
             current_time = time.time()
-            elapsed_time = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
+            elapsed_time = (self.replay.timestamps[self.csv_index] - self.csv_base_timestamp) / 1000000
             self.csv_start_time = current_time - (elapsed_time / self.playback_speed)
         
-        print(f"Jumped to {percentage}% ({self.csv_index}/{len(self.csv_data)})")
+        print(f"Jumped to {percentage}% ({self.csv_index}/{self.total_csv_messages})")
         return True
 
     def jump_time(self, seconds):
         """前進或後退指定秒數"""
-        if not self.csv_data or not self.csv_start_time:
+        if not self.total_csv_messages or not self.csv_start_time:
             return False
         
+        timestamps = self.replay.timestamps
+        total = self.total_csv_messages
         # 計算目標時間戳
-        current_timestamp = self.csv_data[self.csv_index]['timestamp'] if self.csv_index < len(self.csv_data) else self.csv_data[-1]['timestamp']
+        current_timestamp = timestamps[self.csv_index] if self.csv_index < total else timestamps[-1]
         target_timestamp = current_timestamp + (seconds * 1000000)  # 轉換為微秒
         
-        # 找到最接近的索引
-        target_index = self.csv_index
-        if seconds > 0:  # 前進
-            for i in range(self.csv_index, len(self.csv_data)):
-                if self.csv_data[i]['timestamp'] >= target_timestamp:
-                    target_index = i
-                    break
-            else:
-                target_index = len(self.csv_data) - 1
-        else:  # 後退
-            for i in range(self.csv_index, -1, -1):
-                if self.csv_data[i]['timestamp'] <= target_timestamp:
-                    target_index = i
-                    break
-            else:
-                target_index = 0
+        # 以 bisect 找到目標索引
+        if seconds > 0:  # 前進：第一筆 >= 目標時間
+            target_index = min(self.replay.find(target_timestamp), total - 1)
+        else:  # 後退：最後一筆 <= 目標時間
+            target_index = self.replay.find_before(target_timestamp)
         
-        self.csv_index = target_index
+        self.seek(target_index)
         current_time = time.time()
-        elapsed_time = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
+        elapsed_time = (timestamps[self.csv_index] - self.csv_base_timestamp) / 1000000
         self.csv_start_time = current_time - (elapsed_time / self.playback_speed)
         
         print(f"Jumped {seconds}s to index {self.csv_index}")
@@ -263,7 +293,6 @@ class CanReceiverWebApp:
         
         self.current_csv_file = new_file_path
         self.csv_file = new_file_path
-        self.csv_data = []
         self.csv_index = 0
         self.csv_start_time = None
         self.csv_base_timestamp = None
@@ -277,18 +306,19 @@ class CanReceiverWebApp:
     def get_playback_status(self):
         """獲取播放狀態"""
         progress = 0
-        if self.csv_data:
-            progress = (self.csv_index / len(self.csv_data)) * 100
+        if self.total_csv_messages:
+            progress = (self.csv_index / self.total_csv_messages) * 100
         
         current_time_str = "00:00"
         total_time_str = "00:00"
         
-        if self.csv_data and self.csv_base_timestamp:
-            if self.csv_index < len(self.csv_data):
-                current_seconds = (self.csv_data[self.csv_index]['timestamp'] - self.csv_base_timestamp) / 1000000
+        if self.total_csv_messages and self.csv_base_timestamp:
+            timestamps = self.replay.timestamps
+            if self.csv_index < self.total_csv_messages:
+                current_seconds = (timestamps[self.csv_index] - self.csv_base_timestamp) / 1000000
                 current_time_str = f"{int(current_seconds//60):02d}:{int(current_seconds%60):02d}"
             
-            total_seconds = (self.csv_data[-1]['timestamp'] - self.csv_base_timestamp) / 1000000
+            total_seconds = (timestamps[-1] - self.csv_base_timestamp) / 1000000
             total_time_str = f"{int(total_seconds//60):02d}:{int(total_seconds%60):02d}"
         
         return {
@@ -313,6 +343,12 @@ class CanReceiverWebApp:
         
         try:
             # 停止當前模式
+            self.close_csv_file()
+            self.stop_can_reader()
+            self.stop_decode_worker()
+            if self.receiver:
+                self.receiver.close()
+                self.receiver = None
             if self.bus:
                 self.bus.shutdown()
                 self.bus = None
@@ -323,10 +359,10 @@ class CanReceiverWebApp:
             self.csv_start_time = None
             self.csv_base_timestamp = None
             self.is_paused = False
+            self.decoder.history.clear()
             
             if use_csv:
                 # 切換到 CSV 模式
-                self.csv_data = []
                 # 刷新可用的 CSV 檔案列表
                 self.available_csv_files = self.scan_csv_files()
                 self.load_csv_file()
@@ -335,13 +371,19 @@ class CanReceiverWebApp:
             else:
                 # 切換到 CAN 模式
                 try:
-                    self.bus = can.interface.Bus(channel='can0', bustype='socketcan')
+                    if self.use_ingest and self.attach_ingest():
+                        pass
+                    elif self.decode_worker:
+                        if not self.start_decode_worker():
+                            raise RuntimeError(f"decode worker could not open {CAN_CHANNEL}")
+                    else:
+                        self.bus = can.interface.Bus(channel=CAN_CHANNEL, bustype='socketcan')
+                        self.receiver = BusSelector({0: self.bus})
                     print(f"Switched from {old_mode} to CAN mode")
                 except Exception as e:
                     print(f"Warning: Could not initialize CAN bus: {e}")
                     # 如果 CAN 初始化失敗，回到 CSV 模式
                     self.use_csv = True
-                    self.csv_data = []
                     self.load_csv_file()
                     return False
             
@@ -363,7 +405,7 @@ class CanReceiverWebApp:
         if os.name != 'posix':
             return False
         try:
-            test_bus = can.interface.Bus(channel='can0', bustype='socketcan')
+            test_bus = can.interface.Bus(channel=CAN_CHANNEL, bustype='socketcan')
             test_bus.shutdown()
             return True
         except:
@@ -372,7 +414,7 @@ class CanReceiverWebApp:
     def send_can_control_command(self, command_byte):
         """發送 CAN 控制命令到 0x420"""
         # 檢查是否在 CAN 模式且 bus 已被初始化
-        if self.use_csv or not self.bus:
+        if self.use_csv or not (self.bus or self.worker):
             msg = "Not in CAN mode or CAN bus not initialized."
             print(msg)
             return False, msg
@@ -381,7 +423,10 @@ class CanReceiverWebApp:
             # 重用 self.bus 來發送訊息
             data = [command_byte] + [0x00] * 7  # 第一個 byte 是命令，其餘填 0
             message = can.Message(arbitration_id=0x420, data=data, is_extended_id=False)
-            self.bus.send(message)
+            if self.worker:
+                self.worker.send(message)
+            else:
+                self.bus.send(message)
             
             command_name = "START" if command_byte == 0x01 else "STOP" if command_byte == 0x02 else "UNKNOWN"
             print(f"Sent CAN control command via self.bus: {command_name} (0x420: {command_byte:02X})")
@@ -391,11 +436,9 @@ class CanReceiverWebApp:
             print(error_msg)
             return False, error_msg
 
-    async def broadcast_data(self):
-        """廣播數據到所有連接的客戶端"""
-        if not connections:
-            return
-        broadcast_data = {
+    def get_broadcast_data(self):
+        """組出廣播用的完整資料（data_store 內的 dict 直接引用，不複製）"""
+        return {
             'timestamp': self.decoder.data_store['timestamp']['time'].isoformat() if self.decoder.data_store['timestamp']['time'] else None,
             'gps': self.decoder.data_store['gps'],
             'velocity': self.decoder.data_store['velocity'],
@@ -408,19 +451,58 @@ class CanReceiverWebApp:
             'update_time': datetime.now().isoformat(),
             'playback_control': self.get_playback_status() 
         }
-        
-        # 發送到所有連接的客戶端
-        disconnected = []
-        for websocket in connections:
-            try:
-                await websocket.send_text(json.dumps(broadcast_data))
-            except:
-                disconnected.append(websocket)
-        
-        # 移除斷開的連接
-        for ws in disconnected:
-            if ws in connections:
-                connections.remove(ws)
+
+    def client_snapshot(self, client):
+        """client 連線、訂閱或要求 resync 時先送的完整狀態（只含訂閱的欄位）"""
+        if client.kind == 'delta':
+            state = self.delta.snapshot(self.get_broadcast_data())['data']
+            return client.subscription.snapshot(state)
+        # full client 平常只在訂閱的 topic 有推送時才會收到資料
+        return select(self.get_broadcast_data(), client.subscription.topics)
+
+    def take_aggregates(self, topics):
+        """取出這次推送的 topic 在上次推送之後累積的 min / max / mean"""
+        if not self.aggregates:
+            return None
+        aggregates = {}
+        for topic in topics:
+            summary = self.aggregates.take(topic)
+            if summary:
+                aggregates[topic] = summary
+        return aggregates or None
+
+    async def broadcast_data(self):
+        """推送到期的 topic 到所有連接的客戶端（每種格式只序列化一次，放進各 client 的 queue）"""
+        if not broadcaster:
+            return
+        start = time.perf_counter()
+
+        # 上次之後 decoder 有更新的 topic，依各自的最大頻率決定這次要推送哪些
+        scheduler = self.scheduler
+        scheduler.observe(self.decoder.data_store, self.decoder.take_dirty())
+        scheduler.mark('playback_control')
+        topics = scheduler.due()
+        if not topics:
+            return
+        broadcast_data = self.get_broadcast_data()
+        aggregates = self.take_aggregates(topics)
+
+        # delta client: 只比較這次推送的 topic
+        changes = None
+        if broadcaster.has('delta'):
+            delta = self.delta.delta(broadcast_data, topics)
+            if delta:
+                changes = delta['changes']
+        else:
+            self.delta.reset()
+        if aggregates:
+            broadcast_data[AGGREGATES] = aggregates
+            if changes is not None:
+                changes[AGGREGATES] = aggregates
+
+        # 依各 client 的訂閱（topics / rate）送出
+        broadcaster.broadcast(broadcast_data, changes, topics)
+        broadcaster.last_encode = time.perf_counter() - start
 
     async def can_receive_callback(self):
         if self.use_csv:
@@ -429,17 +511,75 @@ class CanReceiverWebApp:
             await self.real_can_receive_callback()
 
     async def real_can_receive_callback(self):
-        """原始的 CAN 接收回調函數 (async)"""
-        try:
-            if self.bus:
-                message = self.bus.recv(timeout=0.001)
-                if message:
-                    self.message_count += 1
-                    self.process_can_message(message)
-                    # await self.broadcast_data() # REMOVED to prevent flooding
-            # await asyncio.sleep(0.001) # REMOVED, handled by receiver_loop
-        except Exception as e:
-            await asyncio.sleep(0.1)
+        """
+        CAN 模式：frame 由 AsyncBusReader 在 socket 可讀時直接處理（loop.add_reader，
+        不阻塞 event loop），這裡只確認監聽的是目前的 receiver；
+        worker / ingest 模式則讀取 worker process 或 CanIngest daemon 發布的最新狀態
+        """
+        if self.worker is not None:
+            self.apply_worker_state()
+            await asyncio.sleep(STATE_POLL_INTERVAL)
+            return
+        receiver = self.receiver
+        if self.reader is not None and self.reader.selector is not receiver:
+            self.stop_can_reader()
+        if receiver is not None and self.reader is None:
+            self.reader = AsyncBusReader(receiver, self.process_can_frames)
+            self.reader.start()
+        await asyncio.sleep(0.1)
+
+    def stop_can_reader(self):
+        """停止監聽 CAN socket（關閉 bus 之前呼叫）"""
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
+    def start_decode_worker(self):
+        """CAN 接收與解碼改由 worker process 執行（見 CanWorker），bus 開不起來時回傳 False"""
+        worker = DecodeWorker({0: CAN_CHANNEL})
+        if not worker.start():
+            return False
+        self.worker = worker
+        self.worker_messages = 0
+        return True
+
+    def attach_ingest(self):
+        """CanIngest daemon 有在執行時改為讀取它發布的狀態（見 CanWorker.IngestSource），沒有 daemon 時回傳 False"""
+        source = IngestSource()
+        if not source.start():
+            return False
+        print("Using the CAN ingest daemon's decoded state")
+        self.worker = source
+        self.worker_messages = 0
+        return True
+
+    def stop_decode_worker(self):
+        if self.worker is not None:
+            self.worker.stop()
+            self.worker = None
+
+    def apply_worker_state(self):
+        """
+        把 worker（或 ingest daemon）最新發布的狀態就地寫入 decoder，只標記有變動的 topic；
+        歷史與彙總以 worker 每個 frame 的樣本更新，不是發布時的快照
+        """
+        state = self.worker.poll()
+        if state is None:
+            return
+        data_store, dirty, message_count, samples = state
+        self.decoder.apply_state(data_store, dirty, samples)
+        self.message_count += message_count - self.worker_messages
+        self.worker_messages = message_count
+        aggregates = self.aggregates
+        if aggregates:
+            for journal in samples:
+                aggregates.sample_journal(journal)
+
+    def process_can_frames(self, frames):
+        """AsyncBusReader 每次喚醒讀到的 [(bus_num, msg), ...]"""
+        for _, message in frames:
+            self.message_count += 1
+            self.process_can_message(message)
 
     async def csv_receive_callback(self):
         """CSV 模式的接收回調函數 (async)"""
@@ -447,24 +587,28 @@ class CanReceiverWebApp:
             await asyncio.sleep(0.1)
             return
             
-        if self.csv_index >= len(self.csv_data):
+        if self.csv_index >= self.total_csv_messages:
             await asyncio.sleep(0.01)
             return 
         
+        replay = self.replay
+        timestamps = replay.timestamps
         current_time = time.time()
         if self.csv_start_time is None:
             self.csv_start_time = current_time
-            self.csv_base_timestamp = self.csv_data[0]['timestamp']
+            self.csv_base_timestamp = timestamps[0]
         elapsed_time = (current_time - self.csv_start_time) * self.csv_speed * self.playback_speed
         target_timestamp = self.csv_base_timestamp + elapsed_time * 1000000  # 轉換為微秒
         updated = False
-        while (self.csv_index < len(self.csv_data) and 
-               self.csv_data[self.csv_index]['timestamp'] <= target_timestamp):
-            csv_msg = self.csv_data[self.csv_index]
-            mock_message = self.create_mock_can_message(csv_msg['can_id'], csv_msg['data'])
+        while (self.csv_index < self.total_csv_messages and 
+               timestamps[self.csv_index] <= target_timestamp):
+            csv_msg = replay.message(self.csv_index)
+            self.csv_index += 1
+            if csv_msg is None:
+                continue
+            mock_message = self.create_mock_can_message(*csv_msg)
             self.message_count += 1
             self.process_can_message(mock_message)
-            self.csv_index += 1
             updated = True
         if updated:
             pass # await self.broadcast_data() # REMOVED to prevent flooding
@@ -475,7 +619,10 @@ class CanReceiverWebApp:
         return self.decoder.create_mock_can_message(can_id, data)
 
     def process_can_message(self, msg: can.Message):
-        self.decoder.process_can_message(msg)
+        section = self.decoder.process_can_message(msg)
+        aggregates = self.aggregates
+        if aggregates and section in aggregates.topics:
+            aggregates.sample(section, self.decoder.data_store[section])
 
 # global CAN receiver instance
 can_receiver = None
@@ -501,7 +648,8 @@ async def dashboard(request: Request):
 @app.get('/api/data')
 async def get_data():
     if can_receiver:
-        return {
+        # data_store 的 __slots__ 狀態與電芯 array 由 encode() 序列化成原本的 dict / list
+        return Response(encode({
             'timestamp': can_receiver.decoder.data_store['timestamp']['time'].isoformat() if can_receiver.decoder.data_store['timestamp']['time'] else None,
             'gps': can_receiver.decoder.data_store['gps'],
             'velocity': can_receiver.decoder.data_store['velocity'],
@@ -512,28 +660,90 @@ async def get_data():
             'imu2': can_receiver.decoder.data_store['imu2'],
             'message_count': can_receiver.message_count,
             'update_time': datetime.now().isoformat()
-        }
+        }), media_type='application/json')
     else:
         return {'error': 'CAN receiver not initialized'}
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
-    connections.append(websocket)
-    print('Client connected')
+    # ?delta=1: 先送完整 snapshot，之後只送變動的欄位（見 CanDelta）
+    use_delta = websocket.query_params.get('delta') == '1' and can_receiver is not None
+    # ?format=msgpack: 二進位 MessagePack frame（static/msgpack.js 解碼），預設 JSON 文字
+    data_format = websocket.query_params.get('format', 'json')
+    if data_format not in FORMATS:
+        data_format = 'json'
+    client = broadcaster.add(websocket, 'delta' if use_delta else 'full', data_format)
+    if can_receiver:
+        client.send(can_receiver.client_snapshot(client))
+    print('Client connected' + (' (delta)' if use_delta else '') + f' [{data_format}]')
     try:
         while True:
-            await websocket.receive_text()  # 等待客戶端發送消息以保持連接
+            text = await websocket.receive_text()  # 等待客戶端發送消息以保持連接
+            request = parse_request(text)
+            if request is None:
+                continue
+            if request.get('type') == 'subscribe':
+                # {"type": "subscribe", "topics": [...], "rate": Hz}，見 CanBroadcast
+                broadcaster.subscribe(client, request.get('topics'), request.get('rate'))
+                if can_receiver:
+                    client.send(can_receiver.client_snapshot(client))
+            elif request.get('type') == 'resync' and use_delta:
+                # client 發現 seq 不連續，重新送 snapshot
+                client.send(can_receiver.client_snapshot(client))
     except Exception as e:
         print('Client disconnected', e)
     finally:
-        if websocket in connections:
-            connections.remove(websocket)
+        broadcaster.remove(websocket)
+
+@app.get('/api/ws/clients')
+async def get_ws_clients():
+    """每個 WebSocket client 的排隊、丟棄與延遲統計"""
+    return broadcaster.stats()
+
+@app.get('/api/ws/topics')
+async def get_ws_topics():
+    """每個 topic 的實際更新頻率、最大推送頻率與推送 / 延後次數"""
+    if can_receiver:
+        return can_receiver.scheduler.stats()
+    return {'error': 'CAN receiver not initialized'}
+
+@app.get('/api/receiver')
+async def get_receiver_stats():
+    """CAN 接收（每次喚醒的 frame 數）與 event loop 延遲統計"""
+    if not can_receiver:
+        return {'error': 'CAN receiver not initialized'}
+    reader = can_receiver.reader
+    worker = can_receiver.worker
+    return {
+        'mode': 'csv' if can_receiver.use_csv else 'can',
+        'message_count': can_receiver.message_count,
+        'reader': reader.stats() if reader else None,
+        'worker': worker.stats() if worker else None,
+        'loop_lag': can_receiver.loop_lag.stats(),
+    }
+
+@app.get('/api/history')
+async def get_history(signals: str = None, since: float = None, points: int = MAX_POINTS):
+    """
+    訊號歷史，欄位式格式（見 CanHistory）
+    signals: 逗號分隔的訊號名稱或前綴（例如 inverters.3.torque,imu2.acceleration），省略時列出可用的訊號
+    since: epoch 秒，或負數表示幾秒前（例如 -60）；省略時回傳保留範圍內的全部
+    points: 每個訊號最多回傳的點數，超過時以 min / max 降採樣（保留峰值）；0 表示只回傳最近的原始樣本
+    """
+    if not can_receiver:
+        return {'error': 'CAN receiver not initialized'}
+    history = can_receiver.decoder.history
+    if not signals:
+        return {'signals': history.names(), 'seconds': history.seconds, 'retention': history.retention}
+    names = [name.strip() for name in signals.split(',') if name.strip()]
+    return Response(encode(history.query(names, since, max_points=max(points, 0))),
+                    media_type='application/json')
 
 async def start_can_receiver():
     """啟動 CAN 接收器"""
     global can_receiver
-    can_receiver = CanReceiverWebApp()
+    can_receiver = CanReceiverWebApp(use_csv=USE_CSV, decode_worker=DECODE_WORKER, use_ingest=USE_INGEST)
     await can_receiver.start_can_receiver()
 
 @app.on_event("startup")
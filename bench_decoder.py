@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+CanDecoder micro-benchmark
+
+用法:
+    python bench_decoder.py                          # 使用合成的 CAN 訊息
+    python bench_decoder.py ../LOGS/can_log_xxx.csv  # 重播實際記錄檔
+
+與舊版本比較（before / after）:
+    git show <commit>:CanDecoder.py > /tmp/CanDecoder_before.py
+    python bench_decoder.py --baseline /tmp/CanDecoder_before.py
+
+指定 --baseline 時也逐個 frame 檢查目前的解碼結果與舊版本相同（array 轉回 list 比較，
+舊版本沒有的欄位不比較）。
+
+有編譯過的解碼核心（build_core.py）時同時量測純 Python 與編譯版本，並逐個 frame
+檢查兩者解碼出的狀態完全相同（last_update 除外）。
+"""
+
+import argparse
+import csv
+import importlib.util
+import pickle
+import random
+import time
+from array import array
+
+from CanDecoder import CanDecoder
+from CanNetwork import is_compiled
+from CanState import State, array_list
+
+
+def load_baseline(path):
+    """從檔案路徑載入另一版本的 CanDecoder 作為比較基準"""
+    spec = importlib.util.spec_from_file_location("CanDecoder_baseline", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.CanDecoder
+
+
+def load_frames(csv_file):
+    """讀取 can_log_*.csv，回傳 (can_id, data) 列表"""
+    frames = []
+    with open(csv_file, 'r', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader, None)  # 跳過標題列
+        for row in reader:
+            try:
+                can_id = int(row[1], 16)
+                length = int(row[5])
+                data = bytes(int(b, 16) for b in row[6:6 + min(length, 8)])
+            except (ValueError, IndexError):
+                continue
+            frames.append((can_id, data))
+    return frames
+
+
+def synthetic_frames(count=200000, seed=0):
+    """產生模擬的車上流量（inverter 與 IMU2 為高頻訊息）"""
+    rng = random.Random(seed)
+    weighted_ids = (
+        [0x193, 0x194, 0x213, 0x214] * 6 +
+        [0x293, 0x294, 0x188, 0x288, 0x488] * 3 +
+        [0x181, 0x400, 0x401, 0x402, 0x403, 0x408, 0x290, 0x490,
+         0x393, 0x394, 0x713, 0x714, 0x710, 0x421, 0x100] +
+        [0x190, 0x390] + list(range(0x410, 0x41A)) +  # 電芯電壓 / 溫度、position covariance
+        [0x123, 0x7FF]  # 未知 ID
+    )
+    frames = []
+    for _ in range(count):
+        can_id = rng.choice(weighted_ids)
+        if can_id == 0x190:
+            data = bytes([rng.randrange(15) * 7] + [rng.randrange(256) for _ in range(7)])
+        elif can_id == 0x390:
+            data = bytes([rng.randrange(32) * 7] + [rng.randrange(256) for _ in range(7)])
+        elif can_id == 0x421:
+            data = bytes([0x00] * 8)
+        else:
+            data = bytes(rng.randrange(256) for _ in range(8))
+        frames.append((can_id, data))
+    return frames
+
+
+def _strip_updates(node):
+    if isinstance(node, (dict, State)):
+        return [(key, _strip_updates(value)) for key, value in node.items() if key != 'last_update']
+    if isinstance(node, array):
+        # 與改版前的 list 比較：未收到的元素轉回 None
+        return array_list(node)
+    return node
+
+
+def _common_fields(node, reference):
+    """只保留 reference 也有的欄位（改版後新增的欄位，例如 0x421 的丟包計數，不列入與舊版的比較）"""
+    if isinstance(node, (dict, State)) and isinstance(reference, (dict, State)):
+        return {key: _common_fields(value, reference[key]) for key, value in node.items() if key in reference}
+    return node
+
+
+def _fingerprint(node):
+    """狀態的位元層級表示（float 以 8 bytes 的 IEEE 754 比較，NaN 也一樣），不含 last_update"""
+    return pickle.dumps(_strip_updates(node))
+
+
+def verify(reference, candidate, frames):
+    """
+    逐個 frame 比較兩個 decoder 更新後的狀態，回傳不相同的 frame 數
+    reference 可以是改版前的 CanDecoder（process_can_message 沒有回傳值，狀態是巢狀 dict / list）：
+    此時比較 candidate 回傳的 section，最後再比較一次完整狀態
+    """
+    mismatches = 0
+    legacy = None
+    for can_id, data in frames:
+        msg = reference.create_mock_can_message(can_id, data)
+        section = reference.process_can_message(msg)
+        candidate_section = candidate.process_can_message(msg)
+        if legacy is None and candidate_section is not None:
+            legacy = section is None
+        if legacy:
+            section = candidate_section
+        elif candidate_section != section:
+            mismatches += 1
+            continue
+        if section is None:
+            continue
+        expected = reference.data_store[section]
+        actual = candidate.data_store[section]
+        if legacy:
+            actual = _common_fields(actual, expected)
+        if _fingerprint(expected) != _fingerprint(actual):
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  mismatch after 0x{can_id:03X} {data.hex()} in {section}")
+    if legacy and _fingerprint(reference.data_store) != \
+            _fingerprint(_common_fields(candidate.data_store, reference.data_store)):
+        mismatches += 1
+        print("  final state differs")
+    return mismatches
+
+
+def run(decoder, messages, repeat):
+    """回傳最佳一次的 frames/sec"""
+    process = decoder.process_can_message
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for msg in messages:
+            process(msg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(messages) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CanDecoder micro-benchmark")
+    parser.add_argument('csv_file', nargs='?', help="can_log_*.csv 重播檔案")
+    parser.add_argument('--count', type=int, default=200000, help="合成訊息數量")
+    parser.add_argument('--repeat', type=int, default=5, help="重複次數（取最佳）")
+    parser.add_argument('--baseline', help="作為比較基準的 CanDecoder.py 路徑")
+    args = parser.parse_args()
+
+    if args.csv_file:
+        frames = load_frames(args.csv_file)
+        print(f"Loaded {len(frames)} frames from {args.csv_file}")
+    else:
+        frames = synthetic_frames(args.count)
+        print(f"Generated {len(frames)} synthetic frames")
+
+    candidates = []
+    if args.baseline:
+        baseline_decoder = load_baseline(args.baseline)
+        candidates.append(("baseline", baseline_decoder()))
+        mismatches = verify(baseline_decoder(), CanDecoder(), frames)
+        print(f"Output vs baseline: {'identical' if not mismatches else f'{mismatches} mismatching frames'}")
+    current = CanDecoder()
+    if is_compiled(current.decoders):
+        reference = CanDecoder(compiled=False)
+        candidates.append(("python", reference))
+        candidates.append(("compiled", current))
+        mismatches = verify(CanDecoder(compiled=False), CanDecoder(), frames)
+        print(f"Compiled core output: {'identical' if not mismatches else f'{mismatches} mismatching frames'}")
+    else:
+        candidates.append(("current", current))
+
+    results = []
+    for name, decoder in candidates:
+        messages = [decoder.create_mock_can_message(can_id, data) for can_id, data in frames]
+        fps = run(decoder, messages, args.repeat)
+        results.append((name, fps))
+
+    baseline = results[0][1]
+    for name, fps in results:
+        print(f"{name:<16} {fps:12,.0f} frames/sec  ({fps / baseline:.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
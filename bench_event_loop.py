@@ -0,0 +1,150 @@
+"""
+asyncio CAN reception benchmark: event loop lag of each receiver_loop variant
+
+需要 vcan 介面（不需實體 CAN）:
+    sudo modprobe vcan
+    sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+
+用法:
+    python bench_event_loop.py [--rate 4000] [--duration 10]
+
+比較 web app 的三種接收方式:
+    blocking    原本的寫法：async 函數中直接 bus.recv(timeout=0.001)，每個 frame
+                之後 await asyncio.sleep(0.0001)
+    executor    在 executor 執行緒中 BusSelector.poll()，喚醒後整批處理
+    add_reader  CanAsync.AsyncBusReader（loop.add_reader，event loop 中不阻塞地整批讀取）
+
+另一個 process 以固定速率送出 frame（payload 為送出時間）。量測 event loop
+延遲（LoopLagMonitor，代表 HTTP / WebSocket 處理被延後多久）、收到的 frame 數、
+端到端延遲與整個接收 process 的 CPU。
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import struct
+import time
+
+import can
+
+from CanAsync import AsyncBusReader, LoopLagMonitor, percentile
+from CanReceiver import BusSelector
+
+_SENT_AT = struct.Struct('<d')
+
+
+def open_bus(channel):
+    return can.interface.Bus(channel=channel, bustype='socketcan')
+
+
+def sender(channel, rate, stop):
+    bus = open_bus(channel)
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    while not stop.is_set():
+        bus.send(can.Message(arbitration_id=0x123, data=_SENT_AT.pack(time.time()),
+                             is_extended_id=False))
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    bus.shutdown()
+
+
+async def receive_blocking(bus, stop, on_frame):
+    """GUIvehical-v3 原本的 receiver_loop"""
+    while not stop.is_set():
+        message = bus.recv(timeout=0.001)
+        if message:
+            on_frame(message)
+        await asyncio.sleep(0.0001)
+
+
+async def receive_executor(bus, stop, on_frame):
+    """app_usedecode 原本的 receiver_loop"""
+    receiver = BusSelector({0: bus})
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        for _, message in await loop.run_in_executor(None, receiver.poll, 0.05):
+            on_frame(message)
+        await asyncio.sleep(0.0001)
+    receiver.close()
+
+
+async def receive_add_reader(bus, stop, on_frame):
+    receiver = BusSelector({0: bus})
+
+    def on_frames(frames):
+        for _, message in frames:
+            on_frame(message)
+
+    reader = AsyncBusReader(receiver, on_frames)
+    reader.start()
+    while not stop.is_set():
+        await asyncio.sleep(0.1)
+    reader.stop()
+    receiver.close()
+
+
+MODES = {
+    'blocking': receive_blocking,
+    'executor': receive_executor,
+    'add_reader': receive_add_reader,
+}
+
+
+async def run_phase(mode, channel, duration):
+    """回傳 (接收端 CPU %, 延遲 list (ms), LoopLagMonitor.stats())"""
+    bus = open_bus(channel)
+    latencies = []
+    stop = asyncio.Event()
+
+    def on_frame(msg):
+        latencies.append((time.time() - _SENT_AT.unpack_from(msg.data)[0]) * 1000)
+
+    monitor = LoopLagMonitor().start()
+    started = time.perf_counter()
+    cpu_start = time.process_time()
+    task = asyncio.create_task(MODES[mode](bus, stop, on_frame))
+    await asyncio.sleep(duration)
+    stop.set()
+    await task
+    cpu = time.process_time() - cpu_start
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+    bus.shutdown()
+    return cpu / elapsed * 100, latencies, monitor.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channel', default='vcan0')
+    parser.add_argument('--rate', type=int, default=4000, help='frames/sec under load')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per phase')
+    parser.add_argument('--mode', choices=sorted(MODES), action='append',
+                        help='mode(s) to run (default: all)')
+    args = parser.parse_args()
+
+    print(f"channel={args.channel} rate={args.rate}/s duration={args.duration}s")
+    print(f"{'mode':<11} {'CPU':>6} {'frames':>8} {'lat p50':>8} {'lat p99':>8} "
+          f"{'lag p50':>8} {'lag p99':>8} {'lag max':>8}  (ms)")
+    for mode in args.mode or list(MODES):
+        stop = multiprocessing.Event()
+        process = multiprocessing.Process(target=sender, args=(args.channel, args.rate, stop))
+        process.start()
+        cpu, latencies, lag = asyncio.run(run_phase(mode, args.channel, args.duration))
+        stop.set()
+        process.join()
+        if latencies:
+            p50 = statistics.median(latencies)
+            p99 = percentile(latencies, 0.99)
+        else:
+            p50 = p99 = float('nan')
+        print(f"{mode:<11} {cpu:>5.1f}% {len(latencies):>8} {p50:>8.3f} {p99:>8.3f} "
+              f"{lag.get('p50_ms', float('nan')):>8.3f} {lag.get('p99_ms', float('nan')):>8.3f} "
+              f"{lag.get('max_ms', float('nan')):>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+CAN reception benchmark: alternating 1 ms polling vs BusSelector
+
+需要一對 vcan 介面（不需實體 CAN）:
+    sudo modprobe vcan
+    sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+    sudo ip link add dev vcan1 type vcan && sudo ip link set up vcan1
+
+用法:
+    python bench_reception.py [--rate 2000] [--duration 10]
+
+每個模式先量閒置 (無流量) 的 CPU，再由另一條執行緒以固定速率同時在兩個
+介面送出 frame（payload 為送出時間），量測接收端 CPU 與端到端延遲。
+CPU 以接收執行緒的 thread_time 計算，不含送出端。
+"""
+
+import argparse
+import statistics
+import struct
+import threading
+import time
+
+import can
+
+from CanReceiver import BusSelector
+
+_SENT_AT = struct.Struct('<d')
+
+
+def open_bus(channel):
+    return can.interface.Bus(channel=channel, bustype='socketcan')
+
+
+def receive_polling(buses, stop, on_frame):
+    """原本的寫法：在兩個 bus 之間輪流 recv(timeout=0.001)"""
+    bus0, bus1 = buses
+    while not stop.is_set():
+        msg0 = bus0.recv(timeout=0.001)
+        msg1 = bus1.recv(timeout=0.001)
+        if msg0 is not None:
+            on_frame(msg0)
+        if msg1 is not None:
+            on_frame(msg1)
+
+
+def receive_select(buses, stop, on_frame):
+    receiver = BusSelector(dict(enumerate(buses)))
+    while not stop.is_set():
+        for _, msg in receiver.poll(timeout=0.1):
+            on_frame(msg)
+    receiver.close()
+
+
+MODES = {
+    'polling': receive_polling,
+    'select': receive_select,
+}
+
+
+def sender(channels, rate, stop):
+    buses = [open_bus(channel) for channel in channels]
+    interval = 1.0 / rate
+    next_send = time.perf_counter()
+    while not stop.is_set():
+        for bus in buses:
+            bus.send(can.Message(arbitration_id=0x123, data=_SENT_AT.pack(time.time()),
+                                 is_extended_id=False))
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    for bus in buses:
+        bus.shutdown()
+
+
+def run_phase(mode, channels, duration, rate=None):
+    """回傳 (接收端 CPU %, 收到的 frame 數, 延遲 list (ms))"""
+    buses = [open_bus(channel) for channel in channels]
+    latencies = []
+    cpu = {}
+    stop = threading.Event()
+
+    def on_frame(msg):
+        latencies.append((time.time() - _SENT_AT.unpack_from(msg.data)[0]) * 1000)
+
+    def receive():
+        start = time.thread_time()
+        MODES[mode](buses, stop, on_frame)
+        cpu['seconds'] = time.thread_time() - start
+
+    threads = [threading.Thread(target=receive)]
+    if rate:
+        threads.append(threading.Thread(target=sender, args=(channels, rate, stop)))
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    for bus in buses:
+        bus.shutdown()
+    return cpu['seconds'] / elapsed * 100, len(latencies), latencies
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--channels', nargs=2, default=['vcan0', 'vcan1'])
+    parser.add_argument('--rate', type=int, default=2000, help='frames/sec per bus under load')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per phase')
+    parser.add_argument('--mode', choices=sorted(MODES), action='append',
+                        help='mode(s) to run (default: all)')
+    args = parser.parse_args()
+
+    print(f"channels={args.channels} rate={args.rate}/s per bus duration={args.duration}s")
+    print(f"{'mode':<10} {'idle CPU':>9} {'load CPU':>9} {'frames':>8} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for mode in args.mode or sorted(MODES):
+        idle_cpu, _, _ = run_phase(mode, args.channels, args.duration)
+        load_cpu, frames, latencies = run_phase(mode, args.channels, args.duration, args.rate)
+        if latencies:
+            p50 = statistics.median(latencies)
+            p99 = percentile(latencies, 0.99)
+            worst = max(latencies)
+        else:
+            p50 = p99 = worst = float('nan')
+        print(f"{mode:<10} {idle_cpu:>8.1f}% {load_cpu:>8.1f}% {frames:>8} "
+              f"{p50:>8.3f} {p99:>8.3f} {worst:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+WebSocket load benchmark: CAN frame loss with N dashboard clients
+
+需要 vcan 介面（不需實體 CAN）與 websockets 套件:
+    sudo modprobe vcan
+    sudo ip link add dev vcan0 type vcan && sudo ip link set up vcan0
+    pip install websockets
+
+用法:
+    python bench_ws_load.py [--app app_usedecode.py] [--clients 0 10 50 100] [--rate 4000] [--duration 10]
+    python bench_ws_load.py ../LOGS/can_log_xxx.csv      # 重播實際記錄檔（預設為合成流量）
+
+每個 (模式, client 數) 重新啟動一次 web app（USE_CSV = False，CAN_CHANNEL 改為 --channel）:
+    inloop  DECODE_WORKER = False：frame 在 uvicorn 的 event loop 中接收與解碼（CanAsync）
+    worker  DECODE_WORKER = True：接收與解碼在另一個 process（CanWorker），web process 只讀狀態
+
+另一個 process 開 N 個 WebSocket client 持續讀取，再一個 process 以固定速率在 vcan
+送出 frame。送出的 frame 數與 app 收到的 message_count（/api/receiver）之差即為遺失
+（接收端 socket buffer 滿了，kernel 丟掉的 frame），同時列出 event loop 延遲與
+每個 client 實際收到的訊息頻率。
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import can
+
+from bench_decoder import load_frames, synthetic_frames
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# 以 module 方式載入 web app，改掉設定後交給 uvicorn（檔名有 '-' 也能載入）
+LAUNCHER = """
+import importlib.util, sys, uvicorn
+app_file, channel, mode, port = sys.argv[1:5]
+spec = importlib.util.spec_from_file_location('dashboard_app', app_file)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+module.USE_CSV = False
+module.CAN_CHANNEL = channel
+module.DECODE_WORKER = mode == 'worker'
+module.USE_INGEST = False  # 不要接上已在執行的 CanIngest daemon
+uvicorn.run(module.app, host='127.0.0.1', port=int(port), log_level='warning')
+"""
+
+MODES = ('inloop', 'worker')
+STARTUP_TIMEOUT = 20.0
+# sender 結束後等 app 處理完（worker 模式還要等下一次發布）
+SETTLE_TIME = 1.0
+
+
+def get_json(port, path):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=5) as response:
+        return json.load(response)
+
+
+def wait_for_receiver(port, mode, timeout=STARTUP_TIMEOUT):
+    """等 app 進入 CAN 模式（worker 模式還要等 worker 啟動），回傳 /api/receiver"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            stats = get_json(port, '/api/receiver')
+            if stats.get('mode') == 'can' and (mode != 'worker' or stats.get('worker')):
+                return stats
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"web app did not start in {mode} CAN mode within {timeout}s")
+
+
+def sender(channel, frames, rate, duration, sent):
+    """以固定速率重播 frames，sent 為實際送出的數量（vcan 送出 buffer 滿時稍等重送）"""
+    bus = can.interface.Bus(channel=channel, bustype='socketcan')
+    interval = 1.0 / rate
+    start = next_send = time.perf_counter()
+    index = 0
+    count = 0
+    while time.perf_counter() - start < duration:
+        can_id, data = frames[index % len(frames)]
+        try:
+            bus.send(can.Message(arbitration_id=can_id, data=data, is_extended_id=False))
+        except (can.CanError, OSError):
+            time.sleep(0.0005)
+            continue
+        index += 1
+        count += 1
+        next_send += interval
+        delay = next_send - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+    sent.value = count
+    bus.shutdown()
+
+
+def ws_clients(port, count, stop, received, connected):
+    """count 個 WebSocket client，持續讀取直到 stop；received 為所有 client 收到的訊息總數"""
+    import websockets
+
+    async def client():
+        async with websockets.connect(f"ws://127.0.0.1:{port}/ws", max_size=None) as websocket:
+            with connected.get_lock():
+                connected.value += 1
+            while not stop.is_set():
+                try:
+                    await asyncio.wait_for(websocket.recv(), 0.5)
+                except asyncio.TimeoutError:
+                    continue
+                with received.get_lock():
+                    received.value += 1
+
+    async def run():
+        results = await asyncio.gather(*(client() for _ in range(count)), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            print(f"  {len(errors)} WebSocket client(s) failed: {errors[0]!r}")
+
+    asyncio.run(run())
+
+
+def run_phase(args, frames, mode, clients):
+    """回傳 (送出, 收到, /api/receiver, client 收到的訊息數)"""
+    app = subprocess.Popen([sys.executable, '-c', LAUNCHER, args.app, args.channel, mode, str(args.port)],
+                           cwd=HERE, stdout=None if args.verbose else subprocess.DEVNULL)
+    stop = multiprocessing.Event()
+    received = multiprocessing.Value('q', 0)
+    connected = multiprocessing.Value('i', 0)
+    client_process = None
+    try:
+        wait_for_receiver(args.port, mode)
+        if clients:
+            client_process = multiprocessing.Process(
+                target=ws_clients, args=(args.port, clients, stop, received, connected))
+            client_process.start()
+            deadline = time.monotonic() + 10.0
+            while connected.value < clients and time.monotonic() < deadline:
+                time.sleep(0.1)
+            # 開始之前先讓 client 收一輪完整狀態
+            time.sleep(1.0)
+
+        before = get_json(args.port, '/api/receiver')['message_count']
+        ws_before = received.value
+        sent = multiprocessing.Value('q', 0)
+        process = multiprocessing.Process(target=sender,
+                                          args=(args.channel, frames, args.rate, args.duration, sent))
+        process.start()
+        process.join()
+        ws_messages = received.value - ws_before
+        time.sleep(SETTLE_TIME)
+        stats = get_json(args.port, '/api/receiver')
+        return sent.value, stats['message_count'] - before, stats, ws_messages
+    finally:
+        stop.set()
+        if client_process is not None:
+            client_process.join(5.0)
+            if client_process.is_alive():
+                client_process.terminate()
+        app.terminate()
+        try:
+            app.wait(10.0)
+        except subprocess.TimeoutExpired:
+            app.kill()
+            app.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('csv_file', nargs='?', help='can_log_*.csv to replay (default: synthetic traffic)')
+    parser.add_argument('--app', default='app_usedecode.py', help='web app to load (app_usedecode.py / GUIvehical-v3.py)')
+    parser.add_argument('--channel', default='vcan0')
+    parser.add_argument('--port', type=int, default=8899)
+    parser.add_argument('--rate', type=int, default=4000, help='frames/sec sent on the bus')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds per phase')
+    parser.add_argument('--clients', type=int, nargs='+', default=[0, 10, 50, 100],
+                        help='number of concurrent WebSocket clients per phase')
+    parser.add_argument('--mode', choices=MODES, action='append', help='mode(s) to run (default: both)')
+    parser.add_argument('--verbose', action='store_true', help='show the web app output')
+    args = parser.parse_args()
+
+    if any(args.clients):
+        try:
+            import websockets  # noqa: F401
+        except ImportError as e:
+            print(f"Error: websockets is not installed ({e})")
+            sys.exit(1)
+
+    frames = load_frames(args.csv_file) if args.csv_file else synthetic_frames()
+    print(f"app={args.app} channel={args.channel} rate={args.rate}/s duration={args.duration}s "
+          f"frames={'synthetic' if not args.csv_file else args.csv_file}")
+    print(f"{'mode':<7} {'clients':>7} {'sent':>8} {'received':>8} {'loss':>7} "
+          f"{'lag p99':>8} {'lag max':>8} {'ws msg/s':>9}")
+    for mode in args.mode or MODES:
+        for clients in args.clients:
+            sent, received, stats, ws_messages = run_phase(args, frames, mode, clients)
+            lost = max(sent - received, 0)
+            lag = stats.get('loop_lag') or {}
+            per_client = ws_messages / args.duration / clients if clients else 0.0
+            print(f"{mode:<7} {clients:>7} {sent:>8} {received:>8} {lost / sent * 100 if sent else 0.0:>6.2f}% "
+                  f"{lag.get('p99_ms', float('nan')):>8.3f} {lag.get('max_ms', float('nan')):>8.3f} "
+                  f"{per_client:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+編譯 CanDecoder 的解碼核心（選用）
+
+把 can_network.yaml 產生的解碼函數（unpack + scale / offset）寫成獨立模組，
+以 Cython 或 mypyc 編譯成 can_network_core.*.so，放在 CanNetwork.py 旁邊。
+CanDecoder 啟動時自動使用相符的編譯版本；沒有編譯、或描述檔之後又修改過時
+自動退回純 Python。
+
+輸出完全相同（bench_decoder.py 逐個 frame 檢查 last_update 以外的狀態）:
+    python bench_decoder.py               # 編譯版本 vs 目前的純 Python 解碼
+    git show <commit>:CanDecoder.py > /tmp/CanDecoder_before.py
+    python bench_decoder.py --baseline /tmp/CanDecoder_before.py
+                                          # 目前的解碼 vs 改版前的 CanDecoder（巢狀 dict / list），
+                                          # 改版後新增的欄位（0x421 的 dropped_frames / overruns）不比較
+
+用法:
+    pip install cython                    # 或 pip install mypy（mypyc）
+    python build_core.py                  # Cython
+    python build_core.py --compiler mypyc
+    python build_core.py --clean          # 移除編譯版本，回到純 Python
+
+修改 can_network.yaml 或升級 Python 之後需要重新編譯。
+
+產生的函數沒有型別標註（要與純 Python 版本共用同一份原始碼、輸出逐位元相同），
+Cython 版本約快 5-10%；mypyc 對沒有型別的程式碼反而比純 Python 慢，僅供比較。
+"""
+
+import argparse
+import glob
+import importlib.machinery
+import os
+import shutil
+import sys
+import tempfile
+
+from CanNetwork import CORE_MODULE, DEFAULT_NETWORK_FILE, generate_module, network_digest, parse_network
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def core_files():
+    """目前已編譯的解碼模組檔案"""
+    return [path for suffix in importlib.machinery.EXTENSION_SUFFIXES
+            for path in glob.glob(os.path.join(HERE, CORE_MODULE + suffix))]
+
+
+def extensions(compiler, source_file):
+    if compiler == 'mypyc':
+        from mypyc.build import mypycify
+        return mypycify([source_file])
+    from Cython.Build import cythonize
+    return cythonize([source_file], quiet=True)
+
+
+def build(network_file, compiler):
+    with open(network_file, 'rb') as f:
+        source_bytes = f.read()
+    messages = parse_network(network_file, source_bytes)
+    source = generate_module(messages, network_digest(network_file))
+
+    build_dir = tempfile.mkdtemp(prefix='can_core_')
+    cwd = os.getcwd()
+    try:
+        os.chdir(build_dir)
+        source_file = f"{CORE_MODULE}.py"
+        with open(source_file, 'w', encoding='utf-8') as f:
+            f.write(source)
+
+        from setuptools import setup
+        setup(name=CORE_MODULE, ext_modules=extensions(compiler, source_file),
+              script_args=['build_ext', '--inplace'])
+
+        built = [path for suffix in importlib.machinery.EXTENSION_SUFFIXES
+                 for path in glob.glob(CORE_MODULE + suffix)]
+        if not built:
+            raise RuntimeError(f"{compiler} did not produce {CORE_MODULE} extension module")
+        for path in core_files():
+            os.remove(path)
+        target = os.path.join(HERE, os.path.basename(built[0]))
+        shutil.copy2(built[0], target)
+        # mypyc 會另外產生共用的 runtime 模組
+        for path in glob.glob('*__mypyc*'):
+            shutil.copy2(path, os.path.join(HERE, os.path.basename(path)))
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return target
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--network', default=DEFAULT_NETWORK_FILE, help='CAN network description (YAML)')
+    parser.add_argument('--compiler', choices=['cython', 'mypyc'], default='cython')
+    parser.add_argument('--clean', action='store_true', help='remove the compiled core')
+    args = parser.parse_args()
+
+    if args.clean:
+        for path in core_files() + glob.glob(os.path.join(HERE, '*__mypyc*')):
+            os.remove(path)
+            print(f"Removed {path}")
+        return
+
+    try:
+        target = build(args.network, args.compiler)
+    except ImportError as e:
+        print(f"Error: {args.compiler} is not installed ({e})")
+        sys.exit(1)
+    print(f"Built {target}")
+
+
+if __name__ == '__main__':
+    main()
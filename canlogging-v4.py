@@ -1,11 +1,37 @@
 import can
 import csv
+import json
 import os
 import time
 from datetime import datetime, timedelta
 
 import subprocess
 
+from CanBinaryLog import BinaryLogWriter, FILE_EXTENSION
+from CanIngest import IngestReceiver
+from CanReceiver import CLOCK_SOURCES
+from CanRing import FrameRing, ReceiverThread
+
+# 記錄格式: "csv"（hex CSV，app_usedecode 可直接讀取）
+#          "binary"（CanBinaryLog 固定長度紀錄，用 `python CanBinaryLog.py to-csv` 轉回 CSV）
+LOG_FORMAT = "csv"
+
+# frame 時間戳來源: "kernel"（SocketCAN 接收時間）、"hardware"（CAN 控制器硬體時間，
+#                  需 driver 支援）、"system"（讀出時的 time.time()）
+TIMESTAMP_MODE = "kernel"
+
+# frame 來源: "bus"（自己開啟 can0 / can1）
+#            "ingest"（由 CanIngest.py daemon 接收，與其他工具共用同一份接收與解碼）
+FRAME_SOURCE = "bus"
+
+# 接收 ring buffer 容量（每個 bus），以及每次整批寫入的最大筆數
+RING_CAPACITY = 65536
+WRITE_BATCH = 1024
+# 沒有 frame 時最多等待的時間（秒），之後照常執行每秒的狀態訊息與輪換
+IDLE_WAIT = 0.1
+# 接收 / 丟包統計，每秒更新
+STATS_FILE = "can_logger_stats.json"
+
 vcu_instruction = False
 
 def check_vcu_running():
@@ -38,29 +64,103 @@ def connect_can(bus_channel='can0'):
             print("CAN not available, retrying in 5 sec...")
             time.sleep(5)
 
+def try_connect_can(bus_channel):
+    """單次嘗試連接 CAN，失敗回傳 None（接收執行緒重連用）"""
+    try:
+        return can.interface.Bus(channel=bus_channel, bustype='socketcan')
+    except OSError:
+        return None
+
 def new_csv_writer(base_dir, base_name):
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = os.path.join(base_dir, f"{base_name}_{timestamp}.csv")
-    f = open(filename, 'w', newline='')
+    f = open(filename, 'w', newline='', buffering=256 * 1024)
     writer = csv.writer(f)
     writer.writerow(["Time Stamp", "ID", "Extended", "Dir", "Bus", "LEN", "D1",
                      "D2", "D3", "D4", "D5", "D6", "D7", "D8", "D9", "D10",
                      "D11", "D12"])
     return f, writer
 
+def new_binary_writer(base_dir, base_name):
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = os.path.join(base_dir, f"{base_name}_{timestamp}{FILE_EXTENSION}")
+    writer = BinaryLogWriter(filename, clock_source=CLOCK_SOURCES[TIMESTAMP_MODE])
+    return writer, writer
+
+def new_log_writer(base_dir, base_name):
+    """依 LOG_FORMAT 開新記錄檔，回傳 (file, writer)"""
+    if LOG_FORMAT == "binary":
+        return new_binary_writer(base_dir, base_name)
+    return new_csv_writer(base_dir, base_name)
+
+def write_frame(writer, msg, bus_num, timestamp):
+    """寫入一筆 CAN 訊息 (timestamp 為接收時間，單位 µs)"""
+    if isinstance(writer, BinaryLogWriter):
+        writer.write_message(msg, bus_num, timestamp)
+        return
+    can_id = f"{msg.arbitration_id:08X}"
+    extended = 'true' if msg.is_extended_id else 'false'
+    direction = 'Rx' if not msg.is_remote_frame else 'Tx'
+    dlc = msg.dlc
+    data_bytes = [f"{byte:02X}" for byte in msg.data]
+    data_bytes += ['00'] * (8 - len(data_bytes))
+    writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
+
+def status_counters(rings, frames_failed=0):
+    """
+    0x421 狀態訊息用的丟包計數：dropped (u16) 與 overrun 次數 (u8)，飽和不溢位
+    dropped 包含 ring 滿了丟掉的與處理時發生錯誤而沒有記錄的 frame
+    """
+    dropped = min(sum(ring.dropped for ring in rings) + frames_failed, 0xFFFF)
+    overruns = min(sum(ring.overruns for ring in rings), 0xFF)
+    return [dropped & 0xFF, (dropped >> 8) & 0xFF, overruns]
+
+def write_stats(base_dir, receiver, frames_written, frames_failed, recording):
+    """將接收 / 寫檔統計寫到 STATS_FILE"""
+    stats = {
+        'time': datetime.now().isoformat(),
+        'recording': recording,
+        'clock_source': receiver.clock_source,
+        'hardware_fallbacks': receiver.hardware_fallbacks,
+        'frames_written': frames_written,
+        'frames_failed': frames_failed,
+        'wakeups': receiver.wakeups,
+        'buses': {
+            f"can{bus_num}": dict(ring.stats(), errors=receiver.errors.get(bus_num, 0),
+                                  connected=receiver.bus(bus_num) is not None)
+            for bus_num, ring in receiver.rings.items()
+        },
+    }
+    path = os.path.join(base_dir, STATS_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(stats, f, indent=2)
+    os.replace(tmp_path, path)
+
 def main():
     base_dir = "/home/pi/Desktop/RPI_Desktop/LOGS"
     os.makedirs(base_dir, exist_ok=True)
 
-    bus0 = connect_can('can0')
-    bus1 = connect_can('can1')
-    
+    # 接收執行緒同時等待兩個 bus，只負責把 frame 放進 ring；寫檔與控制邏輯都在主執行緒
+    rings = {0: FrameRing(RING_CAPACITY), 1: FrameRing(RING_CAPACITY)}
+    if FRAME_SOURCE == "ingest":
+        # bus 由 ingest daemon 開啟，0x421 狀態訊息也由 daemon 代送
+        receiver = IngestReceiver(rings)
+    else:
+        bus0 = connect_can('can0')
+        bus1 = connect_can('can1')
+        receiver = ReceiverThread({0: bus0, 1: bus1}, rings,
+                                  reconnect=lambda bus_num: try_connect_can(f"can{bus_num}"),
+                                  timestamp_mode=TIMESTAMP_MODE)
+    receiver.start()
     
     recording = False
     recording_start_time = datetime.now()
-    file, writer = new_csv_writer(base_dir, "can_log")
+    file, writer = new_log_writer(base_dir, "can_log")
     rotate_at = recording_start_time + timedelta(minutes=20)
     last_status_send = 0
+    frames_written = 0
+    frames_failed = 0
     
     print("CAN Logger started for CAN0 and CAN1 and wait for recording!")
     # print(f"Recording started at {recording_start_time}")
@@ -70,87 +170,101 @@ def main():
     global vcu_instruction
     vcu_last = check_vcu_running()
     while True:
-        # 從兩個 CAN bus 接收訊息
-        msg0 = bus0.recv(timeout=0.001)  # 使用較短的 timeout
-        msg1 = bus1.recv(timeout=0.001)
-        
-        # 檢查 VCU 指令 (從 can0)
-        if msg0 is not None and hasattr(msg0, 'arbitration_id') and msg0.arbitration_id == 0x281 and len(msg0.data) > 0:
-            vcu_instruction = msg0.data[0] & 0x20
-        # 也檢查 can1 的 VCU 指令
-        if msg1 is not None and hasattr(msg1, 'arbitration_id') and msg1.arbitration_id == 0x281 and len(msg1.data) > 0:
-            vcu_instruction = msg1.data[0] & 0x20
-
-        vcu_running = check_vcu_running()
-        # VCU 狀態 edge: False -> True，強制新開檔記錄
-        if vcu_running and not vcu_last:
-            print("VCU狀態由False變True，強制新開檔記錄！")
-            if file:
-                file.close()
-            recording_start_time = datetime.now()
-            file, writer = new_csv_writer(base_dir, "can_log_vcu")
-            rotate_at = recording_start_time + timedelta(minutes=20)
-            recording = True
-            print(f"Recording started at {recording_start_time}")
-        # VCU 狀態 edge: True -> False，自動關閉記錄
-        elif not vcu_running and vcu_last:
-            print("VCU狀態由True變False，自動關閉記錄！")
-            if recording and file:
-                file.close()
-                file = None
-                writer = None
-            recording = False
-            recording_start_time = None
-            print(f"Recording stopped at {datetime.now()}")
-            print("Waiting for VCU or manual start...")
-        vcu_last = vcu_running
-
-        # VCU True: 只能自動記錄，不能被0x420打斷
-        if vcu_running:
-            if not recording:
-                print("VCU running, auto start recording!")
-                recording_start_time = datetime.now()
-                file, writer = new_csv_writer(base_dir, "can_log")
-                rotate_at = recording_start_time + timedelta(minutes=20)
-                recording = True
-                print(f"Recording started at {recording_start_time}")
-        else:
-            # VCU False: 0x420可控制記錄 (檢查兩個 CAN bus)
-            for msg in [msg0, msg1]:
-                if msg is not None and hasattr(msg, 'arbitration_id') and msg.arbitration_id == 0x420:
-                    data_bytes = list(msg.data)
-                    if len(data_bytes) > 0:
-                        first_byte = data_bytes[0]
-                        if first_byte == 0x01:
-                            if not recording:
-                                print("Start recording command received!")
-                                recording_start_time = datetime.now()
-                                file, writer = new_csv_writer(base_dir, "can_log")
-                                rotate_at = recording_start_time + timedelta(minutes=20)
-                                recording = True
-                                print(f"Recording started at {recording_start_time}")
-                            else:
-                                print("Already recording, ignoring start command")
-                        elif first_byte == 0x02:
-                            if recording:
-                                print("Stop recording command received!")
-                                if file:
-                                    file.close()
-                                    file = None
-                                    writer = None
-                                recording = False
-                                recording_start_time = None
-                                print(f"Recording stopped at {datetime.now()}")
-                                print("Waiting for next start command...")
-                            else:
-                                print("Not recording, ignoring stop command")
-                    break  # 只處理一次控制指令
+        # 從兩個 ring 整批取出，依接收時間排序
+        batch = rings[0].drain(WRITE_BATCH) + rings[1].drain(WRITE_BATCH)
+        if not batch:
+            # 等接收執行緒放入新的 frame（清除後下一圈才取，不會漏掉這之間放入的）
+            receiver.ready.wait(IDLE_WAIT)
+            receiver.ready.clear()
+        batch.sort(key=lambda frame: frame[0])
+
+        for timestamp, msg, bus_num in batch:
+            try:
+                # 檢查 VCU 指令 (can0 / can1)
+                if msg.arbitration_id == 0x281 and len(msg.data) > 0:
+                    vcu_instruction = msg.data[0] & 0x20
+
+                vcu_running = check_vcu_running()
+                # VCU 狀態 edge: False -> True，強制新開檔記錄
+                if vcu_running and not vcu_last:
+                    print("VCU狀態由False變True，強制新開檔記錄！")
+                    if file:
+                        file.close()
+                    recording_start_time = datetime.now()
+                    file, writer = new_log_writer(base_dir, "can_log_vcu")
+                    rotate_at = recording_start_time + timedelta(minutes=20)
+                    recording = True
+                    print(f"Recording started at {recording_start_time}")
+                # VCU 狀態 edge: True -> False，自動關閉記錄
+                elif not vcu_running and vcu_last:
+                    print("VCU狀態由True變False，自動關閉記錄！")
+                    if recording and file:
+                        file.close()
+                        file = None
+                        writer = None
+                    recording = False
+                    recording_start_time = None
+                    print(f"Recording stopped at {datetime.now()}")
+                    print("Waiting for VCU or manual start...")
+                vcu_last = vcu_running
+
+                # VCU True: 只能自動記錄，不能被0x420打斷
+                if vcu_running:
+                    if not recording:
+                        print("VCU running, auto start recording!")
+                        recording_start_time = datetime.now()
+                        file, writer = new_log_writer(base_dir, "can_log")
+                        rotate_at = recording_start_time + timedelta(minutes=20)
+                        recording = True
+                        print(f"Recording started at {recording_start_time}")
+                elif msg.arbitration_id == 0x420 and len(msg.data) > 0:
+                    # VCU False: 0x420可控制記錄 (兩個 CAN bus 皆可)
+                    first_byte = msg.data[0]
+                    if first_byte == 0x01:
+                        if not recording:
+                            print("Start recording command received!")
+                            recording_start_time = datetime.now()
+                            file, writer = new_log_writer(base_dir, "can_log")
+                            rotate_at = recording_start_time + timedelta(minutes=20)
+                            recording = True
+                            print(f"Recording started at {recording_start_time}")
+                        else:
+                            print("Already recording, ignoring start command")
+                    elif first_byte == 0x02:
+                        if recording:
+                            print("Stop recording command received!")
+                            if file:
+                                file.close()
+                                file = None
+                                writer = None
+                            recording = False
+                            recording_start_time = None
+                            print(f"Recording stopped at {datetime.now()}")
+                            print("Waiting for next start command...")
+                        else:
+                            print("Not recording, ignoring stop command")
+
+                # 記錄訊息
+                if recording and writer:
+                    write_frame(writer, msg, bus_num, timestamp)
+                    frames_written += 1
+            except Exception as e:
+                # 只丟掉這個 frame（計入 0x421 與統計的丟包數），batch 其餘的照常處理
+                frames_failed += 1
+                print(f"Unexpected error: {e}")
+                if recording and file:
+                    file.close()
+                    file = None
+                    writer = None
+                    recording = False
+                    recording_start_time = None
 
         try:
-            # 2. 保留原本的 CAN 指令控制（已在主邏輯處理，這裡只處理寫檔與狀態訊息）
+            # 狀態訊息與統計（每秒一次）
             current_time = time.time()
             if current_time - last_status_send >= 1.0:
                 try:
+                    counters = status_counters(rings.values(), frames_failed)
                     if recording and recording_start_time:
                         timestamp = int(recording_start_time.timestamp())
                         data = [0x01]
@@ -159,70 +273,35 @@ def main():
                             (timestamp >> 8) & 0xFF,
                             (timestamp >> 16) & 0xFF,
                             (timestamp >> 24) & 0xFF,
-                            0x00, 0x00, 0x00
-                        ])
+                        ] + counters)
                         status_msg = can.Message(arbitration_id=0x421, data=data, is_extended_id=False)
-                        bus0.send(status_msg)  # 從 can0 發送狀態
+                        receiver.bus(0).send(status_msg)  # 從 can0 發送狀態
                     else:
-                        data = [0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
+                        data = [0x00, 0x00, 0x00, 0x00, 0x00] + counters
                         status_msg = can.Message(arbitration_id=0x421, data=data, is_extended_id=False)
-                        bus0.send(status_msg)  # 從 can0 發送狀態
-                    last_status_send = current_time
+                        receiver.bus(0).send(status_msg)  # 從 can0 發送狀態
                 except Exception as e:
                     print(f"Failed to send status message: {e}")
-
-            # 記錄 can0 的訊息
-            if recording and writer and msg0 is not None and hasattr(msg0, 'arbitration_id'):
-                timestamp = int(time.time() * 1000000)
-                can_id = f"{msg0.arbitration_id:08X}"
-                extended = 'true' if msg0.is_extended_id else 'false'
-                direction = 'Rx' if not msg0.is_remote_frame else 'Tx'
-                bus_num = 0  # can0
-                dlc = msg0.dlc
-                data_bytes = [f"{byte:02X}" for byte in msg0.data]
-                data_bytes += ['00'] * (8 - len(data_bytes))
-                writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
-
-            # 記錄 can1 的訊息
-            if recording and writer and msg1 is not None and hasattr(msg1, 'arbitration_id'):
-                timestamp = int(time.time() * 1000000)
-                can_id = f"{msg1.arbitration_id:08X}"
-                extended = 'true' if msg1.is_extended_id else 'false'
-                direction = 'Rx' if not msg1.is_remote_frame else 'Tx'
-                bus_num = 1  # can1
-                dlc = msg1.dlc
-                data_bytes = [f"{byte:02X}" for byte in msg1.data]
-                data_bytes += ['00'] * (8 - len(data_bytes))
-                writer.writerow([timestamp, can_id, extended, direction, bus_num, dlc] + data_bytes)
+                try:
+                    write_stats(base_dir, receiver, frames_written, frames_failed, recording)
+                except OSError as e:
+                    print(f"Failed to write stats file: {e}")
+                # 讓已記錄的資料最多延遲一秒寫入 SD 卡（binary：沒有新 frame 時也寫出未滿的區塊與 index）
+                if recording and isinstance(writer, BinaryLogWriter):
+                    writer.flush_if_due()
+                elif recording and file:
+                    file.flush()
+                last_status_send = current_time
 
             # 檢查是否需要輪換日誌檔案
             if recording and writer and datetime.now() >= rotate_at:
                 print("Rotating log file...")
                 file.close()
                 recording_start_time = datetime.now()
-                file, writer = new_csv_writer(base_dir, "can_log")
+                file, writer = new_log_writer(base_dir, "can_log")
                 rotate_at = recording_start_time + timedelta(minutes=20)
                 print(f"New log file created at {recording_start_time}")
 
-        except can.CanError as e:
-            print(f"CAN Error: {e}")
-            if recording and file:
-                file.close()
-                file = None
-                writer = None
-                recording = False
-                recording_start_time = None
-            # 重新連接兩個 CAN bus
-            try:
-                bus0 = connect_can('can0')
-                print("CAN0 connection restored")
-            except:
-                print("Failed to restore CAN0")
-            try:
-                bus1 = connect_can('can1')
-                print("CAN1 connection restored")
-            except:
-                print("Failed to restore CAN1")
         except Exception as e:
             print(f"Unexpected error: {e}")
             if recording and file:
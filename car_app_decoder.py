@@ -2,7 +2,7 @@ import can
 import struct
 import asyncio
 from fastapi import FastAPI, WebSocket, Request
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
@@ -15,6 +15,7 @@ from typing import List
 import csv
 import os
 from CanDecoder import CanDecoder
+from CanDelta import encode
 
 
 
@@ -373,7 +374,7 @@ class CanReceiverWebApp:
         disconnected = []
         for websocket in connections:
             try:
-                await websocket.send_text(json.dumps(broadcast_data))
+                await websocket.send_text(encode(broadcast_data))
             except:
                 disconnected.append(websocket)
         
@@ -457,7 +458,8 @@ async def dashboard(request: Request):
 async def get_data():
     if can_receiver:
         data_store = can_receiver.decoder.data_store
-        return {
+        # data_store 的 __slots__ 狀態與電芯 array 由 encode() 序列化成原本的 dict / list
+        return Response(encode({
             'timestamp': data_store['timestamp']['time'].isoformat() if data_store['timestamp']['time'] else None,
             'gps': data_store['gps'],
             'velocity': data_store['velocity'],
@@ -468,7 +470,7 @@ async def get_data():
             'canlogging': data_store['canlogging'],  # 新增 CAN Logging 狀態
             'message_count': can_receiver.decoder.message_count,
             'update_time': datetime.now().isoformat()
-        }
+        }), media_type='application/json')
     else:
         return {'error': 'CAN receiver not initialized'}
 
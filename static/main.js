@@ -8,9 +8,11 @@ class NTURTDashboard {
         
         // Data storage
         this.lastData = null;
+        this.deltaSeq = null; // seq of the last snapshot/delta merged into lastData
         this.torqueHistory = [];
         this.rpmHistory = [];
         this.maxHistoryPoints = 100;
+        this.historyStepMs = 50; // chart points arrive at most every 50 ms (inverters are pushed at 20 Hz)
         
         // Chart instances
         this.torqueChart = null;
@@ -52,23 +54,39 @@ class NTURTDashboard {
         this.closeWebSocket(); // Ensure any old connection is cleaned up first
 
         const protocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${protocol}://${window.location.host}/ws`;
+        // delta=1: full snapshot on connect, then only changed fields (see CanDelta.py)
+        // format=msgpack: binary frames, only when static/msgpack.js is loaded
+        const format = typeof MsgpackDecoder !== 'undefined' ? '&format=msgpack' : '';
+        const wsUrl = `${protocol}://${window.location.host}/ws?delta=1${format}`;
+        this.deltaSeq = null;
                 
         try {
             this.websocket = new WebSocket(wsUrl);
+            this.websocket.binaryType = 'arraybuffer';
             
             this.websocket.onopen = () => {
                 this.isConnected = true;
                 this.reconnectAttempts = 0;
                 this.updateConnectionStatus(true);
                 console.log('WebSocket connected');
+                // Only the sections this dashboard renders (GPS / IMU2 have their own pages)
+                this.websocket.send(JSON.stringify({
+                    type: 'subscribe',
+                    topics: ['accumulator', 'canlogging', 'inverters', 'playback_control', 'vcu', 'velocity']
+                }));
+                // Fill the charts (including the time we were disconnected) from the server history
+                this.loadChartHistory();
             };
             
             this.websocket.onmessage = (event) => {
                 try {
-                    const data = JSON.parse(event.data);
-                    this.lastData = data;
-                    this.updateDashboard(data);
+                    const message = typeof event.data === 'string'
+                        ? JSON.parse(event.data)
+                        : MsgpackDecoder.decode(event.data);
+                    const data = this.applyMessage(message);
+                    if (data) {
+                        this.updateDashboard(data);
+                    }
                 } catch (error) {
                     console.error('Error parsing WebSocket data:', error);
                 }
@@ -96,6 +114,43 @@ class NTURTDashboard {
         }
     }
 
+    // Returns the merged full state, or null if the message could not be applied
+    applyMessage(message) {
+        if (message.type === 'snapshot') {
+            this.lastData = message.data;
+            this.deltaSeq = message.seq;
+        } else if (message.type === 'delta') {
+            if (this.deltaSeq === null) {
+                return null; // waiting for a snapshot
+            }
+            if (message.seq !== this.deltaSeq + 1) {
+                console.warn(`Delta seq gap (${this.deltaSeq} -> ${message.seq}), requesting snapshot`);
+                this.deltaSeq = null;
+                this.websocket.send(JSON.stringify({ type: 'resync' }));
+                return null;
+            }
+            this.mergeDelta(this.lastData, message.changes);
+            this.deltaSeq = message.seq;
+        } else {
+            // Server without delta support: every message is a full snapshot
+            this.lastData = message;
+        }
+        return this.lastData;
+    }
+
+    mergeDelta(target, changes) {
+        for (const [key, value] of Object.entries(changes)) {
+            const current = target[key];
+            if (value !== null && typeof value === 'object' && !Array.isArray(value) &&
+                current !== null && typeof current === 'object') {
+                // Lists only carry changed elements: {"$i": {"17": 3.71}}
+                this.mergeDelta(current, '$i' in value ? value['$i'] : value);
+            } else {
+                target[key] = value;
+            }
+        }
+    }
+
     scheduleReconnect() {
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
             this.reconnectAttempts++;
@@ -702,6 +757,75 @@ class NTURTDashboard {
         }
     }
 
+    // Prefill the torque / RPM charts from the server-side ring buffers (/api/history, see CanHistory.py)
+    async loadChartHistory() {
+        const charts = [
+            [this.torqueChart, ['inverters.3.target_torque', 'inverters.4.target_torque',
+                                'inverters.3.torque', 'inverters.4.torque'], value => value],
+            [this.rpmChart, ['inverters.1.speed', 'inverters.2.speed',
+                             'inverters.3.speed', 'inverters.4.speed'], Math.abs]
+        ].filter(([chart]) => chart);
+        if (!charts.length) {
+            return;
+        }
+        const names = charts.flatMap(([, signals]) => signals);
+        const seconds = Math.ceil(this.maxHistoryPoints * this.historyStepMs / 1000) * 2;
+        try {
+            const response = await fetch(`/api/history?signals=${names.join(',')}&since=-${seconds}`);
+            const history = await response.json();
+            if (!history.signals) {
+                return;
+            }
+            charts.forEach(([chart, signals, transform]) => {
+                const rows = this.historyRows(history, signals);
+                if (!rows) {
+                    return;
+                }
+                chart.data.labels = rows.times.map(time => new Date(time).toLocaleTimeString());
+                chart.data.datasets.forEach((dataset, index) => {
+                    dataset.data = rows.columns[index].map(value => transform(value || 0));
+                });
+                chart.update('none');
+            });
+        } catch (error) {
+            console.error('Error loading chart history:', error);
+        }
+    }
+
+    // Aligns the signals on the sample times of the first one with data (at most one row
+    // per historyStepMs, last maxHistoryPoints rows), carrying each signal's last value forward
+    historyRows(history, signals) {
+        const series = signals.map(name => history.signals[name]);
+        const reference = series.find(item => item && item.t.length);
+        if (!reference) {
+            return null;
+        }
+        const times = [];
+        for (const time of reference.t) {
+            if (!times.length || time - times[times.length - 1] >= this.historyStepMs) {
+                times.push(time);
+            }
+        }
+        times.splice(0, Math.max(0, times.length - this.maxHistoryPoints));
+
+        const columns = series.map(item => {
+            const column = new Array(times.length).fill(null);
+            if (!item) {
+                return column;
+            }
+            let next = 0;
+            let value = null;
+            times.forEach((time, row) => {
+                while (next < item.t.length && item.t[next] <= time) {
+                    value = item.v[next++];
+                }
+                column[row] = value;
+            });
+            return column;
+        });
+        return { times: times.map(time => history.t0 * 1000 + time), columns };
+    }
+
     updateCharts(data) {
         const currentTime = data.timestamp ? new Date(data.timestamp).toLocaleTimeString() : new Date().toLocaleTimeString();
         
@@ -0,0 +1,132 @@
+// Minimal MessagePack decoder for /ws?format=msgpack (encoder: CanDelta.encode_msgpack)
+// Ext type 1 is a little-endian float32 array (cell voltages / temperatures);
+// it is decoded to a plain Array with NaN mapped back to null.
+const MsgpackDecoder = {
+    FLOAT32_ARRAY_EXT: 1,
+
+    // float32 carries ~7 significant digits: round the whole array to 7 digits of its
+    // largest element to drop the noise (3.5009999275 -> 3.501)
+    float32Scale(floats) {
+        let largest = 0;
+        for (const item of floats) {
+            if (Math.abs(item) > largest && Number.isFinite(item)) {
+                largest = Math.abs(item);
+            }
+        }
+        return largest ? 10 ** (6 - Math.floor(Math.log10(largest))) : 1;
+    },
+
+    decode(buffer) {
+        const bytes = buffer instanceof Uint8Array ? buffer : new Uint8Array(buffer);
+        const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+        const textDecoder = new TextDecoder();
+        let offset = 0;
+
+        const readStr = (length) => {
+            const end = offset + length;
+            // Short ASCII strings (map keys) are faster without TextDecoder
+            if (length <= 32) {
+                let value = '';
+                for (let i = offset; i < end; i++) {
+                    if (bytes[i] > 0x7f) {
+                        value = null;
+                        break;
+                    }
+                    value += String.fromCharCode(bytes[i]);
+                }
+                if (value !== null) {
+                    offset = end;
+                    return value;
+                }
+            }
+            const value = textDecoder.decode(bytes.subarray(offset, end));
+            offset = end;
+            return value;
+        };
+        const readBin = (length) => {
+            const value = bytes.slice(offset, offset + length);
+            offset += length;
+            return value;
+        };
+        const readArray = (length) => {
+            const value = new Array(length);
+            for (let i = 0; i < length; i++) {
+                value[i] = read();
+            }
+            return value;
+        };
+        const readMap = (length) => {
+            const value = {};
+            for (let i = 0; i < length; i++) {
+                const key = read();
+                value[key] = read();
+            }
+            return value;
+        };
+        const readExt = (length) => {
+            const type = view.getInt8(offset);
+            offset += 1;
+            if (type !== MsgpackDecoder.FLOAT32_ARRAY_EXT) {
+                return readBin(length);
+            }
+            const floats = new Float32Array(length / 4);
+            for (let i = 0; i < floats.length; i++) {
+                floats[i] = view.getFloat32(offset + i * 4, true);
+            }
+            const scale = MsgpackDecoder.float32Scale(floats);
+            const value = new Array(floats.length);
+            for (let i = 0; i < floats.length; i++) {
+                const item = floats[i];
+                value[i] = Number.isNaN(item) ? null : Math.round(item * scale) / scale;
+            }
+            offset += length;
+            return value;
+        };
+
+        const read = () => {
+            const type = bytes[offset++];
+            let value;
+            if (type <= 0x7f) return type;                              // positive fixint
+            if (type >= 0xe0) return type - 0x100;                      // negative fixint
+            if ((type & 0xf0) === 0x80) return readMap(type & 0x0f);    // fixmap
+            if ((type & 0xf0) === 0x90) return readArray(type & 0x0f);  // fixarray
+            if ((type & 0xe0) === 0xa0) return readStr(type & 0x1f);    // fixstr
+            switch (type) {
+                case 0xc0: return null;
+                case 0xc2: return false;
+                case 0xc3: return true;
+                case 0xc4: value = view.getUint8(offset); offset += 1; return readBin(value);
+                case 0xc5: value = view.getUint16(offset); offset += 2; return readBin(value);
+                case 0xc6: value = view.getUint32(offset); offset += 4; return readBin(value);
+                case 0xc7: value = view.getUint8(offset); offset += 1; return readExt(value);
+                case 0xc8: value = view.getUint16(offset); offset += 2; return readExt(value);
+                case 0xc9: value = view.getUint32(offset); offset += 4; return readExt(value);
+                case 0xca: value = view.getFloat32(offset); offset += 4; return value;
+                case 0xcb: value = view.getFloat64(offset); offset += 8; return value;
+                case 0xcc: value = view.getUint8(offset); offset += 1; return value;
+                case 0xcd: value = view.getUint16(offset); offset += 2; return value;
+                case 0xce: value = view.getUint32(offset); offset += 4; return value;
+                case 0xcf: value = Number(view.getBigUint64(offset)); offset += 8; return value;
+                case 0xd0: value = view.getInt8(offset); offset += 1; return value;
+                case 0xd1: value = view.getInt16(offset); offset += 2; return value;
+                case 0xd2: value = view.getInt32(offset); offset += 4; return value;
+                case 0xd3: value = Number(view.getBigInt64(offset)); offset += 8; return value;
+                case 0xd4: return readExt(1);
+                case 0xd5: return readExt(2);
+                case 0xd6: return readExt(4);
+                case 0xd7: return readExt(8);
+                case 0xd8: return readExt(16);
+                case 0xd9: value = view.getUint8(offset); offset += 1; return readStr(value);
+                case 0xda: value = view.getUint16(offset); offset += 2; return readStr(value);
+                case 0xdb: value = view.getUint32(offset); offset += 4; return readStr(value);
+                case 0xdc: value = view.getUint16(offset); offset += 2; return readArray(value);
+                case 0xdd: value = view.getUint32(offset); offset += 4; return readArray(value);
+                case 0xde: value = view.getUint16(offset); offset += 2; return readMap(value);
+                case 0xdf: value = view.getUint32(offset); offset += 4; return readMap(value);
+                default: throw new Error(`Unsupported MessagePack type 0x${type.toString(16)}`);
+            }
+        };
+
+        return read();
+    }
+};